@@ -0,0 +1,106 @@
+"""冷启动耗时：导入模块、创建主窗口、第一次绘制和其余面板创建完成的时间
+
+用法: python benchmarks/bench_startup.py [--runs 次数]
+每次测量都在新的进程和空的临时目录中进行（没有本地缓存），
+默认使用offscreen平台插件，不需要显示器。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+RUNS = 5
+TIMEOUT = 30  # 单次测量的超时（秒）
+
+STAGES = [
+    ("import", "导入"),
+    ("window", "创建窗口"),
+    ("paint", "第一次绘制"),
+    ("panels", "面板就绪"),
+]
+
+def measure(result_path):
+    # 在子进程中运行，各阶段距离开始导入的时间（毫秒）写入result_path
+    start = time.perf_counter()
+    import music_gui
+    imported = time.perf_counter()
+    
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtCore import QObject, QEvent
+    
+    class FirstPaint(QObject):
+        def __init__(self):
+            super().__init__()
+            self.time = None
+        
+        def eventFilter(self, obj, event):
+            if event.type() == QEvent.Paint and self.time is None:
+                self.time = time.perf_counter()
+            return False
+    
+    app = QApplication(sys.argv)
+    app.setStyle("Fusion")
+    window = music_gui.MusicPlayer()
+    created = time.perf_counter()
+    first_paint = FirstPaint()
+    window.installEventFilter(first_paint)
+    window.show()
+    
+    deadline = time.perf_counter() + TIMEOUT
+    while first_paint.time is None or window.visualizer is None:
+        if time.perf_counter() > deadline:
+            raise RuntimeError("窗口没有在规定时间内完成显示")
+        app.processEvents()
+    panels = time.perf_counter()
+    
+    result = {
+        "import": imported - start,
+        "window": created - start,
+        "paint": first_paint.time - start,
+        "panels": panels - start,
+    }
+    with open(result_path, "w") as f:
+        json.dump({name: value * 1000 for name, value in result.items()}, f)
+    window.close()
+
+def run_once():
+    # 每次使用新的工作目录，播放列表和缓存数据库都从空的开始
+    with tempfile.TemporaryDirectory() as workdir:
+        result_path = os.path.join(workdir, "result.json")
+        env = dict(os.environ)
+        env.setdefault("QT_QPA_PLATFORM", "offscreen")
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.path.abspath(ROOT), env.get("PYTHONPATH")]))
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable, os.path.abspath(__file__), "--measure", result_path],
+                                 cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                 timeout=TIMEOUT, text=True)
+        total = (time.perf_counter() - start) * 1000
+        if process.returncode != 0 or not os.path.exists(result_path):
+            raise RuntimeError(f"测量进程出错:\n{process.stderr}")
+        with open(result_path) as f:
+            result = json.load(f)
+    result["total"] = total
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=RUNS)
+    parser.add_argument("--measure", metavar="RESULT_PATH", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        measure(args.measure)
+        return
+    
+    results = [run_once() for _ in range(args.runs)]
+    print(f"{'阶段':>10} {'中位数(ms)':>12} {'最快(ms)':>10} {'最慢(ms)':>10}")
+    for name, title in STAGES + [("total", "进程总耗时")]:
+        values = [result[name] for result in results]
+        print(f"{title:>10} {statistics.median(values):>12.1f} {min(values):>10.1f} {max(values):>10.1f}")
+
+if __name__ == "__main__":
+    main()
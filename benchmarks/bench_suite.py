@@ -0,0 +1,293 @@
+"""热点路径的微基准：歌词解析和查找、可视化绘制、搜索结果转换、结果列表填充和请求地址拼接
+
+用法: python benchmarks/bench_suite.py [--output 结果.json] [--compare 基线.json] [--threshold 0.2]
+每项用timeit自动确定循环次数，重复多轮取中位数。--output把结果保存为JSON，
+--compare和之前保存的结果对比，变慢超过阈值的项目标为回归，此时退出码为1。
+默认使用offscreen平台插件，不需要显示器。冷启动耗时见bench_startup.py。
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import timeit
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+from PyQt5.QtWidgets import QApplication, QListView
+from PyQt5.QtGui import QImage
+from PyQt5.QtCore import QT_VERSION_STR, PYQT_VERSION_STR
+
+from music_engine import SEARCH_PAGE_SIZE, build_url, parse_backup_page, parse_lrc
+from music_gui import VisualizerWidget, LyricsWidget, SongListModel, SONG_LIST_BATCH_SIZE
+
+REPEAT = 7
+THRESHOLD = 0.2  # 中位数比基线慢20%以上算回归
+SEED = 2024  # 生成测试数据的随机种子，每次运行数据相同
+
+# 测试数据规模
+LRC_LINES = 3000  # 大歌词文件的行数，带翻译和逐字标记
+LOOKUP_STEP_MS = 50  # 播放时歌词刷新的间隔
+VISUALIZER_SIZE = (1280, 160)
+SONG_LIST_ROWS = 10000  # 滚动加载很多页之后的结果数
+SONG_LIST_SIZE = (900, 400)
+
+def make_lrc(lines):
+    # 生成带[offset:]、多个时间标签和<mm:ss.xx>逐字标记的LRC文本
+    rng = random.Random(SEED)
+    out = ["[ti:测试歌曲]", "[ar:测试歌手]", "[offset:+120]"]
+    time_ms = 0
+    for i in range(lines):
+        time_ms += rng.randint(1500, 4500)
+        stamp = f"[{time_ms // 60000:02d}:{time_ms // 1000 % 60:02d}.{time_ms % 1000 // 10:02d}]"
+        if i % 10 == 0:
+            # 副歌重复的歌词共用一行，写成多个时间标签
+            stamp += f"[{(time_ms + 90000) // 60000:02d}:{(time_ms + 90000) // 1000 % 60:02d}.00]"
+        words = [f"<{(time_ms + k * 300) // 60000:02d}:{(time_ms + k * 300) // 1000 % 60:02d}.{k * 3:02d}>词{k}"
+                 for k in range(rng.randint(4, 10))]
+        out.append(stamp + "".join(words))
+    return "\n".join(out)
+
+def make_backup_response(count):
+    # 备用API一页搜索结果的JSON文本
+    rng = random.Random(SEED)
+    songs = [{
+        "id": 100000 + i,
+        "name": f"歌曲{i}",
+        "artists": [{"id": rng.randint(1, 9999), "name": f"歌手{rng.randint(1, 500)}", "alias": []}],
+        "album": {"id": rng.randint(1, 99999), "name": f"专辑{rng.randint(1, 2000)}", "publishTime": 1500000000000},
+        "duration": rng.randint(120000, 360000),
+        "fee": rng.choice([0, 1, 8]),
+        "alias": [],
+        "mvid": 0,
+    } for i in range(count)]
+    return json.dumps({"code": 200, "result": {"songs": songs, "songCount": 5000, "hasMore": True}})
+
+def make_songs(count):
+    rng = random.Random(SEED)
+    return [{
+        "NAME": f"歌曲{i}",
+        "ARTIST": f"歌手{rng.randint(1, 500)}",
+        "ALBUM": f"专辑{rng.randint(1, 2000)}" if i % 3 else "",
+        "DC_TARGETID": str(100000 + i),
+        "API_TYPE": "backup" if i % 2 else None,
+    } for i in range(count)]
+
+class NoMoreResults:
+    # 结果列表模型只向引擎询问能否继续加载，基准中不触发加载
+    def can_fetch_more(self):
+        return False
+    
+    def fetch_more(self):
+        return False
+
+def bench_lyrics_parse():
+    text = make_lrc(LRC_LINES)
+    return lambda: parse_lrc(text)
+
+def bench_lyrics_set():
+    text = make_lrc(LRC_LINES)
+    widget = LyricsWidget()
+    return lambda: widget.set_lyrics(text)
+
+def lyrics_widget_times(step_ms):
+    widget = LyricsWidget()
+    widget.set_lyrics(make_lrc(LRC_LINES))
+    end = widget.times[-1] + 5000
+    return widget, list(range(0, end, step_ms))
+
+def bench_lyrics_playback():
+    # 按播放进度依次刷新，大多数调用不换行
+    widget, times = lyrics_widget_times(LOOKUP_STEP_MS)
+    def run():
+        for time_ms in times:
+            widget.update_display(time_ms)
+    return run
+
+def bench_lyrics_seek():
+    # 拖动进度条时的随机跳转
+    widget, times = lyrics_widget_times(LOOKUP_STEP_MS)
+    random.Random(SEED).shuffle(times)
+    times = times[:1000]
+    def run():
+        for time_ms in times:
+            widget.update_display(time_ms)
+    return run
+
+def bench_visualizer_update_simulated():
+    widget = VisualizerWidget()
+    return lambda: widget.update_values()
+
+def bench_visualizer_update_spectrum():
+    widget = VisualizerWidget()
+    values = np.random.default_rng(SEED).random(widget.bars)
+    return lambda: widget.update_values(values)
+
+def visualizer_frame(active):
+    widget = VisualizerWidget()
+    widget.resize(*VISUALIZER_SIZE)
+    if active:
+        widget.update_values(np.random.default_rng(SEED).random(widget.bars))
+    image = QImage(*VISUALIZER_SIZE, QImage.Format_ARGB32_Premultiplied)
+    def run():
+        widget.phase += 0.1
+        widget.render(image)
+    return run
+
+def bench_visualizer_paint_wave():
+    return visualizer_frame(active=False)
+
+def bench_visualizer_paint_bars():
+    return visualizer_frame(active=True)
+
+def bench_search_normalize():
+    # 包括JSON解码，和后台线程里拿到响应之后做的事情一致
+    text = make_backup_response(SEARCH_PAGE_SIZE)
+    return lambda: parse_backup_page(json.loads(text), 0)
+
+def song_list_view():
+    view = QListView()
+    view.setUniformItemSizes(True)
+    view.setLayoutMode(QListView.Batched)
+    view.setBatchSize(SONG_LIST_BATCH_SIZE)
+    view.resize(*SONG_LIST_SIZE)
+    model = SongListModel(NoMoreResults(), view)
+    view.setModel(model)
+    view.show()
+    image = QImage(*SONG_LIST_SIZE, QImage.Format_ARGB32_Premultiplied)
+    def refresh():
+        # 处理延迟的分批布局，再画出可见的行
+        QApplication.processEvents()
+        view.render(image)
+    return model, refresh
+
+def bench_song_list_new_search():
+    # 新的搜索替换整个列表，并画出第一屏
+    model, refresh = song_list_view()
+    batches = [make_songs(SEARCH_PAGE_SIZE), make_songs(SEARCH_PAGE_SIZE + 1)]
+    state = {"turn": 0}
+    def run():
+        state["turn"] ^= 1
+        model.set_results(batches[state["turn"]], True)
+        refresh()
+    return run
+
+def bench_song_list_append():
+    # 滚动加载到一万首之后再追加一批，只插入新行
+    model, refresh = song_list_view()
+    songs = make_songs(SONG_LIST_ROWS + SEARCH_PAGE_SIZE)
+    head, full = songs[:SONG_LIST_ROWS], songs
+    def run():
+        model.set_results(head, True)
+        model.set_results(full, True)
+        refresh()
+    return run
+
+def bench_build_url():
+    return lambda: build_url("周杰伦 晴天 live", 3)
+
+CASES = [
+    ("lyrics.parse", "解析大歌词文件", bench_lyrics_parse),
+    ("lyrics.set_lyrics", "歌词组件载入大歌词", bench_lyrics_set),
+    ("lyrics.playback", "顺序播放整首刷新歌词", bench_lyrics_playback),
+    ("lyrics.seek", "随机跳转1000次", bench_lyrics_seek),
+    ("visualizer.update_simulated", "模拟频谱更新", bench_visualizer_update_simulated),
+    ("visualizer.update_spectrum", "真实频谱更新", bench_visualizer_update_spectrum),
+    ("visualizer.paint_wave", "静态波形一帧", bench_visualizer_paint_wave),
+    ("visualizer.paint_bars", "柱状频谱一帧", bench_visualizer_paint_bars),
+    ("search.normalize_backup", "备用API一页结果转换", bench_search_normalize),
+    ("song_list.new_search", "新搜索填充列表", bench_song_list_new_search),
+    ("song_list.append", "一万首后追加一批", bench_song_list_append),
+    ("build_url", "拼接搜索地址", bench_build_url),
+]
+
+def measure(setup, repeat):
+    # 返回每次调用的耗时（毫秒）：中位数和最快的一轮
+    fn = setup()
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    times = [total / number * 1000 for total in timer.repeat(repeat, number)]
+    return {"median_ms": statistics.median(times), "min_ms": min(times), "number": number, "repeat": repeat}
+
+def environment():
+    return {
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "qt": QT_VERSION_STR,
+        "pyqt": PYQT_VERSION_STR,
+        "qpa": os.environ.get("QT_QPA_PLATFORM"),
+    }
+
+def compare(results, baseline, threshold):
+    # 返回变慢超过阈值的项目，基线中没有的项目不比较
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        ratio = result["median_ms"] / before["median_ms"]
+        result["baseline_ms"] = before["median_ms"]
+        result["ratio"] = ratio
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return regressions
+
+def format_time(ms):
+    return f"{ms * 1000:.2f}µs" if ms < 1 else f"{ms:.3f}ms"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--filter", default="", help="只运行名称包含该字符串的项目")
+    parser.add_argument("--output", help="结果保存到这个JSON文件")
+    parser.add_argument("--compare", metavar="BASELINE", help="和之前保存的JSON结果对比")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="中位数变慢超过这个比例算回归")
+    parser.add_argument("--list", action="store_true", help="列出所有项目")
+    args = parser.parse_args()
+    
+    cases = [case for case in CASES if args.filter in case[0]]
+    if args.list or not cases:
+        for name, title, _ in CASES:
+            print(f"{name:<30} {title}")
+        return 0 if args.list else 1
+    
+    app = QApplication(sys.argv)
+    app.setStyle("Fusion")
+    results = {}
+    for name, title, setup in cases:
+        results[name] = measure(setup, args.repeat)
+        results[name]["title"] = title
+    
+    regressions = []
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline["results"], args.threshold)
+    
+    print(f"{'项目':<30} {'中位数':>10} {'最快':>10} {'基线':>10} {'变化':>8}")
+    for name, result in results.items():
+        line = f"{name:<30} {format_time(result['median_ms']):>10} {format_time(result['min_ms']):>10}"
+        if "ratio" in result:
+            flag = "  回归" if name in regressions else ""
+            line += f" {format_time(result['baseline_ms']):>10} {(result['ratio'] - 1) * 100:>+7.1f}%{flag}"
+        print(line)
+    
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"environment": environment(), "threshold": args.threshold, "results": results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+    
+    if regressions:
+        print(f"{len(regressions)} 项比基线慢 {args.threshold:.0%} 以上: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
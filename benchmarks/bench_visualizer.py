@@ -0,0 +1,113 @@
+"""可视化组件每帧绘制耗时，对比优化前后的实现
+
+用法: python benchmarks/bench_visualizer.py
+默认使用offscreen平台插件，不需要显示器。
+"""
+import os
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtGui import QImage, QPainter, QColor, QLinearGradient, QBrush, QPen
+from PyQt5.QtCore import Qt, QPointF
+
+from music_gui import VisualizerWidget
+
+# 常见的窗口宽度和可视化区域高度
+SIZES = [(600, 100), (900, 120), (1280, 160), (1920, 200)]
+FRAMES = 200
+WARMUP_FRAMES = 10
+
+class LegacyVisualizer(VisualizerWidget):
+    # 优化前的绘制方式：逐点计算、逐段画线，每帧新建渐变
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        
+        gradient = QLinearGradient(0, 0, self.width(), 0)
+        gradient.setColorAt(0, QColor(26, 26, 46, 200))
+        gradient.setColorAt(0.5, QColor(40, 50, 78, 200))
+        gradient.setColorAt(1, QColor(26, 26, 46, 200))
+        painter.fillRect(self.rect(), gradient)
+        
+        if not self.active:
+            self.draw_static_wave(painter)
+        else:
+            self.draw_bars(painter)
+    
+    def draw_static_wave(self, painter):
+        width = self.width()
+        mid_height = self.height() / 2
+        
+        for wave in range(self.waves):
+            hue = 180 + 120 * (wave / self.waves)
+            painter.setPen(QPen(QColor.fromHsv(int(hue), 200, 250, 150), 2))
+            
+            points = []
+            amplitude = 15 - wave * 3
+            frequency = 0.02 + wave * 0.01
+            for x in range(0, width, 2):
+                y = mid_height + amplitude * np.sin(frequency * x + self.phase) * (0.8 + 0.2 * np.sin(frequency * x * 0.3))
+                points.append(QPointF(x, y))
+            
+            for i in range(len(points) - 1):
+                painter.drawLine(points[i], points[i + 1])
+    
+    def draw_bars(self, painter):
+        width = self.width()
+        height = self.height()
+        bar_width = width / self.bars
+        
+        for i in range(self.bars):
+            hue = int(250 * i / self.bars)
+            bar_color = QColor.fromHsv(hue, 220, 250)
+            gradient = QLinearGradient(0, height, 0, 0)
+            gradient.setColorAt(0, bar_color)
+            gradient.setColorAt(1, QColor.fromHsv(hue, 150, 250, 200))
+            painter.setBrush(QBrush(gradient))
+            painter.setPen(Qt.NoPen)
+            
+            variance = 0.1 * np.sin(self.phase * 0.2 + i * 0.1)
+            bar_height = max(3, (self.bar_values[i] + variance) * height * 0.8)
+            x = i * bar_width
+            y = height - bar_height
+            painter.drawRoundedRect(
+                int(x + bar_width * 0.1), int(y),
+                int(bar_width * 0.8), int(bar_height),
+                4, 4
+            )
+
+def frame_cost(widget, image):
+    # 返回每帧平均耗时（毫秒）
+    for _ in range(WARMUP_FRAMES):
+        widget.render(image)
+    start = time.perf_counter()
+    for _ in range(FRAMES):
+        widget.phase += 0.1
+        widget.render(image)
+    return (time.perf_counter() - start) / FRAMES * 1000
+
+def main():
+    app = QApplication(sys.argv)
+    print(f"{'尺寸':>10} {'模式':>6} {'优化前(ms)':>12} {'优化后(ms)':>12} {'加速':>6}")
+    for width, height in SIZES:
+        image = QImage(width, height, QImage.Format_ARGB32_Premultiplied)
+        for mode in ("wave", "bars"):
+            costs = []
+            for widget_class in (LegacyVisualizer, VisualizerWidget):
+                widget = widget_class()
+                widget.resize(width, height)
+                if mode == "bars":
+                    widget.update_values(np.random.rand(widget.bars))
+                # 先处理resize等待处理的事件，不算进绘制时间
+                app.processEvents()
+                costs.append(frame_cost(widget, image))
+            before, after = costs
+            print(f"{width:>5}x{height:<4} {mode:>6} {before:>12.3f} {after:>12.3f} {before / after:>5.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2731 @@
+import sys
+import argparse
+import importlib
+import importlib.util
+import urllib.parse
+import os
+import json
+import re
+import sqlite3
+import unicodedata
+import time
+import threading
+import shutil
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PyQt5.QtCore import QObject, QRunnable, QThread, QThreadPool, QTimer, pyqtSignal, pyqtSlot
+
+class LazyModule:
+    """第一次访问属性时才导入的模块，导入较慢又不是启动时就要用的依赖用它代替import"""
+    def __init__(self, name):
+        self._lazy_name = name
+    
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._lazy_name)
+        # 把模块的属性复制过来，之后的访问和普通模块一样快
+        self.__dict__.update(vars(module))
+        return getattr(module, attr)
+
+# requests导入需要近百毫秒，第一次联网时（通常是后台的连接预热）才导入
+requests = LazyModule("requests")
+
+# 本地搜索的拼音和繁简转换是可选功能，没有安装时只按原文匹配
+# pypinyin导入很慢，只检查是否安装，引擎启动后在后台导入
+pypinyin = LazyModule("pypinyin") if importlib.util.find_spec("pypinyin") else None
+
+# 繁简转换器创建时要加载词典，同样只检查是否安装，第一次使用时（或启动后在后台）创建
+opencc = LazyModule("opencc") if importlib.util.find_spec("opencc") else None
+TO_SIMPLIFIED = None
+TO_SIMPLIFIED_LOCK = threading.Lock()
+
+def simplified_converter():
+    """返回繁简转换器，没有安装opencc或创建失败时返回None"""
+    global TO_SIMPLIFIED, opencc
+    if TO_SIMPLIFIED is None and opencc is not None:
+        with TO_SIMPLIFIED_LOCK:
+            if TO_SIMPLIFIED is None and opencc is not None:
+                try:
+                    TO_SIMPLIFIED = opencc.OpenCC("t2s")
+                except Exception as e:
+                    print(f"繁简转换不可用: {str(e)}")
+                    opencc = None
+    return TO_SIMPLIFIED
+
+# 主API
+BASE_URL = "https://www.kuwo.cn/search/searchMusicBykeyWord"
+MP3_BASE_URL = "http://www.xintuo1.cn/music/kw/"
+
+# 备用API
+BACKUP_SEARCH_URL = "https://api.music.imsyy.top/search"
+BACKUP_SONG_URL = "https://api.music.imsyy.top/song/url"
+BACKUP_LYRIC_URL = "https://api.music.imsyy.top/lyric"
+
+# 歌词API
+KUWO_LYRIC_URL = "http://m.kuwo.cn/newh5/singles/songinfoandlrc"
+
+VIP_VER = "1"
+CLIENT = "kt"
+FT = "music"
+CLUSTER = "0"
+STRATEGY = "2012"
+ENCODING = "utf8"
+RFORMAT = "json"
+MOBI = "1"
+ISSUBTITLE = "1"
+SHOW_COPYRIGHT_OFF = "1"
+
+# 常量定义
+API_TIMEOUT = 15  # API请求超时时间（秒）
+SEARCH_WORKERS = 4  # 后台搜索线程数
+PLAYBACK_WORKERS = 4  # 播放时解析地址和获取歌词的线程数
+LYRICS_TIMEOUT = 8  # 歌词请求超时时间（秒）
+HTTP_POOL_SIZE = 8  # 每个上游保持的长连接数
+WARMUP_TIMEOUT = 5  # 启动预热连接的超时时间（秒）
+SEARCH_PAGE_SIZE = 100  # 每次向上游请求的歌曲数，结果列表滚动到底部时再请求下一页
+
+# 本地缓存
+CACHE_DIR = "cache"
+CACHE_DB_PATH = os.path.join(CACHE_DIR, "music.db")
+SEARCH_CACHE_MEMORY_ENTRIES = 64  # 内存中保留的搜索结果页数
+SEARCH_CACHE_DISK_ENTRIES = 2000  # 磁盘上保留的搜索结果页数
+SEARCH_CACHE_FRESH_TTL = 10 * 60  # 超过该时间的结果先显示，再在后台刷新（秒）
+SEARCH_CACHE_MAX_AGE = 7 * 24 * 3600  # 超过该时间的结果不再使用（秒）
+LYRICS_CACHE_MEMORY_ENTRIES = 100  # 内存中保留的歌词数
+LYRICS_CACHE_NEGATIVE_TTL = 3 * 24 * 3600  # "暂无歌词"的记录有效期（秒）
+
+# 播放列表
+QUEUE_LOAD_CHUNK = 500  # 启动时每次从数据库读取的播放列表条目数
+HISTORY_MEMORY = 200  # 内存中保留的播放历史条数，决定能后退多少首
+HISTORY_LIMIT = 5000  # 数据库中保留的播放历史条数
+
+# 本地音频缓存，播放时边听边写入，按最近使用时间淘汰
+AUDIO_CACHE_DIR = os.path.join(CACHE_DIR, "audio")
+AUDIO_CACHE_MAX_BYTES = 1024 * 1024 * 1024  # 缓存目录的总大小上限
+AUDIO_CACHE_STALE_PART = 60 * 60  # 超过这么久（秒）没有写入的临时文件才清理，其他进程可能正在写入
+AUDIO_PROXY_HOST = "127.0.0.1"  # 本地转发服务只监听回环地址
+
+# 边输入边搜索时发往上游的请求频率
+SEARCH_RATE = 1.0  # 自动搜索每秒最多向上游发出的请求数
+SEARCH_BURST = 3  # 允许短时间内连续发出的请求数
+
+# 音源健康检查和自动切换
+HEALTH_WINDOW = 50  # 计算成功率和延迟时保留的最近请求数
+HEALTH_MIN_SAMPLES = 10  # 样本数达到后才按成功率判断是否熔断
+HEALTH_MIN_SUCCESS_RATE = 0.5  # 成功率低于该值时熔断
+HEALTH_FAILURE_THRESHOLD = 3  # 连续失败多少次后熔断
+HEALTH_COOLDOWN = 30  # 熔断后多久开始后台探测（秒）
+HEALTH_COOLDOWN_MAX = 10 * 60  # 探测失败时冷却时间逐次加倍的上限（秒）
+HEALTH_CHECK_INTERVAL = 5000  # 检查是否需要探测、刷新状态显示的间隔（毫秒）
+HEALTH_PROBE_TERM = "晴天"  # 探测时使用的搜索词
+HEALTH_EXPORT_PATH = os.path.join(CACHE_DIR, "source_health.json")
+
+# 播放时多音源竞速解析
+RACE_PROBE_TIMEOUT = 3  # 检查音乐地址是否可用的超时时间（秒）
+
+# 本地搜索
+LOCAL_SEARCH_LIMIT = 10  # 搜索时最多显示多少条本地结果
+CJK_CHARS = "\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af\uf900-\ufaff"
+
+# 滚动加载预取
+PREFETCH_DEPTH = 1  # 每批结果加载后预取后面几页
+PREFETCH_WORKERS = 2  # 预取线程数，与搜索线程分开
+
+# 下载
+DOWNLOAD_DIR = "downloads"
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # 每次写入磁盘的块大小（字节）
+DOWNLOAD_RETRIES = 3  # 连接中断后的续传次数
+DOWNLOAD_WORKERS = 3  # 同时传输的下载数
+DOWNLOAD_RESOLVE_WORKERS = 2  # 同时解析下载地址的线程数
+DOWNLOAD_RESOLVE_AHEAD = 2  # 提前解析好、等待传输的条目数
+DOWNLOAD_MAX_ATTEMPTS = 3  # 下载失败后自动重试的次数上限
+DOWNLOAD_RETRY_DELAY = 5  # 第一次重试前的等待时间（秒），之后逐次加倍
+THROUGHPUT_WINDOW = 5  # 计算下载速度的时间窗口（秒）
+PROGRESS_INTERVAL = 0.2  # 下载进度信号的最小间隔（秒）
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+
+# 每个上游一个长连接池，默认请求头只在这里设置一次
+UPSTREAM_HEADERS = {
+    "kuwo": {"User-Agent": USER_AGENT, "Referer": "http://www.kuwo.cn/"},
+    "xintuo": {"User-Agent": USER_AGENT, "Referer": "http://www.kuwo.cn/", "Accept": "*/*"},
+    "imsyy": {"User-Agent": USER_AGENT, "Accept": "application/json"},
+    "media": {"User-Agent": USER_AGENT, "Accept": "*/*"},  # 真实音频文件所在的CDN
+}
+
+# 启动时在后台预先完成DNS解析和TLS握手
+WARMUP_URLS = [
+    ("kuwo", "https://www.kuwo.cn/"),
+    ("kuwo", "http://m.kuwo.cn/"),
+    ("xintuo", "http://www.xintuo1.cn/"),
+    ("imsyy", "https://api.music.imsyy.top/"),
+]
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def get_session(upstream):
+    # 同一上游的所有请求共用一个Session，复用已建立的连接
+    with _sessions_lock:
+        session = _sessions.get(upstream)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(UPSTREAM_HEADERS[upstream])
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[upstream] = session
+        return session
+
+def warm_up_connection(upstream, url):
+    # 预热失败不影响正常使用，真正的请求会重新建立连接
+    try:
+        get_session(upstream).head(url, timeout=WARMUP_TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        print(f"预热连接失败 {url}: {e}")
+
+class WorkerSignals(QObject):
+    # 后台任务通过信号把结果送回主线程，token用于丢弃过期的结果
+    finished = pyqtSignal(object, object)  # (token, 结果)
+    failed = pyqtSignal(object, object)  # (token, 异常)
+    progress = pyqtSignal(object, object)  # (token, 进度)
+
+class Worker(QRunnable):
+    """在QThreadPool中执行fn(*args, **kwargs)，不得在fn中操作任何控件"""
+    def __init__(self, token, fn, *args, **kwargs):
+        super().__init__()
+        self.token = token
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        self.cancelled = threading.Event()
+    
+    def with_progress(self):
+        # fn通过progress_callback关键字参数汇报进度
+        self.kwargs["progress_callback"] = self.report_progress
+        return self
+    
+    def report_progress(self, payload):
+        self.signals.progress.emit(self.token, payload)
+    
+    def cancel(self):
+        # 只能取消还没开始执行的任务，已经开始的由调用方按token忽略结果
+        self.cancelled.set()
+    
+    def run(self):
+        if self.cancelled.is_set():
+            return
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            self.signals.failed.emit(self.token, e)
+        else:
+            self.signals.finished.emit(self.token, result)
+
+def build_url(search, pn):
+    search_encoded = urllib.parse.quote(search)
+    return f"{BASE_URL}?vipver={VIP_VER}&client={CLIENT}&ft={FT}&cluster={CLUSTER}&strategy={STRATEGY}&encoding={ENCODING}&rformat={RFORMAT}&mobi={MOBI}&issubtitle={ISSUBTITLE}&show_copyright_off={SHOW_COPYRIGHT_OFF}&pn={pn}&rn={SEARCH_PAGE_SIZE}&all={search_encoded}"
+
+def fetch_main_page(search_term, page):
+    # 在后台线程中执行，只做网络请求和数据整理
+    url = build_url(search_term, page)
+    
+    print(f"搜索请求: {url}")
+    response = get_session("kuwo").get(url, timeout=API_TIMEOUT).json()
+    
+    if "abslist" not in response or "TOTAL" not in response:
+        raise Exception("API返回数据格式不正确")
+    
+    print(f"搜索结果: 找到 {response['TOTAL']} 首歌曲")
+    return {
+        "page": page,
+        "results": response["abslist"],
+        "total_pages": (int(response["TOTAL"]) + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE
+    }
+
+def fetch_backup_page(search_term, page):
+    params = {
+        "keywords": search_term,
+        "limit": SEARCH_PAGE_SIZE,
+        "offset": page * SEARCH_PAGE_SIZE
+    }
+    
+    print(f"备用API搜索请求: {BACKUP_SEARCH_URL}，参数: {params}")
+    response = get_session("imsyy").get(BACKUP_SEARCH_URL, params=params, timeout=API_TIMEOUT).json()
+    page_data = parse_backup_page(response, page)
+    print(f"备用API搜索结果: 找到 {response['result']['songCount']} 首歌曲")
+    return page_data
+
+def parse_backup_page(response, page):
+    # 备用API返回的JSON转换为与主API相同的格式，不做网络请求
+    if response["code"] != 200:
+        raise Exception(f"备用API返回错误: {response.get('msg', '未知错误')}")
+    
+    # 处理搜索结果
+    results = []
+    for item in response["result"]["songs"]:
+        # 转换为与主API相同的格式
+        results.append({
+            "NAME": item["name"],
+            "ARTIST": item["artists"][0]["name"],
+            "ALBUM": item["album"]["name"],
+            "DC_TARGETID": str(item["id"]),  # 使用歌曲ID
+            "API_TYPE": "backup"  # 标记为备用API
+        })
+    
+    # 计算总页数
+    total_count = response["result"]["songCount"]
+    return {
+        "page": page,
+        "results": results,
+        "total_pages": (total_count + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE
+    }
+
+class SongUnavailable(Exception):
+    """音源正常响应，但这首歌没有可用的资源，不计入音源的失败次数"""
+    pass
+
+def resolve_main_url(song_id):
+    # 主API先返回真实音乐链接的文本
+    mp3_url = MP3_BASE_URL + song_id
+    print(f"请求资源信息: {mp3_url}")
+    response = get_session("xintuo").get(mp3_url, timeout=API_TIMEOUT)
+    
+    if response.status_code != 200:
+        raise Exception(f"服务器返回错误代码: {response.status_code}")
+    
+    real_mp3_url = response.text.strip()
+    print(f"获取到真正的音乐链接: {real_mp3_url}")
+    return real_mp3_url
+
+def resolve_backup_url(song_id):
+    params = {"id": song_id}
+    print(f"请求备用API获取歌曲URL: {BACKUP_SONG_URL}?id={song_id}")
+    response = get_session("imsyy").get(BACKUP_SONG_URL, params=params, timeout=API_TIMEOUT).json()
+    
+    if response["code"] != 200:
+        raise Exception(f"获取歌曲URL失败: {response.get('msg', '未知错误')}")
+    
+    if not response["data"] or len(response["data"]) == 0:
+        raise SongUnavailable("未找到音乐资源")
+    
+    music_url = response["data"][0]["url"]
+    if not music_url:
+        raise SongUnavailable("此歌曲无法获取，可能需要VIP或版权受限")
+    
+    print(f"获取到音乐URL: {music_url}")
+    return music_url
+
+class SourceProvider:
+    """音源接口，新的音源实现这些方法后加入PROVIDERS即可
+    
+    search返回{"page", "results", "total_pages"}，results中每首歌至少包含
+    NAME、ARTIST、ALBUM和DC_TARGETID。所有方法都在后台线程中调用。
+    """
+    name = None  # 缓存和下载队列中使用的键
+    title = None  # 界面上显示的名称
+    referer = None  # 下载音频文件时需要的Referer
+    url_ttl = 0  # 解析出的音乐地址的有效期（秒），地址带有签名，过一段时间会失效
+    
+    def search(self, search_term, page):
+        raise NotImplementedError
+    
+    def resolve(self, song_id):
+        raise NotImplementedError
+    
+    def lyrics(self, song_id):
+        raise NotImplementedError
+    
+    def download_headers(self):
+        return {"Referer": self.referer} if self.referer else {}
+    
+    def download(self, url, target_path, cancelled, progress_callback=None):
+        return download_to_file(url, target_path, headers=self.download_headers(),
+                                progress_callback=progress_callback, cancelled=cancelled)
+
+class KuwoProvider(SourceProvider):
+    name = "main"
+    title = "默认音源"
+    referer = "http://www.kuwo.cn/"
+    url_ttl = 20 * 60
+    
+    def search(self, search_term, page):
+        return fetch_main_page(search_term, page)
+    
+    def resolve(self, song_id):
+        return resolve_main_url(song_id)
+    
+    def lyrics(self, song_id):
+        return fetch_main_lyrics(song_id)
+
+class ImsyyProvider(SourceProvider):
+    name = "backup"
+    title = "备用音源"
+    referer = "https://music.163.com/"
+    url_ttl = 10 * 60
+    
+    def search(self, search_term, page):
+        return fetch_backup_page(search_term, page)
+    
+    def resolve(self, song_id):
+        return resolve_backup_url(song_id)
+    
+    def lyrics(self, song_id):
+        return fetch_backup_lyrics(song_id)
+
+# 按顺序排列的音源，搜索时同时请求所有启用的音源
+PROVIDERS = {provider.name: provider for provider in (KuwoProvider(), ImsyyProvider())}
+
+def percentile(values, q):
+    # values已排序，取最接近的样本，不做插值
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+class SourceHealth:
+    """各音源最近请求的成功率、延迟分位数和熔断器
+    
+    熔断器关闭时正常请求；连续失败或成功率过低时打开，不再把搜索发往该音源；
+    冷却结束后进入半开状态，由后台探测决定恢复还是继续熔断，探测失败时冷却时间加倍。
+    所有方法都可以在后台线程中调用。
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self, sources, window=HEALTH_WINDOW):
+        self.samples = {source: deque(maxlen=window) for source in sources}  # (是否成功, 耗时)
+        self.state = {source: self.CLOSED for source in sources}
+        self.consecutive_failures = {source: 0 for source in sources}
+        self.opened_at = {source: 0.0 for source in sources}
+        self.cooldown = {source: HEALTH_COOLDOWN for source in sources}
+        self.totals = {source: {"requests": 0, "failures": 0, "trips": 0} for source in sources}
+        self.lock = threading.Lock()
+    
+    def record(self, source, ok, latency):
+        with self.lock:
+            samples = self.samples[source]
+            samples.append((ok, latency))
+            totals = self.totals[source]
+            totals["requests"] += 1
+            if ok:
+                self.consecutive_failures[source] = 0
+                if self.state[source] != self.CLOSED:
+                    self.state[source] = self.CLOSED
+                    self.cooldown[source] = HEALTH_COOLDOWN
+                    print(f"{PROVIDERS[source].title}已恢复")
+                return
+            
+            totals["failures"] += 1
+            self.consecutive_failures[source] += 1
+            if self.state[source] == self.HALF_OPEN:
+                self.cooldown[source] = min(self.cooldown[source] * 2, HEALTH_COOLDOWN_MAX)
+                self.trip(source)
+            elif self.state[source] == self.CLOSED:
+                success_rate = sum(1 for sample in samples if sample[0]) / len(samples)
+                if (self.consecutive_failures[source] >= HEALTH_FAILURE_THRESHOLD or
+                        (len(samples) >= HEALTH_MIN_SAMPLES and success_rate < HEALTH_MIN_SUCCESS_RATE)):
+                    self.trip(source)
+    
+    def trip(self, source):
+        # 调用方持有锁
+        self.state[source] = self.OPEN
+        self.opened_at[source] = time.monotonic()
+        self.totals[source]["trips"] += 1
+        print(f"{PROVIDERS[source].title}连续出错，暂停使用 {self.cooldown[source]} 秒")
+    
+    def available(self, source):
+        with self.lock:
+            return self.state[source] == self.CLOSED
+    
+    def due_probes(self):
+        """返回冷却结束、需要探测的音源，并把它们转为半开状态"""
+        now = time.monotonic()
+        due = []
+        with self.lock:
+            for source, state in self.state.items():
+                if state == self.OPEN and now - self.opened_at[source] >= self.cooldown[source]:
+                    self.state[source] = self.HALF_OPEN
+                    due.append(source)
+        return due
+    
+    def latency(self, source):
+        with self.lock:
+            latencies = sorted(latency for ok, latency in self.samples[source] if ok)
+        return percentile(latencies, 0.5)
+    
+    def rank(self, sources):
+        # 按成功请求的延迟中位数从低到高排列；还没有成功过的音源（包括只失败过的）排在后面，
+        # 它们之间保持原来的顺序
+        def key(source):
+            latency = self.latency(source)
+            return (latency is None, latency or 0.0)
+        return sorted(sources, key=key)
+    
+    def snapshot(self):
+        with self.lock:
+            report = {}
+            for source, samples in self.samples.items():
+                latencies = sorted(latency for ok, latency in samples if ok)
+                p50 = percentile(latencies, 0.5)
+                p95 = percentile(latencies, 0.95)
+                report[source] = dict(
+                    self.totals[source],
+                    state=self.state[source],
+                    success_rate=sum(1 for sample in samples if sample[0]) / len(samples) if samples else None,
+                    p50_ms=round(p50 * 1000) if p50 is not None else None,
+                    p95_ms=round(p95 * 1000) if p95 is not None else None,
+                    samples=len(samples),
+                    cooldown=self.cooldown[source],
+                )
+            return report
+    
+    def export(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({"time": time.time(), "sources": self.snapshot()}, file, ensure_ascii=False, indent=2)
+        return path
+
+SOURCE_HEALTH = SourceHealth(PROVIDERS)
+
+def call_source(source, method, *args):
+    # 所有搜索、解析和歌词请求都经过这里，记录耗时和结果
+    started = time.monotonic()
+    try:
+        result = getattr(PROVIDERS[source], method)(*args)
+    except SongUnavailable:
+        SOURCE_HEALTH.record(source, True, time.monotonic() - started)
+        raise
+    except Exception:
+        SOURCE_HEALTH.record(source, False, time.monotonic() - started)
+        raise
+    SOURCE_HEALTH.record(source, True, time.monotonic() - started)
+    return result
+
+def probe_source(source):
+    # 熔断冷却结束后的后台探测，结果由call_source记录
+    QThread.currentThread().setPriority(QThread.LowPriority)
+    try:
+        call_source(source, "search", HEALTH_PROBE_TERM, 0)
+    except Exception as e:
+        print(f"{PROVIDERS[source].title}探测失败: {str(e)}")
+
+class StreamUrlExpired(Exception):
+    """音乐地址返回403/404，通常是签名已经过期"""
+    pass
+
+class StreamUrlCache:
+    """解析后的音乐地址缓存，键为(音源, 歌曲id)，播放、下载和预取共用
+    
+    地址只保存在内存中，按音源设置有效期。同一首歌同时有多个解析请求时，
+    后来的请求等待第一个完成后直接使用它的结果。
+    """
+    def __init__(self):
+        self.entries = {}  # key -> (url, expires_at)
+        self.resolving = {}  # key -> 正在解析时持有的锁
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+    
+    def peek(self, source, song_id):
+        """返回未过期的地址，没有时返回None，不计入命中率"""
+        key = (source, song_id)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                self.entries.pop(key, None)
+                return None
+            return entry[0]
+    
+    def lookup(self, source, song_id):
+        """播放时查找地址，命中时计入命中率；未命中时返回None，由随后的resolve计为未命中"""
+        url = self.peek(source, song_id)
+        if url is not None:
+            self.record(True, hit=True)
+        return url
+    
+    def put(self, source, song_id, url):
+        with self.lock:
+            self.entries[(source, song_id)] = (url, time.monotonic() + PROVIDERS[source].url_ttl)
+    
+    def invalidate(self, source, song_id, url=None):
+        # 指定url时只在缓存的仍是这个地址时删除，避免删掉刚解析出的新地址
+        with self.lock:
+            entry = self.entries.get((source, song_id))
+            if entry is not None and (url is None or entry[0] == url):
+                del self.entries[(source, song_id)]
+                self.invalidations += 1
+                print(f"音乐地址已失效: {source}/{song_id}")
+    
+    def resolve(self, source, song_id, count=True):
+        # 在后台线程中调用，缓存未命中时请求上游。每次调用计一次命中或未命中，
+        # 后台预取时count为False，只选中没有播放的歌曲不影响命中率
+        url = self.peek(source, song_id)
+        if url is not None:
+            self.record(count, hit=True)
+            return url
+        
+        key = (source, song_id)
+        with self.lock:
+            key_lock = self.resolving.setdefault(key, threading.Lock())
+        with key_lock:
+            url = self.peek(source, song_id)
+            if url is not None:
+                self.record(count, hit=True)
+                return url
+            self.record(count, hit=False)
+            try:
+                url = call_source(source, "resolve", song_id)
+                self.put(source, song_id, url)
+                return url
+            finally:
+                with self.lock:
+                    self.resolving.pop(key, None)
+    
+    def record(self, count, hit):
+        if not count:
+            return
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+    
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self.entries),
+            }
+
+def prefetch_stream_url(url_cache, source, song_id):
+    # 选中歌曲时提前解析地址，双击播放时直接命中缓存
+    QThread.currentThread().setPriority(QThread.LowPriority)
+    try:
+        url_cache.resolve(source, song_id, count=False)
+    except Exception as e:
+        print(f"预解析音乐地址失败: {str(e)}")
+
+def song_file_name(song_name):
+    # 列表中的名称为"歌名 - 歌手 - 专辑"，保存为"歌手 - 歌名.mp3"
+    parts = song_name.split(' - ', 1)
+    song_title = parts[0]
+    if len(parts) > 1:
+        artist = parts[1].split(' - ')[0]
+        file_name = f"{artist} - {song_title}.mp3"
+    else:
+        file_name = f"{song_title}.mp3"
+    return "".join(c for c in file_name if c.isalnum() or c in (" ", ".", "_", "-")).rstrip()
+
+class DownloadCancelled(Exception):
+    pass
+
+CONTENT_RANGE = re.compile(r"bytes (\d+)-\d+/(\d+|\*)")
+UNSATISFIED_RANGE = re.compile(r"bytes \*/(\d+)")  # 416响应中的文件总长度
+
+def read_resume_info(part_path):
+    """返回.part文件可以续传的(字节数, 校验信息)，没有记录或记录与文件不符时返回(0, None)
+    
+    校验信息保存在.part.json中：服务器给出的ETag或Last-Modified，以及文件总长度。
+    """
+    if not os.path.exists(part_path):
+        return 0, None
+    try:
+        with open(part_path + ".json", encoding="utf-8") as file:
+            info = json.load(file)
+        done = os.path.getsize(part_path)
+    except (OSError, ValueError):
+        return 0, None
+    if not info.get("total") or done > info["total"]:
+        return 0, None
+    return done, info
+
+def discard_partial(part_path):
+    for path in (part_path, part_path + ".json"):
+        if os.path.exists(path):
+            os.remove(path)
+
+def response_validator(response):
+    # 弱ETag不能用于If-Range，这时改用Last-Modified
+    etag = response.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return response.headers.get("Last-Modified")
+
+def download_to_file(url, target_path, headers=None, progress_callback=None, cancelled=None):
+    """分块写入target_path.part，断线后用Range续传，完整后才重命名为target_path
+    
+    续传时带上If-Range，并检查Content-Range的起点和总长度；服务器上的文件已经
+    不是同一个（例如重新解析后的地址换了码率）时从头下载，不会把两个文件拼在一起。
+    """
+    part_path = target_path + ".part"
+    session = get_session("media")
+    
+    attempt = 0
+    while True:
+        done, info = read_resume_info(part_path)
+        request_headers = dict(headers or {})
+        # 续传需要按原始字节计算偏移，不接受压缩编码
+        request_headers["Accept-Encoding"] = "identity"
+        if done:
+            request_headers["Range"] = f"bytes={done}-"
+            if info.get("validator"):
+                request_headers["If-Range"] = info["validator"]
+        
+        try:
+            with session.get(url, headers=request_headers, stream=True, timeout=API_TIMEOUT) as response:
+                if response.status_code == 416 and done:
+                    match = UNSATISFIED_RANGE.match(response.headers.get("Content-Range", ""))
+                    if done == info["total"] and (match is None or int(match.group(1)) == done):
+                        # 上次已经下载完整，只是没来得及重命名
+                        break
+                    print(f"续传位置无效，重新下载: {target_path}")
+                    discard_partial(part_path)
+                    continue
+                if response.status_code in (403, 404):
+                    raise StreamUrlExpired(f"音乐地址已失效，状态码: {response.status_code}")
+                if response.status_code not in (200, 206):
+                    raise Exception(f"下载失败，状态码: {response.status_code}")
+                
+                length = int(response.headers.get("Content-Length", 0))
+                if response.status_code == 206:
+                    match = CONTENT_RANGE.match(response.headers.get("Content-Range", ""))
+                    total = int(match.group(2)) if match and match.group(2) != "*" else 0
+                    if done and (not match or int(match.group(1)) != done or total != info["total"]):
+                        print(f"服务器返回的内容与已下载的部分不一致，重新下载: {target_path}")
+                        discard_partial(part_path)
+                        continue
+                    total = total or done + length
+                else:
+                    # 服务器不支持续传，或者文件已经改变，从头开始
+                    done = 0
+                    total = length
+                
+                if not done:
+                    # 记录校验信息，之后续传时用来确认还是同一个文件
+                    with open(part_path + ".json", "w", encoding="utf-8") as file:
+                        json.dump({"validator": response_validator(response), "total": total}, file)
+                
+                # 先报告续传的起点，之后的进度只包含这次传输的字节
+                if progress_callback:
+                    progress_callback((done, total))
+                last_report = time.monotonic()
+                with open(part_path, "ab" if done else "wb") as file:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        if cancelled is not None and cancelled.is_set():
+                            # 已写入的部分保留在.part文件中，下次启动时续传
+                            raise DownloadCancelled("下载已取消")
+                        file.write(chunk)
+                        done += len(chunk)
+                        now = time.monotonic()
+                        if progress_callback and now - last_report >= PROGRESS_INTERVAL:
+                            progress_callback((done, total))
+                            last_report = now
+                
+                if total and done < total:
+                    raise requests.exceptions.ConnectionError(f"连接中断，已下载 {done}/{total} 字节")
+            break
+        except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                requests.exceptions.Timeout) as e:
+            if attempt == DOWNLOAD_RETRIES:
+                raise
+            attempt += 1
+            print(f"下载中断，准备续传: {e}")
+    
+    if progress_callback:
+        progress_callback((done, done))
+    os.replace(part_path, target_path)
+    discard_partial(part_path)
+    print(f"下载完成，共 {done} 字节: {target_path}")
+    return target_path
+
+def transfer_song(source, url, target_path, cancelled, progress_callback=None):
+    os.makedirs(os.path.dirname(target_path) or ".", exist_ok=True)
+    return PROVIDERS[source].download(url, target_path, cancelled, progress_callback)
+
+def fetch_page(cache, source, search_term, page):
+    # 请求成功的结果先写入缓存，再交给主线程显示
+    page_data = call_source(source, "search", search_term, page)
+    cache.put(source, search_term, page, page_data)
+    return page_data
+
+def prefetch_page(cache, cancelled, source, search_term, page):
+    # 预取线程以低优先级运行，搜索词改变后还没开始的请求直接放弃
+    QThread.currentThread().setPriority(QThread.LowPriority)
+    if cancelled.is_set() or cache.has_fresh(source, search_term, page):
+        return
+    try:
+        fetch_page(cache, source, search_term, page)
+        print(f"已预取第 {page + 1} 页")
+    except Exception as e:
+        print(f"预取第 {page + 1} 页失败: {str(e)}")
+
+def split_song_name(song_name):
+    # 列表中的名称为"歌名 - 歌手 - 专辑"，歌名本身含有" - "时分不准，只在本地索引中没有这首歌时使用
+    parts = song_name.split(' - ')
+    return parts[0], parts[1] if len(parts) > 1 else ""
+
+def find_on_source(cache, source, title, artist):
+    """在另一个音源中按歌名和歌手查找同一首歌，返回歌曲id，找不到时返回None"""
+    search_term = f"{title} {artist}".strip()
+    page_data, stale = cache.get(source, search_term, 0)
+    if page_data is None:
+        page_data = fetch_page(cache, source, search_term, 0)
+    key = (fold_text(title), fold_text(artist))
+    for result in page_data["results"]:
+        if result_key(result) == key:
+            return result["DC_TARGETID"]
+    return None
+
+def probe_stream_url(source, url):
+    # 只请求前两个字节，确认地址确实可以播放
+    headers = dict(PROVIDERS[source].download_headers(), **{"Range": "bytes=0-1", "Accept-Encoding": "identity"})
+    with get_session("media").get(url, headers=headers, stream=True, timeout=RACE_PROBE_TIMEOUT) as response:
+        if response.status_code in (403, 404):
+            raise StreamUrlExpired(f"音乐地址已失效，状态码: {response.status_code}")
+        if response.status_code not in (200, 206):
+            raise Exception(f"音乐地址不可用，状态码: {response.status_code}")
+
+class RaceStats:
+    """多音源竞速的统计：各音源胜出的次数、比原音源节省的时间、原音源失败时救回的次数"""
+    def __init__(self, sources):
+        self.races = 0
+        self.wins = {source: 0 for source in sources}
+        self.saved = {source: 0.0 for source in sources}  # 秒
+        self.rescued = {source: 0 for source in sources}
+        self.lock = threading.Lock()
+    
+    def record_race(self):
+        with self.lock:
+            self.races += 1
+    
+    def record_win(self, source):
+        with self.lock:
+            self.wins[source] += 1
+    
+    def record_saved(self, source, seconds):
+        with self.lock:
+            self.saved[source] += max(seconds, 0.0)
+    
+    def record_rescued(self, source):
+        with self.lock:
+            self.rescued[source] += 1
+    
+    def stats(self):
+        with self.lock:
+            return {
+                source: {
+                    "wins": wins,
+                    "win_rate": wins / self.races if self.races else 0.0,
+                    "saved_ms": round(self.saved[source] * 1000),
+                    "rescued": self.rescued[source],
+                }
+                for source, wins in self.wins.items()
+            }
+
+class StreamRace:
+    """一次播放的竞速：第一个拿到可用地址的音源胜出，其余音源在下一步之前放弃"""
+    def __init__(self, primary, stats):
+        self.primary = primary  # 用户选择的歌曲所在的音源
+        self.stats = stats
+        self.started = time.monotonic()
+        self.won = threading.Event()
+        self.winner = None
+        self.win_elapsed = None
+        self.primary_failed = False
+        self.lock = threading.Lock()
+        stats.record_race()
+    
+    def claim(self, source):
+        with self.lock:
+            if self.winner is not None:
+                return False
+            self.winner = source
+            self.win_elapsed = time.monotonic() - self.started
+            self.won.set()
+        self.stats.record_win(source)
+        if self.primary_failed:
+            self.stats.record_rescued(source)
+        return True
+    
+    def primary_done(self, ok):
+        # 原音源输给其他音源后仍然完成正在进行的解析，用它的耗时计算节省的时间
+        elapsed = time.monotonic() - self.started
+        with self.lock:
+            if not ok:
+                self.primary_failed = True
+            winner, win_elapsed = self.winner, self.win_elapsed
+        if winner is None or winner == self.primary:
+            return
+        if ok:
+            self.stats.record_saved(winner, elapsed - win_elapsed)
+        else:
+            self.stats.record_rescued(winner)
+
+def race_candidate(race, url_cache, search_cache, source, song_id, title, artist):
+    """在后台线程中为一个音源解析地址，胜出时返回(音源, 歌曲id, 地址)，落后时返回None
+    
+    其他音源的song_id为None，先按歌名title和歌手artist查找。每一步之前检查是否已经有音源胜出；
+    已经发出的请求无法中止，原音源的地址解析总会完成，结果留在地址缓存中。
+    """
+    primary = source == race.primary
+    try:
+        if song_id is None:
+            song_id = find_on_source(search_cache, source, title, artist)
+            if song_id is None:
+                raise SongUnavailable(f"{PROVIDERS[source].title}中没有找到这首歌")
+            if race.won.is_set():
+                return None
+        url = url_cache.resolve(source, song_id)
+        if race.won.is_set():
+            if primary:
+                race.primary_done(True)
+            return None
+        probe_stream_url(source, url)
+    except Exception:
+        if primary:
+            race.primary_done(False)
+        raise
+    if race.claim(source):
+        return (source, song_id, url)
+    if primary:
+        race.primary_done(True)
+    return None
+
+class RateLimiter:
+    """令牌桶限速，每秒补充rate个令牌，最多积累burst个"""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+    
+    def try_acquire(self):
+        """取到令牌时返回0，否则返回需要等待的秒数"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+def filter_results(results, search_term):
+    # 用较短关键词的缓存结果临时显示时，只保留包含所有关键词的歌曲
+    words = fold_text(search_term).split()
+    return [result for result in results
+            if all(word in fold_text(f'{result["NAME"]} {result.get("ARTIST", "")} {result.get("ALBUM", "")}')
+                   for word in words)]
+
+def result_key(result):
+    # 不同音源的同一首歌按规范化的歌名和歌手合并
+    return (fold_text(result["NAME"]), fold_text(result.get("ARTIST", "")))
+
+def normalize_term(term):
+    # 全角/半角、大小写和多余空格不同的关键词视为同一个搜索
+    return " ".join(unicodedata.normalize("NFKC", term).casefold().split())
+
+CJK_CHAR = re.compile(f"[{CJK_CHARS}]")
+CJK_SEGMENT = re.compile(f"[{CJK_CHARS}]+|[^{CJK_CHARS}]+")
+
+def fold_text(text):
+    # 规范化后统一为简体，繁体和简体写法可以互相搜到
+    text = normalize_term(text)
+    converter = simplified_converter()
+    if converter is not None:
+        text = converter.convert(text)
+    return text
+
+def index_text(text):
+    # 全文索引按空白分词，中日韩文字逐字分开才能搜到词中间的部分
+    return " ".join(CJK_CHAR.sub(lambda match: f" {match.group(0)} ", fold_text(text)).split())
+
+def pinyin_keys(text):
+    # 全拼的每个音节、连写的全拼和首字母，例如"zhou jie lun zhoujielun zjl"
+    if pypinyin is None:
+        return ""
+    syllables = [syllable for syllable in pypinyin.lazy_pinyin(fold_text(text), errors="ignore") if syllable]
+    if not syllables:
+        return ""
+    return " ".join(syllables + ["".join(syllables), "".join(syllable[0] for syllable in syllables)])
+
+def build_match_query(query):
+    # 中日韩文字作为短语匹配，其他部分按前缀匹配
+    terms = []
+    for word in fold_text(query).replace('"', " ").split():
+        for segment in CJK_SEGMENT.findall(word):
+            if CJK_CHAR.match(segment):
+                terms.append('"' + " ".join(segment) + '"')
+            else:
+                terms.append(f'"{segment}"*')
+    return " ".join(terms)
+
+class LocalStore:
+    """本地SQLite数据库，所有缓存共用一个连接，可以在后台线程中使用"""
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+    
+    def execute(self, sql, params=()):
+        with self.lock, self.conn:
+            return self.conn.execute(sql, params).fetchall()
+    
+    def insert(self, sql, params=()):
+        # 返回新插入行的rowid
+        with self.lock, self.conn:
+            return self.conn.execute(sql, params).lastrowid
+    
+    def executemany(self, sql, seq):
+        with self.lock, self.conn:
+            self.conn.executemany(sql, seq)
+    
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class SearchCache:
+    """搜索结果缓存，键为(音源, 规范化关键词, 页码, 每页歌曲数)
+    
+    内存中是有上限的LRU，磁盘上的记录在重启后仍然有效。get返回的结果
+    超过fresh_ttl时标记为过期，调用方可以先显示再到后台刷新。内存命中的访问
+    时间先记下来，写入新记录和退出时批量更新到磁盘，磁盘上的LRU不会删掉常用的记录。
+    """
+    def __init__(self, store, memory_entries=SEARCH_CACHE_MEMORY_ENTRIES,
+                 disk_entries=SEARCH_CACHE_DISK_ENTRIES, fresh_ttl=SEARCH_CACHE_FRESH_TTL,
+                 max_age=SEARCH_CACHE_MAX_AGE):
+        self.store = store
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.fresh_ttl = fresh_ttl
+        self.max_age = max_age
+        self.memory = OrderedDict()  # key -> (page_data, stored_at)
+        self.touched = {}  # 内存命中后还没写到磁盘的访问时间，磁盘键 -> 时间
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        
+        store.execute("""
+            CREATE TABLE IF NOT EXISTS search_cache (
+                key TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                stored_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        store.execute("CREATE INDEX IF NOT EXISTS search_cache_accessed ON search_cache (accessed_at)")
+    
+    def make_key(self, source, search_term, page):
+        # 每页的歌曲数改变后，旧的记录对应的是别的范围，不能再用
+        return (source, normalize_term(search_term), page, SEARCH_PAGE_SIZE)
+    
+    def get(self, source, search_term, page):
+        """返回(page_data, 是否过期)，未命中时返回(None, False)"""
+        key = self.make_key(source, search_term, page)
+        now = time.time()
+        
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                self.memory.move_to_end(key)
+                self.touched[json.dumps(key, ensure_ascii=False)] = now
+        
+        if entry is None:
+            disk_key = json.dumps(key, ensure_ascii=False)
+            rows = self.store.execute("SELECT data, stored_at FROM search_cache WHERE key = ?", (disk_key,))
+            if rows:
+                entry = (json.loads(rows[0][0]), rows[0][1])
+                self.store.execute("UPDATE search_cache SET accessed_at = ? WHERE key = ?", (now, disk_key))
+                self._remember(key, entry)
+        
+        with self.lock:
+            if entry is None or now - entry[1] > self.max_age:
+                self.misses += 1
+                return None, False
+            
+            stale = now - entry[1] > self.fresh_ttl
+            self.hits += 1
+            if stale:
+                self.stale_hits += 1
+            return entry[0], stale
+    
+    def lookup_prefix(self, source, search_term, page=0):
+        """返回内存中最长的前缀关键词的结果，不计入命中统计"""
+        term = normalize_term(search_term)
+        now = time.time()
+        with self.lock:
+            for length in range(len(term) - 1, 0, -1):
+                entry = self.memory.get(self.make_key(source, term[:length], page))
+                if entry is not None and now - entry[1] <= self.max_age:
+                    return entry[0]
+        return None
+    
+    def has_fresh(self, source, search_term, page):
+        # 只检查是否有未过期的记录，不计入命中统计
+        key = self.make_key(source, search_term, page)
+        with self.lock:
+            entry = self.memory.get(key)
+        if entry is not None:
+            stored_at = entry[1]
+        else:
+            rows = self.store.execute("SELECT stored_at FROM search_cache WHERE key = ?",
+                                      (json.dumps(key, ensure_ascii=False),))
+            if not rows:
+                return False
+            stored_at = rows[0][0]
+        return time.time() - stored_at <= self.fresh_ttl
+    
+    def put(self, source, search_term, page, page_data):
+        key = self.make_key(source, search_term, page)
+        disk_key = json.dumps(key, ensure_ascii=False)
+        now = time.time()
+        self._remember(key, (page_data, now))
+        with self.lock:
+            self.touched.pop(disk_key, None)
+        
+        self.store.execute(
+            "INSERT OR REPLACE INTO search_cache (key, data, stored_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (disk_key, json.dumps(page_data, ensure_ascii=False), now, now)
+        )
+        # 超出上限时删除最久未使用的记录，先写入内存命中的访问时间
+        self.flush_access_times()
+        self.store.execute(
+            "DELETE FROM search_cache WHERE key IN "
+            "(SELECT key FROM search_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.disk_entries,)
+        )
+    
+    def flush_access_times(self):
+        with self.lock:
+            touched, self.touched = self.touched, {}
+        if touched:
+            self.store.executemany("UPDATE search_cache SET accessed_at = ? WHERE key = ?",
+                                   [(accessed_at, disk_key) for disk_key, accessed_at in touched.items()])
+    
+    def _remember(self, key, entry):
+        with self.lock:
+            self.memory[key] = entry
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_entries:
+                self.memory.popitem(last=False)
+    
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "memory_entries": len(self.memory),
+            }
+
+class AudioCache:
+    """本地音频文件缓存，键为(音源, 歌曲id)
+    
+    只有完整收到的文件才会加入索引，写入过程中使用.part临时文件。总大小
+    超过上限时删除最久未播放的文件。
+    """
+    def __init__(self, store, directory=AUDIO_CACHE_DIR, max_bytes=AUDIO_CACHE_MAX_BYTES):
+        self.store = store
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        os.makedirs(directory, exist_ok=True)
+        
+        store.execute("""
+            CREATE TABLE IF NOT EXISTS audio_cache (
+                source TEXT NOT NULL,
+                song_id TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (source, song_id)
+            )
+        """)
+        
+        # 清理上次退出时没写完的文件和已经不存在的记录；缓存目录可能由多个进程共用
+        # （例如播放器运行时使用命令行），最近还在写入的临时文件保留
+        now = time.time()
+        for name in os.listdir(directory):
+            if not name.endswith(".part"):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                if now - os.path.getmtime(path) > AUDIO_CACHE_STALE_PART:
+                    os.remove(path)
+            except OSError:
+                pass
+        for source, song_id, path in store.execute("SELECT source, song_id, path FROM audio_cache"):
+            if not os.path.exists(path):
+                store.execute("DELETE FROM audio_cache WHERE source = ? AND song_id = ?", (source, song_id))
+    
+    def file_path(self, source, song_id):
+        safe_id = "".join(c if c.isalnum() else "_" for c in str(song_id))
+        return os.path.join(self.directory, f"{source}_{safe_id}.mp3")
+    
+    def lookup(self, source, song_id):
+        """返回缓存文件的路径和大小，没有时返回None，不计入命中统计"""
+        rows = self.store.execute("SELECT path, size FROM audio_cache WHERE source = ? AND song_id = ?",
+                                  (source, song_id))
+        if not rows or not os.path.exists(rows[0][0]):
+            return None
+        return rows[0]
+    
+    def open(self, source, song_id):
+        """播放时调用，命中时返回本地文件路径并更新使用时间"""
+        entry = self.lookup(source, song_id)
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.bytes_saved += entry[1]
+        self.touch(source, song_id)
+        return entry[0]
+    
+    def touch(self, source, song_id):
+        self.store.execute("UPDATE audio_cache SET accessed_at = ? WHERE source = ? AND song_id = ?",
+                           (time.time(), source, song_id))
+    
+    def begin_write(self, source, song_id):
+        # 每个写入使用单独的临时文件，同一首歌同时被请求（包括其他进程）时互不影响
+        part_path = f"{self.file_path(source, song_id)}.{os.getpid()}.{threading.get_ident()}.part"
+        return open(part_path, "wb"), part_path
+    
+    def finish_write(self, source, song_id, part_path):
+        path = self.file_path(source, song_id)
+        os.replace(part_path, path)
+        self.store.execute(
+            "INSERT OR REPLACE INTO audio_cache (source, song_id, path, size, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (source, song_id, path, os.path.getsize(path), time.time())
+        )
+        print(f"已缓存音频: {path}")
+        self.evict()
+    
+    def abort_write(self, part_path):
+        try:
+            os.remove(part_path)
+        except OSError:
+            pass
+    
+    def remove(self, source, song_id):
+        entry = self.lookup(source, song_id)
+        self.store.execute("DELETE FROM audio_cache WHERE source = ? AND song_id = ?", (source, song_id))
+        if entry is not None:
+            try:
+                os.remove(entry[0])
+            except OSError:
+                pass
+    
+    def evict(self):
+        # 从最久未使用的文件开始删除，直到总大小不超过上限
+        rows = self.store.execute("SELECT source, song_id, path, size FROM audio_cache ORDER BY accessed_at DESC")
+        total = 0
+        for source, song_id, path, size in rows:
+            total += size
+            if total > self.max_bytes:
+                self.store.execute("DELETE FROM audio_cache WHERE source = ? AND song_id = ?", (source, song_id))
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                print(f"音频缓存已满，删除: {path}")
+    
+    def export(self, source, song_id, target_path):
+        """下载已缓存的歌曲时直接建立硬链接，不支持时复制文件"""
+        entry = self.lookup(source, song_id)
+        if entry is None:
+            raise Exception("缓存文件不存在")
+        path, size = entry
+        os.makedirs(os.path.dirname(target_path) or ".", exist_ok=True)
+        part_path = target_path + ".part"
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        try:
+            os.link(path, part_path)
+        except OSError:
+            shutil.copyfile(path, part_path)
+        os.replace(part_path, target_path)
+        
+        with self.lock:
+            self.hits += 1
+            self.bytes_saved += size
+        self.touch(source, song_id)
+        print(f"从缓存保存: {target_path}")
+        return target_path
+    
+    def stats(self):
+        rows = self.store.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM audio_cache")
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "bytes_saved": self.bytes_saved,
+                "files": rows[0][0],
+                "bytes": rows[0][1],
+            }
+
+class AudioProxyHandler(BaseHTTPRequestHandler):
+    # 把播放器的请求转发到上游，同时把收到的数据写入音频缓存
+    def do_GET(self):
+        proxy = self.server.proxy
+        stream = proxy.streams.get(self.path.lstrip("/"))
+        if stream is None:
+            self.send_error(404)
+            return
+        source, song_id, url = stream
+        
+        headers = dict(PROVIDERS[source].download_headers(), **{"Accept-Encoding": "identity"})
+        if self.headers.get("Range"):
+            headers["Range"] = self.headers["Range"]
+        try:
+            response = get_session("media").get(url, headers=headers, stream=True, timeout=API_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            self.send_error(502, str(e))
+            return
+        
+        with response:
+            self.send_response(response.status_code)
+            for name in ("Content-Type", "Content-Length", "Content-Range", "Accept-Ranges"):
+                if name in response.headers:
+                    self.send_header(name, response.headers[name])
+            self.end_headers()
+            
+            # 只有从第一个字节开始的完整响应才写入缓存，拖动进度产生的请求直接转发
+            expected = None
+            if response.status_code == 200:
+                expected = int(response.headers.get("Content-Length", 0))
+            elif response.status_code == 206:
+                match = re.match(r"bytes 0-(\d+)/(\d+)", response.headers.get("Content-Range", ""))
+                if match and int(match.group(1)) + 1 == int(match.group(2)):
+                    expected = int(match.group(2))
+            
+            file = part_path = None
+            if expected is not None:
+                file, part_path = proxy.cache.begin_write(source, song_id)
+            written = 0
+            try:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    self.wfile.write(chunk)
+                    if file:
+                        file.write(chunk)
+                    written += len(chunk)
+            except (OSError, requests.exceptions.RequestException):
+                # 播放器断开（切歌或拖动）或上游中断，不完整的数据不保留
+                if file:
+                    file.close()
+                    proxy.cache.abort_write(part_path)
+                return
+            
+            if file:
+                file.close()
+                if expected and written != expected:
+                    proxy.cache.abort_write(part_path)
+                    return
+                try:
+                    proxy.cache.finish_write(source, song_id, part_path)
+                except OSError as e:
+                    # 临时文件被删除或磁盘出错时只是这次没有缓存，播放不受影响
+                    print(f"写入音频缓存失败: {str(e)}")
+                    proxy.cache.abort_write(part_path)
+    
+    def log_message(self, format, *args):
+        pass
+
+class AudioCacheProxy:
+    """监听回环地址的转发服务，播放器通过它边播放边缓存"""
+    def __init__(self, cache):
+        self.cache = cache
+        self.streams = {}  # 路径 -> (source, song_id, 上游地址)
+        self.server = ThreadingHTTPServer((AUDIO_PROXY_HOST, 0), AudioProxyHandler)
+        self.server.daemon_threads = True
+        self.server.proxy = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+    
+    def url_for(self, source, song_id, url):
+        path = f"{source}/{urllib.parse.quote(str(song_id), safe='')}"
+        self.streams[path] = (source, song_id, url)
+        return f"http://{AUDIO_PROXY_HOST}:{self.server.server_address[1]}/{path}"
+    
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class QueueNode:
+    __slots__ = ("id", "entry", "position", "prev", "next")
+    
+    def __init__(self, node_id, entry, position):
+        self.id = node_id
+        self.entry = entry  # (source, song_id, song_name)
+        self.position = position
+        self.prev = None
+        self.next = None
+
+def load_queue_rows(store, until, progress_callback):
+    # 在后台线程中按位置分块读取启动前已有的条目，每块交给主线程追加到链表
+    last = -1e300
+    count = 0
+    while True:
+        rows = store.execute(
+            "SELECT id, source, song_id, song_name, position FROM play_queue "
+            "WHERE position > ? AND position <= ? ORDER BY position LIMIT ?",
+            (last, until, QUEUE_LOAD_CHUNK)
+        )
+        if not rows:
+            break
+        progress_callback(rows)
+        count += len(rows)
+        last = rows[-1][4]
+    return count
+
+class PlayQueue:
+    """播放列表和播放历史
+    
+    内存中是双向链表，入队、移除、移动都只改动相邻的节点。数据库中每个条目
+    保存一个小数位置，插入时取前后两个条目的中间值，每次修改只写入一行。
+    启动前已有的条目由load_queue_rows在后台分块读取，期间新加入的条目排在
+    它们之后。
+    """
+    def __init__(self, store):
+        self.store = store
+        self.head = QueueNode(None, None, 0.0)
+        self.tail = QueueNode(None, None, 0.0)
+        self.head.next = self.tail
+        self.tail.prev = self.head
+        self.nodes = {}  # id -> 节点
+        self.by_key = {}  # (source, song_id) -> 节点
+        self.current = None
+        self.loaded = False
+        self.load_anchor = self.head  # 后台读取的条目插入在这个节点之后
+        
+        store.execute("""
+            CREATE TABLE IF NOT EXISTS play_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source TEXT NOT NULL,
+                song_id TEXT NOT NULL,
+                song_name TEXT NOT NULL,
+                position REAL NOT NULL
+            )
+        """)
+        store.execute("CREATE INDEX IF NOT EXISTS play_queue_position ON play_queue (position)")
+        store.execute("""
+            CREATE TABLE IF NOT EXISTS play_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source TEXT NOT NULL,
+                song_id TEXT NOT NULL,
+                song_name TEXT NOT NULL,
+                played_at REAL NOT NULL
+            )
+        """)
+        store.execute("CREATE TABLE IF NOT EXISTS play_state (key TEXT PRIMARY KEY, value TEXT)")
+        
+        # 只读取最大位置，条目本身在后台加载
+        self.max_position = store.execute("SELECT MAX(position) FROM play_queue")[0][0] or 0.0
+        self.loaded_until = self.max_position
+        rows = store.execute("SELECT value FROM play_state WHERE key = 'current'")
+        self.saved_current = int(rows[0][0]) if rows and rows[0][0] else None
+        
+        # 后退时使用的播放历史，history_cursor为已经后退的步数
+        rows = store.execute("SELECT source, song_id, song_name FROM play_history ORDER BY id DESC LIMIT ?",
+                             (HISTORY_MEMORY,))
+        self.history = deque((tuple(row) for row in reversed(rows)), maxlen=HISTORY_MEMORY)
+        self.history_cursor = 0
+    
+    def __len__(self):
+        return len(self.nodes)
+    
+    def __iter__(self):
+        node = self.head.next
+        while node is not self.tail:
+            yield node
+            node = node.next
+    
+    def find(self, entry):
+        return self.by_key.get(entry[:2])
+    
+    def next_of(self, node):
+        # node为None时返回第一个条目
+        node = (node or self.head).next
+        return None if node is self.tail else node
+    
+    def _link(self, node, after):
+        node.prev = after
+        node.next = after.next
+        after.next.prev = node
+        after.next = node
+        self.nodes[node.id] = node
+        self.by_key[node.entry[:2]] = node
+    
+    def _unlink(self, node):
+        node.prev.next = node.next
+        node.next.prev = node.prev
+        del self.nodes[node.id]
+        del self.by_key[node.entry[:2]]
+    
+    def _position_after(self, after):
+        # after之后、下一个节点之前的位置，末尾时在最大位置上加1
+        before = after.position if after is not self.head else (
+            self.head.next.position - 2 if self.head.next is not self.tail else self.max_position)
+        if after.next is self.tail:
+            position = max(before, self.max_position) + 1
+        else:
+            position = (before + after.next.position) / 2
+            if not before < position < after.next.position:
+                # 小数精度用完时重新编号，很少发生
+                self.renumber()
+                return self._position_after(after)
+        self.max_position = max(self.max_position, position)
+        return position
+    
+    def insert(self, entries, after=None):
+        """在after之后插入，after为None时加到末尾，已在列表中的歌曲移到新位置，返回节点列表"""
+        after = after or self.tail.prev
+        result = []
+        for entry in entries:
+            node = self.find(entry)
+            if node is not None:
+                if node is not after and node is not self.current:
+                    self.move(node, after)
+                if node is not self.current:
+                    after = node
+                result.append(node)
+                continue
+            
+            position = self._position_after(after)
+            node = QueueNode(None, tuple(entry), position)
+            node.id = self.store.insert(
+                "INSERT INTO play_queue (source, song_id, song_name, position) VALUES (?, ?, ?, ?)",
+                (*entry, position)
+            )
+            self._link(node, after)
+            after = node
+            result.append(node)
+        return result
+    
+    def add_loaded(self, rows):
+        # 后台读取的一块条目，按顺序接在上一块之后
+        nodes = []
+        for node_id, source, song_id, song_name, position in rows:
+            if node_id in self.nodes:
+                continue
+            node = QueueNode(node_id, (source, song_id, song_name), position)
+            self._link(node, self.load_anchor)
+            self.load_anchor = node
+            nodes.append(node)
+        return nodes
+    
+    def finish_loading(self):
+        self.loaded = True
+        self.load_anchor = None
+        if self.saved_current is not None:
+            self.current = self.nodes.get(self.saved_current)
+    
+    def remove(self, node):
+        if node is self.current:
+            # 移除正在播放的条目后从它后面的歌曲继续
+            self.set_current(node.prev if node.prev is not self.head else None)
+        if node is self.load_anchor:
+            self.load_anchor = node.prev
+        self._unlink(node)
+        self.store.execute("DELETE FROM play_queue WHERE id = ?", (node.id,))
+    
+    def move(self, node, after):
+        if node is after or node.prev is after:
+            return
+        if node is self.load_anchor:
+            self.load_anchor = node.prev
+        self._unlink(node)
+        node.position = self._position_after(after)
+        self._link(node, after)
+        self.store.execute("UPDATE play_queue SET position = ? WHERE id = ?", (node.position, node.id))
+    
+    def clear(self):
+        self.store.execute("DELETE FROM play_queue")
+        self.head.next = self.tail
+        self.tail.prev = self.head
+        self.nodes.clear()
+        self.by_key.clear()
+        self.max_position = 0.0
+        self.set_current(None)
+        if not self.loaded:
+            self.load_anchor = self.head
+    
+    def renumber(self):
+        position = 0.0
+        rows = []
+        for node in self:
+            position += 1
+            node.position = position
+            rows.append((position, node.id))
+        self.max_position = max(position, self.loaded_until) if not self.loaded else position
+        self.store.executemany("UPDATE play_queue SET position = ? WHERE id = ?", rows)
+    
+    def set_current(self, node):
+        self.current = node
+        self.store.execute("INSERT OR REPLACE INTO play_state (key, value) VALUES ('current', ?)",
+                           (str(node.id) if node else None,))
+    
+    def record_history(self, entry):
+        self.history.append(tuple(entry))
+        self.history_cursor = 0
+        row_id = self.store.insert(
+            "INSERT INTO play_history (source, song_id, song_name, played_at) VALUES (?, ?, ?, ?)",
+            (*entry, time.time())
+        )
+        if row_id % 100 == 0:
+            self.store.execute("DELETE FROM play_history WHERE id <= ?", (row_id - HISTORY_LIMIT,))
+    
+    def step_back(self):
+        if self.history_cursor + 1 >= len(self.history):
+            return None
+        self.history_cursor += 1
+        return self.history[-1 - self.history_cursor]
+    
+    def step_forward(self):
+        if self.history_cursor == 0:
+            return None
+        self.history_cursor -= 1
+        return self.history[-1 - self.history_cursor]
+
+class LocalIndex:
+    """搜索结果、播放历史和下载中出现过的歌曲的本地全文索引
+    
+    使用SQLite FTS5索引歌名、歌手、专辑和拼音，不支持FTS5时退回到LIKE查询。
+    歌曲信息没有变化时只更新播放和下载标记，不重写索引。
+    """
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.Lock()  # 后台线程和主线程可能同时写入同一首歌
+        store.execute("""
+            CREATE TABLE IF NOT EXISTS local_tracks (
+                source TEXT NOT NULL,
+                song_id TEXT NOT NULL,
+                name TEXT NOT NULL,
+                artist TEXT NOT NULL,
+                album TEXT NOT NULL,
+                search_text TEXT NOT NULL,
+                played INTEGER NOT NULL DEFAULT 0,
+                downloaded INTEGER NOT NULL DEFAULT 0,
+                seen_at REAL NOT NULL,
+                PRIMARY KEY (source, song_id)
+            )
+        """)
+        try:
+            store.execute("CREATE VIRTUAL TABLE IF NOT EXISTS local_index USING fts5("
+                          "title, artist, album, pinyin, tokenize = 'unicode61 remove_diacritics 2')")
+            self.fts = True
+        except sqlite3.OperationalError as e:
+            print(f"当前SQLite不支持FTS5，本地搜索使用普通查询: {e}")
+            self.fts = False
+    
+    def add(self, source, song_id, name, artist="", album="", played=False, downloaded=False):
+        with self.lock:
+            self._add(source, song_id, name, artist, album, played, downloaded)
+    
+    def _add(self, source, song_id, name, artist, album, played, downloaded):
+        rows = self.store.execute("SELECT rowid, name, artist, album FROM local_tracks "
+                                  "WHERE source = ? AND song_id = ?", (source, song_id))
+        if rows and tuple(rows[0][1:]) == (name, artist, album):
+            self.store.execute(
+                "UPDATE local_tracks SET played = played + ?, downloaded = MAX(downloaded, ?), seen_at = ? "
+                "WHERE rowid = ?", (int(played), int(downloaded), time.time(), rows[0][0])
+            )
+            return
+        
+        title_text, artist_text, album_text = index_text(name), index_text(artist), index_text(album)
+        pinyin = " ".join(filter(None, (pinyin_keys(name), pinyin_keys(artist))))
+        search_text = " ".join((title_text, artist_text, album_text, pinyin))
+        if rows:
+            rowid = rows[0][0]
+            self.store.execute(
+                "UPDATE local_tracks SET name = ?, artist = ?, album = ?, search_text = ?, "
+                "played = played + ?, downloaded = MAX(downloaded, ?), seen_at = ? WHERE rowid = ?",
+                (name, artist, album, search_text, int(played), int(downloaded), time.time(), rowid)
+            )
+        else:
+            rowid = self.store.insert(
+                "INSERT INTO local_tracks (source, song_id, name, artist, album, search_text, "
+                "played, downloaded, seen_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (source, song_id, name, artist, album, search_text, int(played), int(downloaded), time.time())
+            )
+        if self.fts:
+            self.store.execute("DELETE FROM local_index WHERE rowid = ?", (rowid,))
+            self.store.execute("INSERT INTO local_index (rowid, title, artist, album, pinyin) VALUES (?, ?, ?, ?, ?)",
+                               (rowid, title_text, artist_text, album_text, pinyin))
+    
+    def add_results(self, results):
+        # 搜索结果每次都会加入索引，在后台线程中调用
+        for result in results:
+            self.add(result.get("API_TYPE") or "main", result["DC_TARGETID"], result["NAME"],
+                     result.get("ARTIST", ""), result.get("ALBUM", ""))
+    
+    def track_fields(self, source, song_id):
+        """返回索引中这首歌的(歌名, 歌手)，没有时返回None"""
+        rows = self.store.execute("SELECT name, artist FROM local_tracks WHERE source = ? AND song_id = ?",
+                                  (source, song_id))
+        return tuple(rows[0]) if rows else None
+    
+    def add_song(self, source, song_id, song_name, played=False, downloaded=False):
+        # 列表中显示的名称为"歌名 - 歌手 - 专辑"，已经索引过的歌曲保留原来的字段
+        rows = self.store.execute("SELECT name, artist, album FROM local_tracks WHERE source = ? AND song_id = ?",
+                                  (source, song_id))
+        fields = rows[0] if rows else (song_name.split(" - ", 2) + ["", ""])[:3]
+        self.add(source, song_id, *fields, played=played, downloaded=downloaded)
+    
+    def search(self, query, limit=LOCAL_SEARCH_LIMIT):
+        """返回与主API搜索结果格式相同的字典，播放过或下载过的歌曲排在前面"""
+        columns = "t.source, t.song_id, t.name, t.artist, t.album"
+        if self.fts:
+            match = build_match_query(query)
+            if not match:
+                return []
+            try:
+                rows = self.store.execute(
+                    f"SELECT {columns} FROM local_index f JOIN local_tracks t ON t.rowid = f.rowid "
+                    "WHERE local_index MATCH ? "
+                    "ORDER BY (t.played > 0 OR t.downloaded > 0) DESC, bm25(local_index, 4.0, 2.0, 1.0, 1.0) "
+                    "LIMIT ?", (match, limit)
+                )
+            except sqlite3.OperationalError as e:
+                print(f"本地搜索出错: {e}")
+                return []
+        else:
+            words = index_text(query).split()
+            if not words:
+                return []
+            conditions = " AND ".join("t.search_text LIKE ?" for _ in words)
+            rows = self.store.execute(
+                f"SELECT {columns} FROM local_tracks t WHERE {conditions} "
+                "ORDER BY (t.played > 0 OR t.downloaded > 0) DESC, t.seen_at DESC LIMIT ?",
+                [f"%{word}%" for word in words] + [limit]
+            )
+        
+        return [{"NAME": name, "ARTIST": artist, "ALBUM": album, "DC_TARGETID": song_id,
+                 "API_TYPE": source, "LOCAL": True}
+                for source, song_id, name, artist, album in rows]
+
+DOWNLOAD_STATE_NAMES = {
+    "pending": "等待",
+    "resolving": "解析中",
+    "resolved": "待下载",
+    "active": "下载中",
+    "done": "完成",
+    "failed": "失败",
+}
+
+def format_size(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+class DownloadManager(QObject):
+    """批量下载队列
+    
+    解析地址和传输数据是两个独立的阶段，分别使用各自的线程池，后面条目的
+    地址解析与前面条目的传输同时进行。队列状态保存在本地数据库中，程序
+    重启后未完成的条目会重新排队并从.part文件续传。
+    """
+    changed = pyqtSignal(object)  # 状态变化的条目，None表示整个队列需要刷新
+    
+    def __init__(self, store, url_cache, audio_cache, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.url_cache = url_cache
+        self.audio_cache = audio_cache
+        self.items = OrderedDict()  # id -> 条目
+        self.index = {}  # (source, song_id) -> id
+        self.samples = deque()  # (时间, 字节数)，用于计算下载速度
+        self.cancelled = threading.Event()
+        
+        self.resolve_pool = QThreadPool(self)
+        self.resolve_pool.setMaxThreadCount(DOWNLOAD_RESOLVE_WORKERS)
+        self.transfer_pool = QThreadPool(self)
+        self.transfer_pool.setMaxThreadCount(DOWNLOAD_WORKERS)
+        
+        store.execute("""
+            CREATE TABLE IF NOT EXISTS download_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source TEXT NOT NULL,
+                song_id TEXT NOT NULL,
+                song_name TEXT NOT NULL,
+                target_path TEXT NOT NULL,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                updated_at REAL NOT NULL,
+                UNIQUE (source, song_id)
+            )
+        """)
+        
+        for row in store.execute("SELECT id, source, song_id, song_name, target_path, state, attempts, error "
+                                 "FROM download_queue ORDER BY id"):
+            item = dict(zip(("id", "source", "song_id", "song_name", "target_path", "state", "attempts", "error"), row))
+            item.update(url=None, done=0, total=0, retry_at=0)
+            if item["state"] in ("resolving", "resolved", "active"):
+                # 上次退出时还没完成，重新解析地址后续传
+                item["state"] = "pending"
+            self.items[item["id"]] = item
+            self.index[(item["source"], item["song_id"])] = item["id"]
+    
+    def start(self):
+        self._pump()
+    
+    def enqueue(self, songs):
+        """songs为(source, song_id, song_name)的序列，已在队列中的歌曲不会重复添加"""
+        for source, song_id, song_name in songs:
+            item_id = self.index.get((source, song_id))
+            if item_id is not None:
+                item = self.items[item_id]
+                if item["state"] == "failed" or (item["state"] == "done" and not os.path.exists(item["target_path"])):
+                    item["attempts"] = 0
+                    self._set_state(item, "pending")
+                continue
+            
+            target_path = os.path.join(DOWNLOAD_DIR, song_file_name(song_name))
+            item_id = self.store.insert(
+                "INSERT INTO download_queue (source, song_id, song_name, target_path, state, updated_at) "
+                "VALUES (?, ?, ?, ?, 'pending', ?)",
+                (source, song_id, song_name, target_path, time.time())
+            )
+            item = {"id": item_id, "source": source, "song_id": song_id, "song_name": song_name,
+                    "target_path": target_path, "state": "pending", "attempts": 0, "error": None,
+                    "url": None, "done": 0, "total": 0, "retry_at": 0}
+            self.items[item_id] = item
+            self.index[(source, song_id)] = item_id
+            self.changed.emit(item)
+        self._pump()
+    
+    def retry_failed(self):
+        for item in self.items.values():
+            if item["state"] == "failed":
+                item["attempts"] = 0
+                self._set_state(item, "pending")
+        self._pump()
+    
+    def clear_finished(self):
+        self.store.execute("DELETE FROM download_queue WHERE state = 'done'")
+        for item_id in [i for i, item in self.items.items() if item["state"] == "done"]:
+            item = self.items.pop(item_id)
+            del self.index[(item["source"], item["song_id"])]
+        self.changed.emit(None)
+    
+    def shutdown(self):
+        # 中止传输，.part文件保留到下次启动
+        self.cancelled.set()
+        self.resolve_pool.clear()
+        self.transfer_pool.clear()
+        self.resolve_pool.waitForDone(2000)
+        self.transfer_pool.waitForDone(2000)
+    
+    def _set_state(self, item, state, error=None):
+        item["state"] = state
+        item["error"] = error
+        self.store.execute(
+            "UPDATE download_queue SET state = ?, attempts = ?, error = ?, updated_at = ? WHERE id = ?",
+            (state, item["attempts"], error, time.time(), item["id"])
+        )
+        self.changed.emit(item)
+    
+    def _pump(self):
+        # 每次状态变化后调度：先让已解析的条目开始传输，再提前解析后面的条目
+        if self.cancelled.is_set():
+            return
+        
+        now = time.time()
+        resolving = active = 0
+        resolved = []
+        pending = []
+        for item in self.items.values():
+            state = item["state"]
+            if state == "resolving":
+                resolving += 1
+            elif state == "active":
+                active += 1
+            elif state == "resolved":
+                resolved.append(item)
+            elif state == "pending" and item["retry_at"] <= now:
+                pending.append(item)
+        
+        while resolved and active < DOWNLOAD_WORKERS:
+            self._start_transfer(resolved.pop(0))
+            active += 1
+        
+        for item in pending:
+            if resolving >= DOWNLOAD_RESOLVE_WORKERS:
+                break
+            if resolving + len(resolved) + active >= DOWNLOAD_WORKERS + DOWNLOAD_RESOLVE_AHEAD:
+                break
+            self._start_resolve(item)
+            resolving += 1
+    
+    def _start_resolve(self, item):
+        if self.audio_cache.lookup(item["source"], item["song_id"]) is not None:
+            # 播放过的歌曲直接从音频缓存保存，不需要解析地址和网络传输
+            self._set_state(item, "active")
+            worker = Worker(item["id"], self.audio_cache.export, item["source"], item["song_id"],
+                            item["target_path"])
+            worker.signals.finished.connect(self.on_transferred)
+            worker.signals.failed.connect(self.on_failed)
+            self.transfer_pool.start(worker)
+            return
+        
+        self._set_state(item, "resolving")
+        worker = Worker(item["id"], self.url_cache.resolve, item["source"], item["song_id"])
+        worker.signals.finished.connect(self.on_resolved)
+        worker.signals.failed.connect(self.on_failed)
+        self.resolve_pool.start(worker)
+    
+    def _start_transfer(self, item):
+        # 从.part文件续传的部分不是这次传输的，不计入速度
+        item["done"] = read_resume_info(item["target_path"] + ".part")[0]
+        self._set_state(item, "active")
+        worker = Worker(item["id"], transfer_song, item["source"], item["url"],
+                        item["target_path"], self.cancelled).with_progress()
+        worker.signals.progress.connect(self.on_progress)
+        worker.signals.finished.connect(self.on_transferred)
+        worker.signals.failed.connect(self.on_failed)
+        self.transfer_pool.start(worker)
+    
+    @pyqtSlot(object, object)
+    def on_resolved(self, item_id, url):
+        item = self.items.get(item_id)
+        if item is None:
+            return
+        item["url"] = url
+        self._set_state(item, "resolved")
+        self._pump()
+    
+    @pyqtSlot(object, object)
+    def on_progress(self, item_id, progress):
+        item = self.items.get(item_id)
+        if item is None:
+            return
+        done, total = progress
+        if done > item["done"]:
+            self.samples.append((time.monotonic(), done - item["done"]))
+        item["done"], item["total"] = done, total
+        self.changed.emit(item)
+    
+    @pyqtSlot(object, object)
+    def on_transferred(self, item_id, target_path):
+        item = self.items.get(item_id)
+        if item is None:
+            return
+        print(f"文件已保存: {target_path}")
+        self._set_state(item, "done")
+        self._pump()
+    
+    @pyqtSlot(object, object)
+    def on_failed(self, item_id, error):
+        item = self.items.get(item_id)
+        if item is None or isinstance(error, DownloadCancelled):
+            return
+        
+        print(f"下载失败: {item['song_name']}: {str(error)}")
+        item["attempts"] += 1
+        expired = isinstance(error, StreamUrlExpired)
+        if expired:
+            self.url_cache.invalidate(item["source"], item["song_id"], item["url"])
+        item["url"] = None  # 地址可能已经过期，重试时重新解析
+        if item["attempts"] < DOWNLOAD_MAX_ATTEMPTS:
+            # 地址过期不是上游故障，立即重新解析
+            delay = 0 if expired else DOWNLOAD_RETRY_DELAY * 2 ** (item["attempts"] - 1)
+            item["retry_at"] = time.time() + delay
+            self._set_state(item, "pending", str(error))
+            QTimer.singleShot(int(delay * 1000), self._pump)
+        else:
+            self._set_state(item, "failed", str(error))
+        self._pump()
+    
+    def stats(self):
+        """返回各状态的数量、总下载速度（字节/秒）和预计剩余时间（秒）"""
+        now = time.monotonic()
+        while self.samples and self.samples[0][0] < now - THROUGHPUT_WINDOW:
+            self.samples.popleft()
+        speed = 0.0
+        if self.samples:
+            span = min(max(now - self.samples[0][0], 1.0), THROUGHPUT_WINDOW)
+            speed = sum(size for _, size in self.samples) / span
+        
+        counts = {state: 0 for state in DOWNLOAD_STATE_NAMES}
+        sizes = []
+        remaining = 0
+        unknown = 0
+        for item in self.items.values():
+            counts[item["state"]] += 1
+            if item["total"]:
+                sizes.append(item["total"])
+            if item["state"] in ("pending", "resolving", "resolved", "active"):
+                if item["total"]:
+                    remaining += item["total"] - item["done"]
+                else:
+                    unknown += 1
+        
+        # 大小未知的条目按已知条目的平均大小估算
+        if sizes:
+            remaining += unknown * sum(sizes) / len(sizes)
+        eta = remaining / speed if speed > 0 and (sizes or not unknown) else None
+        return {"counts": counts, "speed": speed, "eta": eta}
+
+# 歌词解析
+LRC_TIME_TAG = re.compile(r"\[(\d+):(\d+)(?:[.:](\d+))?\]")  # [mm:ss]、[mm:ss.xx]、[mm:ss:xx]
+LRC_OFFSET_TAG = re.compile(r"\[offset:\s*([+-]?\d+)\s*\]", re.IGNORECASE)
+LRC_WORD_TAG = re.compile(r"<\d+:\d+(?:[.:]\d+)?>")  # 逐字歌词的时间标记
+
+class LyricTimeline:
+    """歌词时间轴：按时间排序的时间戳（毫秒）和歌词文字两个平行列表"""
+    __slots__ = ("times", "texts")
+    
+    def __init__(self, times=None, texts=None):
+        self.times = times or []
+        self.texts = texts or []
+    
+    def __len__(self):
+        return len(self.times)
+    
+    @classmethod
+    def from_pairs(cls, pairs):
+        # pairs为(毫秒, 文字)，空白歌词不保留
+        lines = sorted(((int(time_ms), text.strip()) for time_ms, text in pairs if text and text.strip()),
+                       key=lambda line: line[0])
+        return cls([time_ms for time_ms, _ in lines], [text for _, text in lines])
+
+def parse_lrc(lrc_text):
+    """单遍解析LRC文本
+    
+    支持一行多个时间标签、不带小数的[mm:ss]、[offset:]标签，逐字歌词的
+    <mm:ss.xx>标记会被去掉，只保留整行文字。
+    """
+    offset = 0
+    pairs = []
+    for line in lrc_text.splitlines():
+        line = line.strip().lstrip("\ufeff")
+        
+        # 行首可能有多个时间标签，共用同一句歌词
+        stamps = []
+        pos = 0
+        match = LRC_TIME_TAG.match(line)
+        while match:
+            minutes, seconds, fraction = match.groups()
+            time_ms = (int(minutes) * 60 + int(seconds)) * 1000
+            if fraction:
+                time_ms += int(fraction.ljust(3, "0")[:3])
+            stamps.append(time_ms)
+            pos = match.end()
+            match = LRC_TIME_TAG.match(line, pos)
+        
+        if not stamps:
+            match = LRC_OFFSET_TAG.match(line)
+            if match:
+                offset = int(match.group(1))
+            continue
+        
+        text = LRC_WORD_TAG.sub("", line[pos:])
+        for time_ms in stamps:
+            pairs.append((time_ms, text))
+    
+    # offset为正表示歌词整体提前
+    return LyricTimeline.from_pairs((max(0, time_ms - offset), text) for time_ms, text in pairs)
+
+def fetch_main_lyrics(song_id):
+    response = get_session("kuwo").get(KUWO_LYRIC_URL, params={"musicId": song_id}, timeout=LYRICS_TIMEOUT)
+    if response.status_code != 200:
+        raise Exception(f"服务器返回错误代码: {response.status_code}")
+    
+    # 接口直接给出结构化的歌词，不需要再转成LRC文本
+    data = response.json().get("data") or {}
+    return LyricTimeline.from_pairs(
+        (float(item["time"]) * 1000, item["lineLyric"]) for item in data.get("lrclist") or []
+    )
+
+def fetch_backup_lyrics(song_id):
+    response = get_session("imsyy").get(BACKUP_LYRIC_URL, params={"id": song_id}, timeout=LYRICS_TIMEOUT).json()
+    if response["code"] != 200:
+        raise Exception(f"获取歌词失败: {response.get('msg', '未知错误')}")
+    return parse_lrc((response.get("lrc") or {}).get("lyric") or "")
+
+def fetch_lyrics_cached(cache, source, song_id):
+    # 没有歌词时也写入缓存，下次播放不再请求；网络错误不缓存
+    timeline = call_source(source, "lyrics", song_id)
+    cache.put(source, song_id, timeline)
+    return timeline
+
+class LyricsCache:
+    """解析好的歌词时间轴缓存，键为(音源, 歌曲id)，空时间轴表示该歌曲没有歌词"""
+    def __init__(self, store, memory_entries=LYRICS_CACHE_MEMORY_ENTRIES,
+                 negative_ttl=LYRICS_CACHE_NEGATIVE_TTL):
+        self.store = store
+        self.memory_entries = memory_entries
+        self.negative_ttl = negative_ttl
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        
+        store.execute("""
+            CREATE TABLE IF NOT EXISTS lyrics_cache (
+                source TEXT NOT NULL,
+                song_id TEXT NOT NULL,
+                times TEXT NOT NULL,
+                texts TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (source, song_id)
+            )
+        """)
+    
+    def get(self, source, song_id):
+        """未命中时返回None"""
+        key = (source, song_id)
+        with self.lock:
+            timeline = self.memory.get(key)
+            if timeline is not None:
+                self.memory.move_to_end(key)
+                return timeline
+        
+        rows = self.store.execute(
+            "SELECT times, texts, fetched_at FROM lyrics_cache WHERE source = ? AND song_id = ?", key)
+        if not rows:
+            return None
+        times, texts, fetched_at = rows[0]
+        timeline = LyricTimeline(json.loads(times), json.loads(texts))
+        if not timeline and time.time() - fetched_at > self.negative_ttl:
+            # 以前没有歌词的歌曲过一段时间再重新获取
+            return None
+        self._remember(key, timeline)
+        return timeline
+    
+    def put(self, source, song_id, timeline):
+        self._remember((source, song_id), timeline)
+        self.store.execute(
+            "INSERT OR REPLACE INTO lyrics_cache (source, song_id, times, texts, fetched_at) VALUES (?, ?, ?, ?, ?)",
+            (source, song_id, json.dumps(timeline.times), json.dumps(timeline.texts, ensure_ascii=False), time.time())
+        )
+    
+    def _remember(self, key, timeline):
+        with self.lock:
+            self.memory[key] = timeline
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_entries:
+                self.memory.popitem(last=False)
+
+def merge_results(pages, local=(), seen=()):
+    """按顺序合并各音源的结果，pages为(音源, 结果列表)的序列，同名同歌手的歌曲只保留第一个
+    
+    local和seen（已有结果的result_key集合）中已经有的歌曲不再加入。
+    """
+    seen = set(seen) | {result_key(result) for result in local}
+    merged = []
+    for source, results in pages:
+        for result in results:
+            key = result_key(result)
+            if key in seen:
+                continue
+            seen.add(key)
+            merged.append(result if result.get("API_TYPE") == source else dict(result, API_TYPE=source))
+    return merged
+
+def resolve_entry(url_cache, source, song_id):
+    return (source, song_id, url_cache.resolve(source, song_id))
+
+class MusicEngine(QObject):
+    """不依赖界面的音乐引擎：搜索、解析地址、歌词、下载和播放列表
+    
+    search_page、search、resolve、lyrics和download是阻塞方法，可以在任意线程中直接调用，
+    适合脚本和压力测试。start_开头的方法把请求交给线程池，结果通过信号送回创建引擎的
+    线程，token由调用方指定，用于识别过期的结果。引擎只依赖QtCore，不操作任何控件。
+    """
+    search_updated = pyqtSignal(object)  # 当前搜索的合并结果，见emit_search
+    search_failed = pyqtSignal(object)  # 所有音源都失败且没有任何结果：{"failures": {音源: 异常}, "incremental"}
+    stream_ready = pyqtSignal(object, object)  # (token, 播放信息)，见stream_info
+    stream_failed = pyqtSignal(object, object)  # (token, 异常)
+    lyrics_ready = pyqtSignal(object, object)  # (token, LyricTimeline)
+    lyrics_failed = pyqtSignal(object, object)  # (token, 异常)
+    queue_chunk = pyqtSignal(object)  # 启动时后台读取的一块播放列表条目对应的节点
+    queue_loaded = pyqtSignal(object)  # 启动前已有的条目数
+    queue_load_failed = pyqtSignal(object)  # 异常
+    health_changed = pyqtSignal()
+    
+    def __init__(self, db_path=CACHE_DB_PATH, parent=None):
+        super().__init__(parent)
+        # 本地数据库和各类缓存
+        self.store = LocalStore(db_path)
+        self.search_cache = SearchCache(self.store)
+        self.lyrics_cache = LyricsCache(self.store)
+        self.local_index = LocalIndex(self.store)
+        self.url_cache = StreamUrlCache()
+        self.audio_cache = AudioCache(self.store)
+        self.audio_proxy = AudioCacheProxy(self.audio_cache)
+        self.race_stats = RaceStats(PROVIDERS)
+        
+        # 播放列表和下载队列，都保存在本地数据库中
+        self.queue = PlayQueue(self.store)
+        self.downloads = DownloadManager(self.store, self.url_cache, self.audio_cache, self)
+        self.downloads.changed.connect(self.on_download_changed)
+        
+        # 搜索和播放分别使用各自的线程池，预取使用单独的低优先级线程池
+        self.search_pool = QThreadPool(self)
+        self.search_pool.setMaxThreadCount(SEARCH_WORKERS)
+        self.playback_pool = QThreadPool(self)
+        self.playback_pool.setMaxThreadCount(PLAYBACK_WORKERS)
+        self.prefetch_pool = QThreadPool(self)
+        self.prefetch_pool.setMaxThreadCount(PREFETCH_WORKERS)
+        self.prefetch_cancel = threading.Event()
+        
+        # 当前搜索的状态，search_generation用于识别最新的一次搜索
+        self.search_generation = 0
+        self.search_term = ""
+        self.search_sources = []
+        self.search_incremental = False  # 输入过程中的自动搜索，第一批确定之前只请求一个音源
+        self.search_quiet = False  # 自动搜索失败时不弹出对话框
+        self.results = []  # 已经确定的结果（本地结果和之前各批），之后只在末尾追加
+        self.result_keys = set()  # results中歌曲的result_key
+        self.next_pages = {}  # 音源 -> 下一批要请求的页码
+        self.page_totals = {}  # 音源 -> 总页数
+        self.batch_open = False  # 正在加载的一批还没有确定
+        self.batch_sources = []  # 这一批请求的音源
+        self.page_results = {}  # 音源 -> 这一批的结果
+        self.arrival_order = []  # 按结果到达的先后排列的音源
+        self.search_pending = set()  # 还在请求中的音源
+        self.search_silent = set()  # 已经有缓存结果、在后台刷新的音源
+        self.search_failures = {}  # 音源 -> 本次搜索的错误，出错的音源不再加载更多
+        self.search_workers = {}
+        self.search_limiter = RateLimiter(SEARCH_RATE, SEARCH_BURST)
+        
+        # 正在进行的竞速：{"token", "primary", "pending": 未返回的音源数, "error", "workers"}
+        self.race = None
+        
+        # 定时探测熔断中的音源
+        self.health_timer = QTimer(self)
+        self.health_timer.setInterval(HEALTH_CHECK_INTERVAL)
+        self.health_timer.timeout.connect(self.check_health)
+    
+    def start(self):
+        """开始后台工作：继续未完成的下载、预热连接、加载播放列表和探测音源"""
+        self.downloads.start()
+        
+        # 在全局线程池中预热各上游连接，不占用搜索线程
+        for upstream, url in WARMUP_URLS:
+            QThreadPool.globalInstance().start(Worker(None, warm_up_connection, upstream, url))
+        
+        # 建立拼音索引要用的模块和繁简转换器也在后台准备，第一次搜索时不用等待
+        if pypinyin is not None:
+            QThreadPool.globalInstance().start(Worker(None, getattr, pypinyin, "lazy_pinyin"))
+        if opencc is not None:
+            QThreadPool.globalInstance().start(Worker(None, simplified_converter))
+        
+        # 已有的播放列表条目在后台分块加载
+        worker = Worker(None, load_queue_rows, self.store, self.queue.loaded_until).with_progress()
+        worker.signals.progress.connect(self.on_queue_rows)
+        worker.signals.finished.connect(self.on_queue_rows_done)
+        worker.signals.failed.connect(self.on_queue_rows_failed)
+        self.search_pool.start(worker)
+        
+        self.health_timer.start()
+    
+    def shutdown(self):
+        """停止所有后台工作并关闭数据库，调用前应先停止正在使用本地转发地址的播放器"""
+        self.health_timer.stop()
+        
+        # 丢弃尚未开始的后台任务，等待进行中的任务写完缓存
+        self.cancel_prefetch()
+        self.cancel_search()
+        self.cancel_stream()
+        self.search_pool.clear()
+        self.search_pool.waitForDone(1000)
+        self.playback_pool.clear()
+        self.playback_pool.waitForDone(1000)
+        self.prefetch_pool.waitForDone(1000)
+        self.downloads.shutdown()
+        self.search_cache.flush_access_times()
+        print(f"搜索缓存统计: {self.search_cache.stats()}")
+        print(f"音乐地址缓存统计: {self.url_cache.stats()}")
+        print(f"音源状态: {SOURCE_HEALTH.snapshot()}")
+        print(f"竞速统计: {self.race_stats.stats()}")
+        SOURCE_HEALTH.export(HEALTH_EXPORT_PATH)
+        
+        # 停止本地转发服务，之后不会再有写入缓存的数据
+        self.audio_proxy.shutdown()
+        print(f"音频缓存统计: {self.audio_cache.stats()}")
+        self.store.close()
+    
+    def search_page(self, source, search_term, page=0):
+        """返回一个音源的一页结果，缓存中有未过期的结果时不请求网络"""
+        page_data, stale = self.search_cache.get(source, search_term, page)
+        if page_data is not None and not stale:
+            return page_data
+        return fetch_page(self.search_cache, source, search_term, page)
+    
+    def search(self, search_term, page=0, sources=None):
+        """依次请求各音源并合并结果，返回{"results", "total_pages", "failures"}"""
+        pages = []
+        failures = {}
+        for source in self.route_sources(sources or list(PROVIDERS)):
+            try:
+                pages.append((source, self.search_page(source, search_term, page)))
+            except Exception as e:
+                failures[source] = e
+        return {
+            "results": merge_results([(source, page_data["results"]) for source, page_data in pages]),
+            "total_pages": max((page_data["total_pages"] for _, page_data in pages), default=0),
+            "failures": failures,
+        }
+    
+    def resolve(self, source, song_id):
+        return self.url_cache.resolve(source, song_id)
+    
+    def lyrics(self, source, song_id):
+        timeline = self.lyrics_cache.get(source, song_id)
+        return timeline if timeline is not None else fetch_lyrics_cached(self.lyrics_cache, source, song_id)
+    
+    def download(self, source, song_id, song_name, target_dir=DOWNLOAD_DIR, progress_callback=None):
+        """下载一首歌并返回保存的路径，播放过的歌曲直接从音频缓存导出"""
+        target_path = os.path.join(target_dir, song_file_name(song_name))
+        if self.audio_cache.lookup(source, song_id) is not None:
+            return self.audio_cache.export(source, song_id, target_path)
+        url = self.resolve(source, song_id)
+        try:
+            return transfer_song(source, url, target_path, threading.Event(), progress_callback)
+        except StreamUrlExpired:
+            # 缓存的地址已经失效，重新解析一次
+            self.url_cache.invalidate(source, song_id, url)
+            return transfer_song(source, self.resolve(source, song_id), target_path, threading.Event(),
+                                 progress_callback)
+    
+    def route_sources(self, sources):
+        # 跳过熔断中的音源，全部熔断时仍然尝试所有音源；按延迟从低到高排列
+        healthy = [source for source in sources if SOURCE_HEALTH.available(source)]
+        return SOURCE_HEALTH.rank(healthy) if healthy else list(sources)
+    
+    def start_search(self, search_term, sources=None, incremental=False):
+        """开始新的搜索，同时请求各音源的第一页，每个音源返回时通过search_updated发出合并后的结果
+        
+        缓存中的结果立即发出，过期的在后台刷新。之后的结果由fetch_more一批批加载。
+        incremental为True时第一批只请求最快的音源，确定后再请求其余音源；发往上游的请求
+        受令牌桶限制，超出频率时不发出请求，返回需要等待的秒数；其他情况返回0。
+        """
+        # 每次搜索分配新的代号，旧的搜索结果回来后直接丢弃，还没开始的请求直接取消
+        self.search_generation += 1
+        self.cancel_search()
+        sources = self.route_sources(sources or list(PROVIDERS))
+        if (sources, normalize_term(search_term)) != (self.search_sources, normalize_term(self.search_term)):
+            self.cancel_prefetch()
+        self.search_sources = sources
+        self.search_term = search_term
+        self.search_incremental = incremental
+        self.search_quiet = incremental
+        self.next_pages = {source: 0 for source in sources}
+        self.page_totals = {}
+        self.search_failures = {}
+        
+        # 本地索引中的歌曲显示在最前面，不需要等待网络请求
+        self.results = self.local_index.search(search_term)
+        self.result_keys = {result_key(result) for result in self.results}
+        # 输入过程中的自动搜索先只发往最快的音源
+        return self.load_batch(incremental, sources[:1] if incremental else None)
+    
+    def can_fetch_more(self):
+        # 上一批已经确定，并且还有没加载完、也没有出错的音源
+        return bool(self.search_term) and not self.batch_open and bool(self.fetchable_sources())
+    
+    def fetch_more(self):
+        """加载当前搜索的下一批结果（每个音源的下一页），结果追加在后面，同样通过search_updated发出"""
+        if not self.can_fetch_more():
+            return False
+        self.search_incremental = False
+        self.load_batch()
+        return True
+    
+    def fetchable_sources(self):
+        # 还不知道总页数的音源至少有第一页
+        return [source for source in self.search_sources
+                if source not in self.search_failures and self.next_pages[source] < self.page_totals.get(source, 1)]
+    
+    def load_batch(self, incremental=False, sources=None):
+        # sources为None时加载所有还有下一页的音源
+        self.batch_open = True
+        self.batch_sources = [source for source in self.fetchable_sources() if sources is None or source in sources]
+        self.page_results = {}
+        self.arrival_order = []
+        self.search_pending = set()
+        self.search_silent = set()
+        
+        # 缓存命中时立即显示，过期的结果在后台静默刷新；没有缓存时先显示较短关键词的缓存结果中符合的歌曲
+        to_fetch = []
+        for source in self.batch_sources:
+            page = self.next_pages[source]
+            cached, stale = self.search_cache.get(source, self.search_term, page)
+            if cached is not None:
+                self.add_page_results(source, cached)
+                if not stale:
+                    continue
+                self.search_silent.add(source)
+            elif page == 0:
+                prefix_page = self.search_cache.lookup_prefix(source, self.search_term)
+                if prefix_page:
+                    self.add_page_results(source, {"results": filter_results(prefix_page["results"], self.search_term),
+                                                   "total_pages": 0})
+            to_fetch.append(source)
+        
+        if not to_fetch:
+            self.finish_batch()
+            return 0
+        self.emit_search()
+        wait = self.search_limiter.try_acquire()
+        if wait and incremental:
+            return wait
+        
+        # 所有音源同时请求，结果按到达的先后依次加入
+        for source in to_fetch:
+            worker = Worker((self.search_generation, source), fetch_page, self.search_cache,
+                            source, self.search_term, self.next_pages[source])
+            worker.signals.finished.connect(self.on_page_loaded)
+            worker.signals.failed.connect(self.on_page_failed)
+            self.search_workers[source] = worker
+            self.search_pending.add(source)
+            self.search_pool.start(worker)
+        self.emit_search()
+        return 0
+    
+    def cancel_search(self):
+        for worker in self.search_workers.values():
+            worker.cancel()
+        self.search_workers = {}
+    
+    def add_page_results(self, source, page_data):
+        # 先到达的音源排在前面，后台刷新的结果保留原来的位置
+        self.page_results[source] = page_data["results"]
+        if page_data["total_pages"]:
+            self.page_totals[source] = page_data["total_pages"]
+        if source not in self.arrival_order:
+            self.arrival_order.append(source)
+    
+    def batch_results(self):
+        # 这一批中与已确定的结果不重复的歌曲，后台刷新后可能整批改变
+        return merge_results([(source, self.page_results[source]) for source in self.arrival_order],
+                             seen=self.result_keys)
+    
+    def finish_batch(self):
+        # 所有请求都返回后这一批确定下来，追加到results末尾；出错的音源不再加载更多
+        batch = self.batch_results()
+        self.results.extend(batch)
+        self.result_keys.update(result_key(result) for result in batch)
+        for source in self.batch_sources:
+            if source not in self.search_failures:
+                self.next_pages[source] += 1
+        self.page_results = {}
+        self.arrival_order = []
+        self.batch_open = False
+        self.emit_search()
+        
+        # 停止输入后的自动搜索就是用户要找的内容，第一批确定后和按回车的搜索一样，
+        # 先请求其余的音源，之后正常预取和加载
+        if self.search_incremental:
+            self.search_incremental = False
+            untried = [source for source in self.fetchable_sources() if self.next_pages[source] == 0]
+            if untried:
+                self.load_batch(sources=untried)
+                return
+        if not batch and self.fetchable_sources():
+            # 这一批的歌曲全都和前面重复，列表没有变化，直接加载下一批
+            self.load_batch()
+        else:
+            self.schedule_prefetch()
+    
+    def emit_search(self):
+        # results是新的列表，已经发出的行只会在整批刷新时改变；
+        # loading表示还有用户在等待的请求，done表示所有请求（包括后台刷新）都已返回
+        self.search_updated.emit({
+            "term": self.search_term,
+            "sources": self.search_sources,
+            "results": self.results + self.batch_results() if self.batch_open else list(self.results),
+            "loading": bool(self.search_pending - self.search_silent),
+            "done": not self.search_pending,
+            "more": not self.batch_open and bool(self.fetchable_sources()),
+            "failed": list(self.search_failures),
+        })
+    
+    @pyqtSlot(object, object)
+    def on_page_loaded(self, token, page_data):
+        generation, source = token
+        if generation != self.search_generation:
+            print(f"丢弃过期的搜索结果: {PROVIDERS[source].title} 第 {page_data['page'] + 1} 页")
+            return
+        
+        self.search_workers.pop(source, None)
+        self.search_pending.discard(source)
+        self.search_silent.discard(source)
+        self.add_page_results(source, page_data)
+        # 新的搜索结果在后台加入本地索引
+        self.search_pool.start(Worker(None, self.local_index.add_results,
+                                      merge_results([(source, page_data["results"])])))
+        if self.search_pending:
+            self.emit_search()
+        else:
+            self.finish_batch()
+    
+    @pyqtSlot(object, object)
+    def on_page_failed(self, token, error):
+        generation, source = token
+        if generation != self.search_generation:
+            return
+        
+        self.search_workers.pop(source, None)
+        self.search_pending.discard(source)
+        title = PROVIDERS[source].title
+        # 已经有缓存结果时，后台刷新失败不算作搜索失败
+        if source in self.search_silent:
+            self.search_silent.discard(source)
+            print(f"后台刷新{title}搜索结果失败: {str(error)}")
+        else:
+            print(f"{title}搜索失败: {str(error)}")
+            self.search_failures[source] = error
+        if self.search_pending:
+            self.emit_search()
+            return
+        
+        # 输入过程中的自动搜索只发往了一个音源，它失败时改用下一个可用的音源，不算搜索失败
+        untried = [other for other in self.fetchable_sources() if self.next_pages[other] == 0]
+        if self.search_incremental and self.batch_sources == [source] and source in self.search_failures and untried:
+            print(f"{title}搜索失败，改用{PROVIDERS[untried[0]].title}")
+            self.load_batch(sources=untried[:1])
+            return
+        self.finish_batch()
+        
+        # 已经有结果时只在控制台记录，所有音源都失败且没有任何结果时才通知
+        if self.results or not self.search_failures:
+            return
+        self.search_failed.emit({"failures": dict(self.search_failures), "incremental": self.search_quiet})
+    
+    def schedule_prefetch(self):
+        # 用户很可能继续向下滚动，提前把后面的页面放进缓存
+        for source in self.fetchable_sources():
+            for page in range(self.next_pages[source], self.next_pages[source] + PREFETCH_DEPTH):
+                if page < self.page_totals.get(source, 0):
+                    self.prefetch_pool.start(Worker(None, prefetch_page, self.search_cache, self.prefetch_cancel,
+                                                    source, self.search_term, page))
+    
+    def cancel_prefetch(self):
+        # 丢弃排队中的预取，正在进行的请求开始前会检查取消标记
+        self.prefetch_cancel.set()
+        self.prefetch_cancel = threading.Event()
+        self.prefetch_pool.clear()
+    
+    def stream_info(self, source, song_id, url=None, path=None, cached=False):
+        # path为已缓存的本地文件；否则media为经本地转发服务的地址，数据同时写入音频缓存
+        return {
+            "source": source,
+            "song_id": song_id,
+            "url": url,
+            "path": path,
+            "media": self.audio_proxy.url_for(source, song_id, url) if url else None,
+            "cached": cached,  # 地址来自缓存，播放出错时值得重新解析一次
+        }
+    
+    def start_stream(self, token, source, song_id, song_name, race=False, sources=None):
+        """准备播放一首歌，结果通过stream_ready或stream_failed送回
+        
+        已缓存的音频和地址立即送回。race为True时同时在sources中的其他音源（默认全部）
+        解析，使用第一个可以播放的地址，此时送回的音源和歌曲id可能与请求的不同。
+        """
+        local_path = self.audio_cache.open(source, song_id)
+        if local_path is not None:
+            self.stream_ready.emit(token, self.stream_info(source, song_id, path=os.path.abspath(local_path)))
+            return
+        music_url = self.url_cache.lookup(source, song_id)
+        if music_url is not None:
+            self.stream_ready.emit(token, self.stream_info(source, song_id, music_url, cached=True))
+        elif race:
+            self.start_race(token, source, song_id, song_name, sources)
+        else:
+            worker = Worker(token, resolve_entry, self.url_cache, source, song_id)
+            worker.signals.finished.connect(self.on_entry_resolved)
+            worker.signals.failed.connect(self.stream_failed)
+            self.playback_pool.start(worker)
+    
+    @pyqtSlot(object, object)
+    def on_entry_resolved(self, token, entry):
+        self.stream_ready.emit(token, self.stream_info(*entry))
+    
+    def start_race(self, token, source, song_id, song_name, sources=None):
+        # 原音源按id解析，用户启用的其他可用音源先按歌名和歌手查找，谁先拿到可播放的地址就用谁
+        self.cancel_stream()
+        race = StreamRace(source, self.race_stats)
+        # 搜索结果的歌名和歌手已经分开保存在本地索引中，不从显示的名称里拆分
+        title, artist = self.local_index.track_fields(source, song_id) or split_song_name(song_name)
+        sources = [source] + [other for other in sources or PROVIDERS
+                              if other != source and SOURCE_HEALTH.available(other)]
+        self.race = {"token": token, "primary": source, "pending": len(sources), "error": None, "workers": []}
+        for candidate in sources:
+            worker = Worker((token, candidate), race_candidate, race, self.url_cache, self.search_cache,
+                            candidate, song_id if candidate == source else None, title, artist)
+            worker.signals.finished.connect(self.on_race_finished)
+            worker.signals.failed.connect(self.on_race_failed)
+            self.race["workers"].append(worker)
+            self.playback_pool.start(worker)
+    
+    def cancel_stream(self):
+        # 还没开始的竞速任务直接取消，已经开始的由StreamRace在下一步之前放弃
+        if self.race is not None:
+            for worker in self.race["workers"]:
+                worker.cancel()
+            self.race = None
+    
+    @pyqtSlot(object, object)
+    def on_race_finished(self, key, result):
+        token, candidate = key
+        if self.race is None or self.race["token"] != token:
+            return
+        self.race["pending"] -= 1
+        if result is None:
+            return
+        
+        source, song_id, music_url = result
+        if source != self.race["primary"]:
+            print(f"{PROVIDERS[source].title}先返回可用地址，改用该音源播放")
+        self.cancel_stream()
+        self.stream_ready.emit(token, self.stream_info(source, song_id, music_url))
+    
+    @pyqtSlot(object, object)
+    def on_race_failed(self, key, error):
+        token, candidate = key
+        if self.race is None or self.race["token"] != token:
+            return
+        self.race["pending"] -= 1
+        print(f"{PROVIDERS[candidate].title}竞速解析失败: {str(error)}")
+        # 优先报告原音源的错误
+        if self.race["error"] is None or candidate == self.race["primary"]:
+            self.race["error"] = error
+        if self.race["pending"] == 0:
+            error = self.race["error"]
+            self.race = None
+            self.stream_failed.emit(token, error)
+    
+    def start_lyrics(self, token, source, song_id):
+        """获取歌词，缓存中有（包括确认没有歌词）时立即送回并返回True"""
+        timeline = self.lyrics_cache.get(source, song_id)
+        if timeline is not None:
+            self.lyrics_ready.emit(token, timeline)
+            return True
+        worker = Worker(token, fetch_lyrics_cached, self.lyrics_cache, source, song_id)
+        worker.signals.finished.connect(self.lyrics_ready)
+        worker.signals.failed.connect(self.lyrics_failed)
+        self.playback_pool.start(worker)
+        return False
+    
+    def prefetch_lyrics(self, source, song_id):
+        # 提前放进缓存，切换歌曲时直接显示
+        if self.lyrics_cache.get(source, song_id) is None:
+            self.playback_pool.start(Worker(None, fetch_lyrics_cached, self.lyrics_cache, source, song_id))
+    
+    def prefetch_url(self, source, song_id):
+        # 选中歌曲时提前解析地址，播放时直接命中缓存
+        if self.url_cache.peek(source, song_id) is None:
+            self.prefetch_pool.start(Worker(None, prefetch_stream_url, self.url_cache, source, song_id))
+    
+    def invalidate_stream(self, source, song_id, url=None):
+        """播放器报告地址失效时调用；url为None时说明本地缓存文件损坏"""
+        if url is None:
+            self.audio_cache.remove(source, song_id)
+        else:
+            self.url_cache.invalidate(source, song_id, url)
+    
+    def record_play(self, source, song_id, song_name):
+        self.local_index.add_song(source, song_id, song_name, played=True)
+    
+    @pyqtSlot(object, object)
+    def on_queue_rows(self, token, rows):
+        # 后台读取的条目插在启动后新加入的条目之前
+        self.queue_chunk.emit(self.queue.add_loaded(rows))
+    
+    @pyqtSlot(object, object)
+    def on_queue_rows_done(self, token, count):
+        self.queue.finish_loading()
+        self.queue_loaded.emit(count)
+    
+    @pyqtSlot(object, object)
+    def on_queue_rows_failed(self, token, error):
+        self.queue.finish_loading()
+        self.queue_load_failed.emit(error)
+    
+    def on_download_changed(self, item):
+        if item is not None and item["state"] == "done":
+            self.local_index.add_song(item["source"], item["song_id"], item["song_name"], downloaded=True)
+    
+    def check_health(self):
+        for source in SOURCE_HEALTH.due_probes():
+            print(f"探测{PROVIDERS[source].title}是否恢复")
+            self.search_pool.start(Worker(None, probe_source, source))
+        self.health_changed.emit()
+    
+    def source_available(self, source):
+        return SOURCE_HEALTH.available(source)
+    
+    def health_report(self):
+        return {"sources": SOURCE_HEALTH.snapshot(), "races": self.race_stats.stats()}
+    
+    def export_health(self, path=HEALTH_EXPORT_PATH):
+        return SOURCE_HEALTH.export(path)
+
+def main(argv=None):
+    # 不启动界面，直接在命令行中使用引擎
+    parser = argparse.ArgumentParser(description="炫彩音乐播放器引擎")
+    commands = parser.add_subparsers(dest="command", required=True)
+    search_parser = commands.add_parser("search", help="搜索歌曲")
+    search_parser.add_argument("term")
+    search_parser.add_argument("--page", type=int, default=1)
+    search_parser.add_argument("--source", choices=list(PROVIDERS), action="append")
+    for name, help_text in (("resolve", "解析音乐地址"), ("lyrics", "获取歌词")):
+        command_parser = commands.add_parser(name, help=help_text)
+        command_parser.add_argument("source", choices=list(PROVIDERS))
+        command_parser.add_argument("song_id")
+    download_parser = commands.add_parser("download", help="下载歌曲")
+    download_parser.add_argument("source", choices=list(PROVIDERS))
+    download_parser.add_argument("song_id")
+    download_parser.add_argument("song_name", help='保存的文件名，格式为"歌名 - 歌手"')
+    download_parser.add_argument("--dir", default=DOWNLOAD_DIR)
+    args = parser.parse_args(argv)
+    
+    engine = MusicEngine()
+    try:
+        if args.command == "search":
+            page = engine.search(args.term, args.page - 1, args.source)
+            for result in page["results"]:
+                print(f'{result["API_TYPE"]}\t{result["DC_TARGETID"]}\t{result["NAME"]} - {result.get("ARTIST", "")}')
+            for source, error in page["failures"].items():
+                print(f"{PROVIDERS[source].title}搜索失败: {str(error)}")
+            if not page["results"] and page["failures"]:
+                return 1
+            print(f"第 {args.page}/{page['total_pages']} 页")
+        elif args.command == "resolve":
+            print(engine.resolve(args.source, args.song_id))
+        elif args.command == "lyrics":
+            timeline = engine.lyrics(args.source, args.song_id)
+            for time_ms, text in zip(timeline.times, timeline.texts):
+                print(f"[{time_ms // 60000:02d}:{time_ms % 60000 / 1000:05.2f}] {text}")
+        elif args.command == "download":
+            print(engine.download(args.source, args.song_id, args.song_name, args.dir,
+                                  progress_callback=lambda progress: print(f"{progress[0]}/{progress[1]} 字节")))
+    except Exception as e:
+        print(f"出错: {str(e)}")
+        return 1
+    finally:
+        engine.shutdown()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
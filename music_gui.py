@@ -1,46 +1,455 @@
 import sys
-import requests
-import urllib.parse
-import pygame  # 保留一些可能仍需要的pygame功能
 import os
-import numpy as np
-import json
-import re
 import time
 import traceback
+from bisect import bisect_right
+from collections import deque
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
-                           QHBoxLayout, QPushButton, QLineEdit, QListWidget,
+                           QHBoxLayout, QPushButton, QLineEdit, QListWidget, QListView,
                            QLabel, QSlider, QListWidgetItem, QMessageBox,
                            QScrollArea, QFrame, QCheckBox, QTabWidget, 
-                           QComboBox, QToolButton, QAction, QMenu)
+                           QToolButton, QAction, QMenu, QAbstractItemView,
+                           QSpinBox)
 from PyQt5.QtGui import (QIcon, QFont, QPixmap, QPainter, QColor, QLinearGradient, 
-                        QPalette, QRadialGradient, QConicalGradient, QBrush, QPen)
-from PyQt5.QtCore import (Qt, QTimer, QUrl, QRect, QPointF, QSize, 
-                         QPropertyAnimation, QEasingCurve, QThread, pyqtSignal)
-from PyQt5.QtMultimedia import QMediaPlayer, QMediaContent
+                        QPalette, QRadialGradient, QConicalGradient, QBrush, QPen, QPolygonF)
+from PyQt5.QtCore import (Qt, QTimer, QUrl, QRect, QSize, QEvent,
+                         QPropertyAnimation, QEasingCurve, QThread, pyqtSignal,
+                         pyqtSlot, QObject, QAbstractListModel, QModelIndex)
+from PyQt5.QtMultimedia import QMediaPlayer, QMediaContent, QAudioProbe, QAudioFormat
+from music_engine import (MusicEngine, PROVIDERS, SourceHealth, DOWNLOAD_STATE_NAMES, LazyModule,
+                          format_size, normalize_term, parse_lrc)
 
-# 主API
-BASE_URL = "https://www.kuwo.cn/search/searchMusicBykeyWord"
-MP3_BASE_URL = "http://www.xintuo1.cn/music/kw/"
+# numpy只有可视化和频谱分析用到，这些面板在窗口显示之后才创建
+np = LazyModule("numpy")
+requests = LazyModule("requests")
 
-# 备用API
-BACKUP_SEARCH_URL = "https://api.music.imsyy.top/search"
-BACKUP_SONG_URL = "https://api.music.imsyy.top/song/url"
+# 连续播放
+DEFAULT_VOLUME = 70  # 默认音量
+PRELOAD_AHEAD = 15  # 距离结束还有多少秒时预加载下一首
+CROSSFADE_SECONDS = 0  # 淡入淡出时长（秒），0表示无缝衔接
+CROSSFADE_MAX = 12  # 淡入淡出时长的上限（秒）
+FADE_INTERVAL = 50  # 淡入淡出时调整音量的间隔（毫秒）
+POSITION_INTERVAL = 200  # 播放器报告进度的间隔（毫秒）
+GAP_SAMPLES = 20  # 统计曲间间隔时保留的次数
 
-VIP_VER = "1"
-CLIENT = "kt"
-FT = "music"
-CLUSTER = "0"
-STRATEGY = "2012"
-ENCODING = "utf8"
-RFORMAT = "json"
-MOBI = "1"
-ISSUBTITLE = "1"
-SHOW_COPYRIGHT_OFF = "1"
-RN = 20
+# 边输入边搜索
+SEARCH_DEBOUNCE = 350  # 停止输入多久后开始搜索（毫秒）
+SEARCH_MIN_CHARS = 1  # 至少输入几个字符才自动搜索
 
-# 常量定义
-API_TIMEOUT = 15  # API请求超时时间（秒）
+# 播放时多音源竞速解析
+RACE_PLAYBACK = False  # 默认是否开启，可以在音源菜单中切换
+
+# 歌曲列表中保存音源的数据角色，歌曲id保存在Qt.UserRole
+SOURCE_ROLE = Qt.UserRole + 1
+
+# 搜索结果列表
+SONG_LIST_BATCH_SIZE = 200  # 列表一次布局的行数，结果很多时分批布局，不会卡住界面
+BULK_DOWNLOAD_CONFIRM = 100  # 一次下载超过这么多首歌时先确认
+
+# 频谱分析
+SPECTRUM_FFT_SIZE = 2048  # 每次FFT的采样点数
+SPECTRUM_FPS = 60  # 频谱输出的最高帧率
+SPECTRUM_MIN_FREQ = 40  # 最低频段的起始频率（Hz）
+SPECTRUM_MAX_FREQ = 16000  # 最高频段的结束频率（Hz）
+SPECTRUM_DB_RANGE = 70  # 显示的动态范围（dB）
+SPECTRUM_TILT_DB = 3.0  # 每倍频程的补偿，避免高频柱总是很低
+SPECTRUM_ATTACK = 0.6  # 上升时的平滑系数，越大越灵敏
+SPECTRUM_DECAY = 0.15  # 回落时的平滑系数
+PCM_TIMEOUT = 0.5  # 超过该时间没有收到PCM数据时使用模拟效果（秒）
+
+# 动画
+FRAME_RATE = 30  # 可视化和歌词高亮的目标帧率
+WAVE_SPEED = 2.0  # 波浪相位每秒前进的弧度
+
+# 界面样式，程序中只解析一次。原来分散在各部件上的样式表合并到这里，
+# 部件的规则用objectName选择，优先级高于上面的通用规则
+STYLE_SHEET = """
+QMainWindow {
+    background: qlineargradient(x1:0, y1:0, x2:1, y2:1, stop:0 #1a1a2e, stop:1 #16213e);
+}
+QWidget {
+    color: #FFFFFF;
+    font-family: 'Microsoft YaHei', Arial;
+}
+QPushButton {
+    background: qlineargradient(x1:0, y1:0, x2:0, y2:1, stop:0 #0f52ba, stop:1 #0066cc);
+    border-radius: 5px;
+    color: white;
+    padding: 8px 16px;
+    font-size: 14px;
+    font-weight: bold;
+    border: none;
+}
+QPushButton:hover {
+    background: qlineargradient(x1:0, y1:0, x2:0, y2:1, stop:0 #1a75ff, stop:1 #0052cc);
+}
+QPushButton:pressed {
+    background: qlineargradient(x1:0, y1:0, x2:0, y2:1, stop:0 #004080, stop:1 #003366);
+}
+QLineEdit {
+    padding: 8px;
+    background-color: rgba(40, 44, 52, 0.8);
+    border: 1px solid #3d5a80;
+    border-radius: 4px;
+    color: white;
+    font-size: 14px;
+}
+QListView {
+    background-color: rgba(26, 26, 46, 0.7);
+    border: 1px solid #3d5a80;
+    border-radius: 6px;
+    padding: 5px;
+    font-size: 14px;
+    alternate-background-color: rgba(45, 45, 65, 0.7);
+}
+QListView::item {
+    padding: 8px;
+    border-bottom: 1px solid rgba(61, 90, 128, 0.5);
+    border-radius: 3px;
+}
+QListView::item:selected {
+    background: qlineargradient(x1:0, y1:0, x2:1, y2:0, stop:0 #3d5a80, stop:1 #4a6fa5);
+}
+QListView::item:hover {
+    background-color: rgba(61, 90, 128, 0.3);
+}
+QSlider {
+    height: 20px;
+}
+QSlider::groove:horizontal {
+    height: 8px;
+    background: #3d5a80;
+    border-radius: 4px;
+}
+QSlider::handle:horizontal {
+    background: qradialgradient(cx:0.5, cy:0.5, radius:0.5, fx:0.5, fy:0.5, stop:0 #e0fbfc, stop:1 #98c1d9);
+    width: 16px;
+    margin: -4px 0;
+    border-radius: 8px;
+}
+QSlider::handle:horizontal:hover {
+    background: qradialgradient(cx:0.5, cy:0.5, radius:0.5, fx:0.5, fy:0.5, stop:0 #ffffff, stop:1 #a8dadc);
+}
+QLabel {
+    color: #e0fbfc;
+    font-size: 14px;
+}
+QCheckBox {
+    color: #e0fbfc;
+    font-size: 14px;
+}
+QCheckBox::indicator {
+    width: 18px;
+    height: 18px;
+}
+QTabWidget::pane {
+    border: 1px solid #3d5a80;
+    border-radius: 5px;
+    background-color: rgba(26, 26, 46, 0.7);
+}
+QTabBar::tab {
+    background: qlineargradient(x1:0, y1:0, x2:0, y2:1, stop:0 #293241, stop:1 #3d5a80);
+    color: #e0fbfc;
+    padding: 8px 12px;
+    border-top-left-radius: 4px;
+    border-top-right-radius: 4px;
+    margin-right: 2px;
+}
+QTabBar::tab:selected {
+    background: qlineargradient(x1:0, y1:0, x2:0, y2:1, stop:0 #3d5a80, stop:1 #4a6fa5);
+}
+QComboBox {
+    background-color: rgba(40, 44, 52, 0.8);
+    border: 1px solid #3d5a80;
+    border-radius: 4px;
+    padding: 5px;
+    color: #e0fbfc;
+}
+QComboBox::drop-down {
+    width: 20px;
+    border-left: 1px solid #3d5a80;
+}
+QToolButton {
+    background-color: transparent;
+    border: none;
+    border-radius: 4px;
+    color: #e0fbfc;
+}
+QToolButton:hover {
+    background-color: rgba(61, 90, 128, 0.3);
+}
+QFrame {
+    border-radius: 5px;
+}
+
+/* 顶部搜索区域和播放控制区域 */
+#topFrame, #topFrame *, #playerFrame, #playerFrame * {
+    background-color: rgba(26, 26, 46, 0.8);
+    border-radius: 8px;
+}
+#progressFrame, #progressFrame *, #controlFrame, #controlFrame * {
+    background-color: transparent;
+    border: none;
+}
+#lyricsFrame, #lyricsFrame QFrame {
+    background-color: rgba(26, 26, 46, 0.5);
+    border-radius: 8px;
+    border: 1px solid #3d5a80;
+}
+QLabel#titleLabel {
+    color: #e0fbfc;
+    font-size: 18px;
+    font-weight: bold;
+}
+QLineEdit#searchInput {
+    background-color: rgba(40, 44, 52, 0.7);
+    border: 2px solid #3d5a80;
+    border-radius: 20px;
+    padding: 8px 15px;
+    font-size: 14px;
+    color: #e0fbfc;
+}
+QLineEdit#searchInput:focus {
+    border-color: #98c1d9;
+}
+QPushButton#searchButton {
+    background: qlineargradient(x1:0, y1:0, x2:0, y2:1, stop:0 #0f52ba, stop:1 #0066cc);
+    border-radius: 20px;
+    color: white;
+    padding: 8px 25px;
+    font-size: 14px;
+    font-weight: bold;
+    border: none;
+}
+QPushButton#searchButton:hover {
+    background: qlineargradient(x1:0, y1:0, x2:0, y2:1, stop:0 #1a75ff, stop:1 #0052cc);
+}
+QToolButton#sourceButton {
+    background-color: rgba(40, 44, 52, 0.7);
+    border: 2px solid #3d5a80;
+    border-radius: 15px;
+    padding: 5px 10px;
+    min-width: 100px;
+    color: #e0fbfc;
+}
+QToolButton#sourceButton::menu-indicator {
+    subcontrol-position: right center;
+    right: 8px;
+}
+QCheckBox#instantSearchCheck {
+    color: #e0fbfc;
+}
+QTabWidget#contentTabs::pane {
+    border: 1px solid #3d5a80;
+    border-radius: 8px;
+    background-color: rgba(26, 26, 46, 0.7);
+}
+#contentTabs QTabBar::tab {
+    background: qlineargradient(x1:0, y1:0, x2:0, y2:1, stop:0 #293241, stop:1 #3d5a80);
+    color: #e0fbfc;
+    padding: 10px 15px;
+    border-top-left-radius: 6px;
+    border-top-right-radius: 6px;
+    margin-right: 2px;
+    font-weight: bold;
+}
+#contentTabs QTabBar::tab:selected {
+    background: qlineargradient(x1:0, y1:0, x2:0, y2:1, stop:0 #3d5a80, stop:1 #4a6fa5);
+}
+QWidget#visualizer {
+    background-color: transparent;
+}
+/* 歌词按距离当前行的远近使用不同的样式 */
+#lyricsFrame QLabel#lyricLine0 {
+    color: #a8dadc;
+    font-weight: bold;
+    font-size: 16px;
+    background-color: rgba(61, 90, 128, 0.3);
+    border-radius: 4px;
+    padding: 4px;
+}
+#lyricsFrame QLabel#lyricLine1 {
+    color: rgba(224, 251, 252, 0.7);
+    font-size: 13px;
+}
+#lyricsFrame QLabel#lyricLine2 {
+    color: rgba(224, 251, 252, 0.6);
+    font-size: 12px;
+}
+#lyricsFrame QLabel#lyricLine3 {
+    color: rgba(224, 251, 252, 0.5);
+    font-size: 11px;
+}
+QLabel#nowPlaying {
+    color: #a8dadc;
+    margin: 5px 0;
+}
+QLabel#timeLabel, QLabel#downloadStatus {
+    color: #a8dadc;
+    font-size: 12px;
+}
+QLabel#volumeIcon {
+    color: #a8dadc;
+    font-size: 16px;
+}
+QSlider#volumeSlider::groove:horizontal {
+    height: 4px;
+    background: #3d5a80;
+    border-radius: 2px;
+}
+QSlider#volumeSlider::handle:horizontal {
+    background: #e0fbfc;
+    width: 10px;
+    margin: -3px 0;
+    border-radius: 5px;
+}
+QPushButton#controlButton {
+    background-color: #3d5a80;
+    border-radius: 20px;
+    color: white;
+    font-size: 16px;
+    font-weight: bold;
+    border: none;
+    padding: 0;
+}
+QPushButton#controlButton:hover {
+    background-color: #4a6fa5;
+}
+QPushButton#controlButton:pressed {
+    background-color: #293241;
+}
+QPushButton#controlButton:disabled {
+    background-color: #293241;
+    color: #7d8597;
+}
+"""
+
+
+def pcm_to_mono(raw, audio_format):
+    # audio_format为(采样率, 声道数, 采样位数, 采样类型, 是否小端)
+    sample_rate, channels, sample_size, sample_type, little_endian = audio_format
+    order = "<" if little_endian else ">"
+    if sample_type == QAudioFormat.Float and sample_size == 32:
+        samples = np.frombuffer(raw, order + "f4")
+    elif sample_type == QAudioFormat.SignedInt and sample_size in (8, 16, 32):
+        samples = np.frombuffer(raw, f"{order}i{sample_size // 8}") / float(2 ** (sample_size - 1))
+    elif sample_type == QAudioFormat.UnSignedInt and sample_size == 8:
+        samples = (np.frombuffer(raw, np.uint8) - 128.0) / 128.0
+    else:
+        return None
+    
+    if channels > 1:
+        samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1)
+    return samples.astype(np.float32, copy=False)
+
+class SpectrumAnalyzer(QObject):
+    """在后台线程中对播放的PCM数据做加窗FFT，输出对数分布的频段强度(0~1)"""
+    spectrum_ready = pyqtSignal(object)
+    
+    def __init__(self, bands, fft_size=SPECTRUM_FFT_SIZE, fps=SPECTRUM_FPS):
+        super().__init__()
+        self.bands = bands
+        self.fft_size = fft_size
+        self.interval = 1.0 / fps
+        self.window = np.hanning(fft_size).astype(np.float32)
+        # 满幅正弦波对应0dB
+        self.reference = (self.window.sum() / 2) ** 2
+        self.samples = np.zeros(fft_size, np.float32)
+        self.levels = np.zeros(bands)
+        self.band_layout = {}  # 采样率 -> (频段边界, 频段宽度, 倾斜补偿)
+        self.last_emit = 0
+    
+    def layout_for(self, sample_rate):
+        layout = self.band_layout.get(sample_rate)
+        if layout is None:
+            # 频段边界按对数分布，每个频段至少包含一个FFT频点
+            max_freq = min(SPECTRUM_MAX_FREQ, sample_rate / 2)
+            edges_hz = np.geomspace(SPECTRUM_MIN_FREQ, max_freq, self.bands + 1)
+            edges = np.round(edges_hz * self.fft_size / sample_rate).astype(int)
+            steps = np.arange(len(edges))
+            edges = np.maximum.accumulate(edges - steps) + steps
+            edges = np.minimum(edges, self.fft_size // 2 + 1 - (len(edges) - 1 - steps))
+            centers = np.sqrt(edges_hz[:-1] * edges_hz[1:])
+            tilt = SPECTRUM_TILT_DB * np.log2(centers / 1000.0)
+            layout = (edges, np.diff(edges), tilt)
+            self.band_layout[sample_rate] = layout
+        return layout
+    
+    @pyqtSlot(object, object)
+    def process(self, raw, audio_format):
+        samples = pcm_to_mono(raw, audio_format)
+        if samples is None or not len(samples):
+            return
+        
+        # 只保留最近fft_size个采样点
+        if len(samples) >= self.fft_size:
+            self.samples[:] = samples[-self.fft_size:]
+        else:
+            self.samples = np.roll(self.samples, -len(samples))
+            self.samples[-len(samples):] = samples
+        
+        now = time.monotonic()
+        if now - self.last_emit < self.interval:
+            return
+        self.last_emit = now
+        
+        edges, widths, tilt = self.layout_for(audio_format[0])
+        power = np.abs(np.fft.rfft(self.samples * self.window)) ** 2 / self.reference
+        band_power = np.add.reduceat(power[:edges[-1]], edges[:-1]) / widths
+        db = 10 * np.log10(band_power + 1e-12) + tilt
+        target = np.clip(1 + db / SPECTRUM_DB_RANGE, 0, 1)
+        
+        # 上升快、回落慢
+        coefficient = np.where(target > self.levels, SPECTRUM_ATTACK, SPECTRUM_DECAY)
+        self.levels += (target - self.levels) * coefficient
+        self.spectrum_ready.emit(self.levels.copy())
+
+class FrameClock(QObject):
+    """统一的动画时钟，可视化相位、频谱和歌词高亮都在同一帧里更新"""
+    tick = pyqtSignal(float)  # 距上一帧的秒数
+    fps_measured = pyqtSignal(float)  # 每秒汇报一次实际帧率
+    
+    def __init__(self, fps=FRAME_RATE, parent=None):
+        super().__init__(parent)
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self.on_timeout)
+        self.set_fps(fps)
+        self.last_tick = None
+        self.frames = 0
+        self.window_start = 0
+        self.measured_fps = 0.0
+    
+    def set_fps(self, fps):
+        self.timer.setInterval(max(1, round(1000 / fps)))
+    
+    def is_running(self):
+        return self.timer.isActive()
+    
+    def start(self):
+        if not self.timer.isActive():
+            self.last_tick = None
+            self.frames = 0
+            self.window_start = time.monotonic()
+            self.timer.start()
+    
+    def stop(self):
+        self.timer.stop()
+        self.measured_fps = 0.0
+    
+    def on_timeout(self):
+        now = time.monotonic()
+        dt = now - self.last_tick if self.last_tick is not None else self.timer.interval() / 1000
+        self.last_tick = now
+        
+        self.frames += 1
+        if now - self.window_start >= 1.0:
+            self.measured_fps = self.frames / (now - self.window_start)
+            self.frames = 0
+            self.window_start = now
+            self.fps_measured.emit(self.measured_fps)
+        
+        self.tick.emit(dt)
 
 class VisualizerWidget(QWidget):
     def __init__(self, parent=None):
@@ -50,26 +459,62 @@ class VisualizerWidget(QWidget):
         self.bar_values = np.zeros(self.bars)
         self.active = False
         
-        # 设置动画计时器
-        self.animation_timer = QTimer(self)
-        self.animation_timer.setInterval(50)
-        self.animation_timer.timeout.connect(self.update_animation)
-        self.animation_timer.start()
-        
         # 动画参数
         self.phase = 0
         self.waves = 3  # 波浪数量
         
+        # 绘制用的画笔、画刷和坐标只在尺寸变化时重建
+        self.wave_pens = []
+        for wave in range(self.waves):
+            # 为每条波浪线设置不同颜色
+            hue = 180 + 120 * (wave / self.waves)
+            self.wave_pens.append(QPen(QColor.fromHsv(int(hue), 200, 250, 150), 2))
+        self.bar_offsets = np.arange(self.bars) * 0.1
+        self.background_brush = None
+        self.bar_brushes = []
+        self.wave_x = None
+        self.wave_polygon = None
+        self.wave_points = None
+        self.rebuild_cache()
+    
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.rebuild_cache()
+    
+    def rebuild_cache(self):
+        width = self.width()
+        height = self.height()
+        
+        # 渐变背景
+        gradient = QLinearGradient(0, 0, width, 0)
+        gradient.setColorAt(0, QColor(26, 26, 46, 200))
+        gradient.setColorAt(0.5, QColor(40, 50, 78, 200))
+        gradient.setColorAt(1, QColor(26, 26, 46, 200))
+        self.background_brush = QBrush(gradient)
+        
+        # 每个频谱柱的彩虹色垂直渐变
+        self.bar_brushes = []
+        for i in range(self.bars):
+            hue = int(250 * i / self.bars)
+            gradient = QLinearGradient(0, height, 0, 0)
+            gradient.setColorAt(0, QColor.fromHsv(hue, 220, 250))
+            gradient.setColorAt(1, QColor.fromHsv(hue, 150, 250, 200))
+            self.bar_brushes.append(QBrush(gradient))
+        
+        # 波浪线的点直接写入QPolygonF的内存，每帧只更新y坐标
+        self.wave_x = np.arange(0, max(width, 2), 2, dtype=np.float64)
+        self.wave_polygon = QPolygonF(len(self.wave_x))
+        buffer = self.wave_polygon.data()
+        buffer.setsize(len(self.wave_x) * 2 * 8)
+        self.wave_points = np.frombuffer(buffer, np.float64).reshape(-1, 2)
+        self.wave_points[:, 0] = self.wave_x
+    
     def paintEvent(self, event):
         painter = QPainter(self)
         painter.setRenderHint(QPainter.Antialiasing)
         
         # 设置渐变背景
-        gradient = QLinearGradient(0, 0, self.width(), 0)
-        gradient.setColorAt(0, QColor(26, 26, 46, 200))
-        gradient.setColorAt(0.5, QColor(40, 50, 78, 200))
-        gradient.setColorAt(1, QColor(26, 26, 46, 200))
-        painter.fillRect(self.rect(), gradient)
+        painter.fillRect(self.rect(), self.background_brush)
         
         # 如果没有活跃数据，绘制静态波形
         if not self.active:
@@ -78,61 +523,37 @@ class VisualizerWidget(QWidget):
             self.draw_bars(painter)
     
     def draw_static_wave(self, painter):
-        width = self.width()
-        height = self.height()
-        mid_height = height / 2
+        mid_height = self.height() / 2
         
         # 绘制多条波浪线
         for wave in range(self.waves):
-            # 为每条波浪线设置不同颜色
-            hue = 180 + 120 * (wave / self.waves)
-            painter.setPen(QPen(QColor.fromHsv(int(hue), 200, 250, 150), 2))
-            
-            # 绘制波浪线
-            points = []
+            painter.setPen(self.wave_pens[wave])
             amplitude = 15 - wave * 3  # 振幅逐渐减小
             frequency = 0.02 + wave * 0.01  # 频率逐渐增加
             
-            for x in range(0, width, 2):
-                # 使用多个正弦波叠加制造更自然的波形
-                y = mid_height + amplitude * np.sin(frequency * x + self.phase) * (0.8 + 0.2 * np.sin(frequency * x * 0.3))
-                points.append(QPointF(x, y))
-            
-            # 绘制连线
-            for i in range(len(points) - 1):
-                painter.drawLine(points[i], points[i + 1])
+            # 使用多个正弦波叠加制造更自然的波形，整条线一次算完、一次画完
+            fx = frequency * self.wave_x
+            self.wave_points[:, 1] = mid_height + amplitude * np.sin(fx + self.phase) * (0.8 + 0.2 * np.sin(fx * 0.3))
+            painter.drawPolyline(self.wave_polygon)
     
     def draw_bars(self, painter):
         width = self.width()
         height = self.height()
         bar_width = width / self.bars
         
+        # 计算柱状高度，加入一些随机波动使显示更自然
+        variance = 0.1 * np.sin(self.phase * 0.2 + self.bar_offsets)
+        bar_heights = np.maximum(3, (self.bar_values + variance) * height * 0.8).astype(int)
+        
+        painter.setPen(Qt.NoPen)
         for i in range(self.bars):
-            # 创建彩虹色渐变效果
-            hue = int(250 * i / self.bars)
-            # 使柱状图对称
-            mirror_i = self.bars - 1 - i if i > self.bars // 2 else i
-            bar_color = QColor.fromHsv(hue, 220, 250)
-            
-            # 创建垂直渐变
-            gradient = QLinearGradient(0, height, 0, 0)
-            gradient.setColorAt(0, bar_color)
-            gradient.setColorAt(1, QColor.fromHsv(hue, 150, 250, 200))
-            
-            painter.setBrush(QBrush(gradient))
-            painter.setPen(Qt.NoPen)
-            
-            # 计算柱状高度，加入一些随机波动使显示更自然
-            variance = 0.1 * np.sin(self.phase * 0.2 + i * 0.1)
-            bar_height = max(3, (self.bar_values[i] + variance) * height * 0.8)
-            
+            painter.setBrush(self.bar_brushes[i])
             x = i * bar_width
-            y = height - bar_height
             
             # 绘制圆角矩形
             painter.drawRoundedRect(
-                int(x + bar_width * 0.1), int(y),
-                int(bar_width * 0.8), int(bar_height),
+                int(x + bar_width * 0.1), height - bar_heights[i],
+                int(bar_width * 0.8), bar_heights[i],
                 4, 4
             )
     
@@ -155,21 +576,26 @@ class VisualizerWidget(QWidget):
             self.bar_values = self.bar_values * 0.7 + new_values * 0.3
         else:
             self.bar_values = values
-        
-        self.update()
     
-    def update_animation(self):
-        # 更新动画阶段
-        self.phase += 0.1
+    def advance(self, dt):
+        # 由统一的动画时钟驱动，每帧只重绘一次
+        self.phase += WAVE_SPEED * dt
         if self.phase > 2 * np.pi:
             self.phase -= 2 * np.pi
         self.update()
+    
+    def reset(self):
+        # 停止播放后恢复静态波形
+        self.active = False
+        self.bar_values = np.zeros(self.bars)
+        self.update()
 
 # 添加歌词组件
 class LyricsWidget(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.lyrics = []
+        self.times = []  # 每行歌词的时间戳，用于二分查找
+        self.texts = []
         self.current_time = 0
         self.current_line = -1
         
@@ -186,78 +612,64 @@ class LyricsWidget(QWidget):
             label.setAlignment(Qt.AlignCenter)
             label.setWordWrap(True)
             
-            # 根据位置设置不同的样式
-            if i == 3:  # 当前行
-                label.setStyleSheet("""
-                    color: #a8dadc; 
-                    font-weight: bold; 
-                    font-size: 16px;
-                    background-color: rgba(61, 90, 128, 0.3);
-                    border-radius: 4px;
-                    padding: 4px;
-                """)
-            else:
-                # 距离中心越远，透明度越高
-                opacity = 0.5 + 0.1 * (3 - abs(i - 3))
-                label.setStyleSheet(f"""
-                    color: rgba(224, 251, 252, {opacity});
-                    font-size: {14 - abs(i - 3)}px;
-                """)
+            # 样式按距离当前行（第3行）的远近固定，见STYLE_SHEET，之后只更新文字
+            label.setObjectName(f"lyricLine{abs(i - 3)}")
             
             layout.addWidget(label)
             self.labels.append(label)
         
-    def set_lyrics(self, lyrics_text):
-        if not lyrics_text:
-            self.show_no_lyrics()
-            return
-            
+    def set_lyrics(self, lyrics):
+        # lyrics可以是LRC文本，也可以是已经解析好的LyricTimeline
         try:
-            # 清理和解析歌词
-            self.lyrics = []
-            lines = lyrics_text.strip().split("\n")
-            
-            for line in lines:
-                match = re.match(r'\[(\d+):(\d+\.\d+)\](.*)', line)
-                if match:
-                    minutes, seconds, text = match.groups()
-                    time_ms = int(minutes) * 60 * 1000 + float(seconds) * 1000
-                    if text.strip():  # 不添加空白歌词
-                        self.lyrics.append((time_ms, text.strip()))
-            
-            # 按时间排序
-            self.lyrics.sort(key=lambda x: x[0])
-            
-            # 显示初始歌词
-            self.current_line = -1
-            self.update_display(0)
+            timeline = parse_lrc(lyrics) if isinstance(lyrics, str) else lyrics
         except Exception as e:
             print(f"解析歌词出错: {e}")
             traceback.print_exc()
+            timeline = None
+        
+        if not timeline:
             self.show_no_lyrics()
+            return
+        
+        self.times = timeline.times
+        self.texts = timeline.texts
+        
+        # 显示初始歌词，-2保证第一行出现之前也会刷新显示
+        self.current_line = -2
+        self.update_display(0)
     
-    def show_no_lyrics(self):
+    def show_no_lyrics(self, message="暂无歌词"):
         for i, label in enumerate(self.labels):
             if i == 3:
-                label.setText("暂无歌词")
+                label.setText(message)
             else:
                 label.setText("")
-        self.lyrics = []
+        self.times = []
+        self.texts = []
         self.current_line = -1
+    
+    def find_line(self, current_time_ms):
+        times = self.times
+        line_idx = self.current_line
+        
+        # 正常播放时只需要检查当前行和下一行
+        if 0 <= line_idx < len(times) and times[line_idx] <= current_time_ms:
+            if line_idx + 1 == len(times) or current_time_ms < times[line_idx + 1]:
+                return line_idx
+            if line_idx + 2 == len(times) or current_time_ms < times[line_idx + 2]:
+                return line_idx + 1
+        
+        # 拖动进度条等跳转时二分查找
+        return bisect_right(times, current_time_ms) - 1
         
     def update_display(self, current_time_ms):
-        if not self.lyrics:
+        if not self.times:
             return
             
         self.current_time = current_time_ms
         
         # 找到当前应该显示的歌词行
-        line_idx = -1
-        for i, (time, _) in enumerate(self.lyrics):
-            if time <= current_time_ms:
-                line_idx = i
-            else:
-                break
+        line_idx = self.find_line(current_time_ms)
         
         # 如果当前行没变，不需要更新
         if line_idx == self.current_line:
@@ -265,181 +677,198 @@ class LyricsWidget(QWidget):
             
         self.current_line = line_idx
         
-        # 创建滚动动画效果
+        # 创建滚动动画效果，当前行显示在中间位置
         for i, label in enumerate(self.labels):
-            idx = self.current_line + i - 3  # 当前行显示在中间位置
-            if 0 <= idx < len(self.lyrics):
-                label.setText(self.lyrics[idx][1])
-                
-                # 当前播放行应用特殊动画效果
-                if i == 3:
-                    label.setStyleSheet("""
-                        color: #a8dadc; 
-                        font-weight: bold; 
-                        font-size: 16px;
-                        background-color: rgba(61, 90, 128, 0.3);
-                        border-radius: 4px;
-                        padding: 4px;
-                    """)
-                else:
-                    # 距离中心越远，透明度越高
-                    opacity = 0.5 + 0.1 * (3 - abs(i - 3))
-                    label.setStyleSheet(f"""
-                        color: rgba(224, 251, 252, {opacity});
-                        font-size: {14 - abs(i - 3)}px;
-                    """)
-            else:
-                label.setText("")
+            idx = self.current_line + i - 3
+            text = self.texts[idx] if 0 <= idx < len(self.texts) else ""
+            if label.text() != text:
+                label.setText(text)
+
+class SongListModel(QAbstractListModel):
+    """搜索结果列表的数据模型，视图只向模型取可见行的数据，上万条结果也不用逐行创建条目
+    
+    结果由引擎一批批追加，滚动到底部时视图通过canFetchMore/fetchMore请求下一批。
+    """
+    def __init__(self, engine, parent=None):
+        super().__init__(parent)
+        self.engine = engine
+        self.rows = []
+        self.keys = []  # 每行的(音源, 歌曲id)，用于判断新结果是否只是追加
+        self.show_source = False  # 启用了多个音源时在提示中显示歌曲来自哪个音源
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+    
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self.rows[index.row()]
+        if role == Qt.DisplayRole:
+            # 添加更多信息，帮助用户选择歌曲
+            album = row.get("ALBUM", "")
+            album_text = f" - {album}" if album else ""
+            return f'{row["NAME"]} - {row.get("ARTIST", "未知歌手")}{album_text}'
+        if role == Qt.UserRole:
+            return row["DC_TARGETID"]
+        if role == SOURCE_ROLE:
+            return row.get("API_TYPE") or "main"
+        if role == Qt.ForegroundRole and row.get("LOCAL"):
+            return QColor("#98c1d9")
+        if role == Qt.ToolTipRole:
+            if row.get("LOCAL"):
+                return "本地记录中的歌曲"
+            if self.show_source:
+                return PROVIDERS[row.get("API_TYPE") or "main"].title
+        return None
+    
+    def canFetchMore(self, parent):
+        return not parent.isValid() and self.engine.can_fetch_more()
+    
+    def fetchMore(self, parent):
+        if not parent.isValid():
+            self.engine.fetch_more()
+    
+    def set_results(self, rows, show_source):
+        # 后面的结果到达时只插入新的行，不打断用户的选择和滚动位置；其他变化整个列表重新显示
+        keys = [(row.get("API_TYPE") or "main", row["DC_TARGETID"]) for row in rows]
+        self.show_source = show_source
+        count = len(self.keys)
+        if keys[:count] != self.keys:
+            self.beginResetModel()
+            self.rows, self.keys = rows, keys
+            self.endResetModel()
+        elif len(keys) > count:
+            self.beginInsertRows(QModelIndex(), count, len(keys) - 1)
+            self.rows, self.keys = rows, keys
+            self.endInsertRows()
+        else:
+            self.rows = rows
 
 class MusicPlayer(QMainWindow):
+    pcm_ready = pyqtSignal(object, object)  # (PCM数据, 音频格式)
+    
     def __init__(self):
         super().__init__()
         self.setWindowTitle("炫彩音乐播放器")
         self.setMinimumSize(900, 700)
         
-        # 设置应用整体样式
-        self.setStyleSheet("""
-            QMainWindow {
-                background: qlineargradient(x1:0, y1:0, x2:1, y2:1, stop:0 #1a1a2e, stop:1 #16213e);
-            }
-            QWidget {
-                color: #FFFFFF;
-                font-family: 'Microsoft YaHei', Arial;
-            }
-            QPushButton {
-                background: qlineargradient(x1:0, y1:0, x2:0, y2:1, stop:0 #0f52ba, stop:1 #0066cc);
-                border-radius: 5px;
-                color: white;
-                padding: 8px 16px;
-                font-size: 14px;
-                font-weight: bold;
-                border: none;
-            }
-            QPushButton:hover {
-                background: qlineargradient(x1:0, y1:0, x2:0, y2:1, stop:0 #1a75ff, stop:1 #0052cc);
-            }
-            QPushButton:pressed {
-                background: qlineargradient(x1:0, y1:0, x2:0, y2:1, stop:0 #004080, stop:1 #003366);
-            }
-            QLineEdit {
-                padding: 8px;
-                background-color: rgba(40, 44, 52, 0.8);
-                border: 1px solid #3d5a80;
-                border-radius: 4px;
-                color: white;
-                font-size: 14px;
-            }
-            QListWidget {
-                background-color: rgba(26, 26, 46, 0.7);
-                border: 1px solid #3d5a80;
-                border-radius: 6px;
-                padding: 5px;
-                font-size: 14px;
-                alternate-background-color: rgba(45, 45, 65, 0.7);
-            }
-            QListWidget::item {
-                padding: 8px;
-                border-bottom: 1px solid rgba(61, 90, 128, 0.5);
-                border-radius: 3px;
-            }
-            QListWidget::item:selected {
-                background: qlineargradient(x1:0, y1:0, x2:1, y2:0, stop:0 #3d5a80, stop:1 #4a6fa5);
-            }
-            QListWidget::item:hover {
-                background-color: rgba(61, 90, 128, 0.3);
-            }
-            QSlider {
-                height: 20px;
-            }
-            QSlider::groove:horizontal {
-                height: 8px;
-                background: #3d5a80;
-                border-radius: 4px;
-            }
-            QSlider::handle:horizontal {
-                background: qradialgradient(cx:0.5, cy:0.5, radius:0.5, fx:0.5, fy:0.5, stop:0 #e0fbfc, stop:1 #98c1d9);
-                width: 16px;
-                margin: -4px 0;
-                border-radius: 8px;
-            }
-            QSlider::handle:horizontal:hover {
-                background: qradialgradient(cx:0.5, cy:0.5, radius:0.5, fx:0.5, fy:0.5, stop:0 #ffffff, stop:1 #a8dadc);
-            }
-            QLabel {
-                color: #e0fbfc;
-                font-size: 14px;
-            }
-            QCheckBox {
-                color: #e0fbfc;
-                font-size: 14px;
-            }
-            QCheckBox::indicator {
-                width: 18px;
-                height: 18px;
-            }
-            QTabWidget::pane {
-                border: 1px solid #3d5a80;
-                border-radius: 5px;
-                background-color: rgba(26, 26, 46, 0.7);
-            }
-            QTabBar::tab {
-                background: qlineargradient(x1:0, y1:0, x2:0, y2:1, stop:0 #293241, stop:1 #3d5a80);
-                color: #e0fbfc;
-                padding: 8px 12px;
-                border-top-left-radius: 4px;
-                border-top-right-radius: 4px;
-                margin-right: 2px;
-            }
-            QTabBar::tab:selected {
-                background: qlineargradient(x1:0, y1:0, x2:0, y2:1, stop:0 #3d5a80, stop:1 #4a6fa5);
-            }
-            QComboBox {
-                background-color: rgba(40, 44, 52, 0.8);
-                border: 1px solid #3d5a80;
-                border-radius: 4px;
-                padding: 5px;
-                color: #e0fbfc;
-            }
-            QComboBox::drop-down {
-                width: 20px;
-                border-left: 1px solid #3d5a80;
-            }
-            QToolButton {
-                background-color: transparent;
-                border: none;
-                border-radius: 4px;
-                color: #e0fbfc;
-            }
-            QToolButton:hover {
-                background-color: rgba(61, 90, 128, 0.3);
-            }
-            QFrame {
-                border-radius: 5px;
-            }
-        """)
+        # 整个窗口只设置一次样式表，各部件通过objectName匹配自己的规则
+        self.setStyleSheet(STYLE_SHEET)
         
         self.init_ui()
-        self.current_page = 0
-        self.total_pages = 0
-        self.search_results = []
         self.current_song_id = None
         self.current_song_name = None
+        self.current_source = "main"
         self.is_playing = False
-        self.use_backup_api = False
         self.song_duration = 0
         
-        # 创建媒体播放器
-        self.media_player = QMediaPlayer(self)
-        self.media_player.setVolume(70)  # 设置默认音量为70%
-        self.media_player.positionChanged.connect(self.position_changed)
-        self.media_player.durationChanged.connect(self.duration_changed)
-        self.media_player.stateChanged.connect(self.media_state_changed)
-        self.media_player.mediaStatusChanged.connect(self.media_status_changed)
+        # 搜索、地址解析、歌词、下载和播放列表都由引擎处理，界面只负责显示
+        self.engine = MusicEngine(parent=self)
+        self.play_queue = self.engine.queue
+        self.download_manager = self.engine.downloads
+        self.engine.search_updated.connect(self.on_search_updated)
+        self.engine.search_failed.connect(self.on_search_failed)
+        self.engine.stream_ready.connect(self.on_stream_ready)
+        self.engine.stream_failed.connect(self.on_stream_failed)
+        self.engine.lyrics_ready.connect(self.on_lyrics_loaded)
+        self.engine.lyrics_failed.connect(self.on_lyrics_failed)
+        self.engine.queue_chunk.connect(self.on_queue_chunk)
+        self.engine.queue_loaded.connect(self.on_queue_loaded)
+        self.engine.queue_load_failed.connect(self.on_queue_load_failed)
+        self.engine.health_changed.connect(self.refresh_source_health)
+        
+        self.enabled_sources = list(PROVIDERS)
+        self.last_sent_term = None
+        
+        # 搜索结果列表直接显示引擎中的结果，滚动到底部时由模型向引擎请求下一批
+        self.song_model = SongListModel(self.engine, self)
+        self.song_list.setModel(self.song_model)
+        self.song_list.selectionModel().currentChanged.connect(self.prefetch_selected_url)
+        
+        # 输入停止一段时间后自动搜索
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE)
+        self.search_timer.timeout.connect(self.incremental_search)
+        
+        # play_generation用于识别最新的一次播放，preload_generation用于识别最新的一次预加载
+        self.play_generation = 0
+        self.current_url = None
+        self.current_url_cached = False
+        
+        # 下载队列，上次未完成的下载会继续进行
+        self.download_items = {}  # 条目id -> 下载列表中的行
+        self.download_manager.changed.connect(self.on_download_changed)
+        self.on_download_changed(None)
+        
+        # 播放列表和播放历史保存在本地数据库中，已有的条目由引擎在后台分块加载
+        self.queue_items = {}  # 节点id -> 播放列表中的行
+        self.queue_loaded_rows = 0
+        self.playlist_list.setEnabled(False)
+        self.gap_label.setText("正在加载播放列表…")
+        self.engine.start()
+        
+        # 两个播放器轮流使用：media_player正在播放，next_player提前缓冲下一首
+        self.volume = DEFAULT_VOLUME
+        self.crossfade_seconds = CROSSFADE_SECONDS
+        self.media_player = self.create_player()
+        self.next_player = self.create_player()
+        self.bind_players(True)
+        self.preload = None  # 预加载的条目信息
+        self.preload_generation = 0
+        
+        # 淡入淡出期间旧的播放器继续播放，音量逐渐降低
+        self.fading_out = None
+        self.fade_started = 0
+        self.fade_timer = QTimer(self)
+        self.fade_timer.setInterval(FADE_INTERVAL)
+        self.fade_timer.timeout.connect(self.fade_step)
+        
+        # 曲间间隔测量：旧歌曲结束和新歌曲开始发声的时间
+        self.handoff = None
+        self.gap_samples = deque(maxlen=GAP_SAMPLES)
+        
+        # 频谱分析和可视化一起在build_panels中创建
+        self.last_pcm_time = 0
+        self.analyzer = None
+        self.analyzer_thread = None
+        self.audio_probe = None
+        
+        # 可视化、频谱和歌词共用一个动画时钟，窗口不可见或停止播放时暂停
+        self.latest_spectrum = None
+        self.frame_clock = FrameClock(FRAME_RATE, self)
+        self.frame_clock.tick.connect(self.on_frame)
+        self.frame_clock.fps_measured.connect(
+            lambda fps: self.visualizer.setToolTip(f"动画帧率: {fps:.1f} FPS"))
+        self.refresh_source_health()
+    
+    def build_panels(self):
+        # 可视化、歌词和频谱分析不影响第一次显示，窗口画出来之后再创建，numpy也在这时才导入
+        if self.visualizer is not None:
+            return
+        self.visualizer = VisualizerWidget()
+        self.visualizer.setMinimumHeight(100)
+        self.visualizer.setObjectName("visualizer")
+        self.player_layout.replaceWidget(self.visualizer_placeholder, self.visualizer)
+        self.visualizer_placeholder.deleteLater()
+        self.visualizer_placeholder = None
         
-        # 创建定时器用于更新可视化效果
-        self.visualizer_timer = QTimer(self)
-        self.visualizer_timer.setInterval(50)  # 更快的更新频率
-        self.visualizer_timer.timeout.connect(self.update_visualizer)
+        self.lyrics_widget = LyricsWidget()
+        self.lyrics_frame.layout().addWidget(self.lyrics_widget)
+        
+        # 截取播放中的PCM数据，在后台线程中计算频谱
+        self.analyzer = SpectrumAnalyzer(self.visualizer.bars)
+        self.analyzer_thread = QThread(self)
+        self.analyzer.moveToThread(self.analyzer_thread)
+        self.pcm_ready.connect(self.analyzer.process)
+        self.analyzer.spectrum_ready.connect(self.on_spectrum)
+        self.analyzer_thread.start()
+        
+        self.audio_probe = QAudioProbe(self)
+        self.audio_probe.audioBufferProbed.connect(self.on_audio_buffer)
+        if not self.audio_probe.setSource(self.media_player):
+            # 部分平台的多媒体后端不支持截取音频，此时使用模拟的频谱效果
+            print("当前平台不支持音频截取，使用模拟频谱")
         
     def init_ui(self):
         central_widget = QWidget()
@@ -449,12 +878,12 @@ class MusicPlayer(QMainWindow):
         
         # 顶部搜索区域
         top_frame = QFrame()
-        top_frame.setStyleSheet("background-color: rgba(26, 26, 46, 0.8); border-radius: 8px;")
+        top_frame.setObjectName("topFrame")
         top_layout = QVBoxLayout(top_frame)
         
         # 搜索区域标题
         title_label = QLabel("炫彩音乐搜索")
-        title_label.setStyleSheet("color: #e0fbfc; font-size: 18px; font-weight: bold;")
+        title_label.setObjectName("titleLabel")
         title_label.setAlignment(Qt.AlignCenter)
         top_layout.addWidget(title_label)
         
@@ -463,127 +892,127 @@ class MusicPlayer(QMainWindow):
         self.search_input = QLineEdit()
         self.search_input.setPlaceholderText("请输入歌手或歌曲名")
         self.search_input.returnPressed.connect(self.search_music)
+        self.search_input.textChanged.connect(self.schedule_incremental_search)
         
         # 美化搜索框
-        self.search_input.setStyleSheet("""
-            QLineEdit {
-                background-color: rgba(40, 44, 52, 0.7);
-                border: 2px solid #3d5a80;
-                border-radius: 20px;
-                padding: 8px 15px;
-                font-size: 14px;
-                color: #e0fbfc;
-            }
-            QLineEdit:focus {
-                border-color: #98c1d9;
-            }
-        """)
+        self.search_input.setObjectName("searchInput")
         
         self.search_btn = QPushButton("搜索")
         self.search_btn.clicked.connect(self.search_music)
-        self.search_btn.setStyleSheet("""
-            QPushButton {
-                background: qlineargradient(x1:0, y1:0, x2:0, y2:1, stop:0 #0f52ba, stop:1 #0066cc);
-                border-radius: 20px;
-                color: white;
-                padding: 8px 25px;
-                font-size: 14px;
-                font-weight: bold;
-                border: none;
-            }
-            QPushButton:hover {
-                background: qlineargradient(x1:0, y1:0, x2:0, y2:1, stop:0 #1a75ff, stop:1 #0052cc);
-            }
-        """)
-        
-        # 添加API选择下拉框
-        self.api_combo = QComboBox()
-        self.api_combo.addItem("默认音源")
-        self.api_combo.addItem("备用音源")
-        self.api_combo.currentIndexChanged.connect(self.change_api)
-        self.api_combo.setStyleSheet("""
-            QComboBox {
-                background-color: rgba(40, 44, 52, 0.7);
-                border: 2px solid #3d5a80;
-                border-radius: 15px;
-                padding: 5px 10px;
-                min-width: 120px;
-                color: #e0fbfc;
-            }
-            QComboBox::drop-down {
-                border: none;
-                border-left: 1px solid #3d5a80;
-                width: 30px;
-            }
-            QComboBox QAbstractItemView {
-                background-color: rgba(26, 26, 46, 0.9);
-                border: 1px solid #3d5a80;
-                selection-background-color: #4a6fa5;
-                color: #e0fbfc;
-            }
-        """)
+        self.search_btn.setObjectName("searchButton")
+        
+        # 音源选择菜单，可以同时启用多个音源
+        self.source_btn = QToolButton()
+        self.source_btn.setText("音源")
+        self.source_btn.setPopupMode(QToolButton.InstantPopup)
+        source_menu = QMenu(self.source_btn)
+        self.source_actions = {}
+        for name, provider in PROVIDERS.items():
+            action = source_menu.addAction(provider.title)
+            action.setCheckable(True)
+            action.setChecked(True)
+            action.toggled.connect(self.change_sources)
+            self.source_actions[name] = action
+        source_menu.addSeparator()
+        self.race_action = source_menu.addAction("播放时多源竞速")
+        self.race_action.setCheckable(True)
+        self.race_action.setChecked(RACE_PLAYBACK)
+        source_menu.addAction("导出音源状态").triggered.connect(self.export_source_health)
+        self.source_btn.setMenu(source_menu)
+        self.source_btn.setObjectName("sourceButton")
+        
+        self.instant_search_check = QCheckBox("即时搜索")
+        self.instant_search_check.setChecked(True)
+        self.instant_search_check.setObjectName("instantSearchCheck")
         
         search_layout.addWidget(self.search_input, 4)
+        search_layout.addWidget(self.instant_search_check)
         search_layout.addWidget(self.search_btn, 1)
-        search_layout.addWidget(self.api_combo, 1)
+        search_layout.addWidget(self.source_btn, 1)
+        
+        # 各音源的状态和延迟
+        self.health_label = QLabel()
+        self.health_label.setTextFormat(Qt.RichText)
+        search_layout.addWidget(self.health_label)
         top_layout.addLayout(search_layout)
         
         main_layout.addWidget(top_frame)
         
         # 创建内容区选项卡
         content_tabs = QTabWidget()
-        content_tabs.setStyleSheet("""
-            QTabWidget::pane {
-                border: 1px solid #3d5a80;
-                border-radius: 8px;
-                background-color: rgba(26, 26, 46, 0.7);
-            }
-            QTabBar::tab {
-                background: qlineargradient(x1:0, y1:0, x2:0, y2:1, stop:0 #293241, stop:1 #3d5a80);
-                color: #e0fbfc;
-                padding: 10px 15px;
-                border-top-left-radius: 6px;
-                border-top-right-radius: 6px;
-                margin-right: 2px;
-                font-weight: bold;
-            }
-            QTabBar::tab:selected {
-                background: qlineargradient(x1:0, y1:0, x2:0, y2:1, stop:0 #3d5a80, stop:1 #4a6fa5);
-            }
-        """)
+        content_tabs.setObjectName("contentTabs")
         
         # 歌曲列表标签页
         song_list_tab = QWidget()
         song_list_layout = QVBoxLayout(song_list_tab)
         
-        # 歌曲列表
-        self.song_list = QListWidget()
-        self.song_list.itemDoubleClicked.connect(self.play_selected_song)
+        # 歌曲列表，所有行高度相同，只绘制可见的行
+        self.song_list = QListView()
+        self.song_list.doubleClicked.connect(self.play_selected_song)
+        self.song_list.setUniformItemSizes(True)
+        self.song_list.setLayoutMode(QListView.Batched)
+        self.song_list.setBatchSize(SONG_LIST_BATCH_SIZE)
         self.song_list.setAlternatingRowColors(True)
+        self.song_list.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.song_list.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.song_list.customContextMenuRequested.connect(self.show_song_menu)
         song_list_layout.addWidget(self.song_list)
         
-        # 分页控制
-        page_layout = QHBoxLayout()
-        self.prev_page_btn = QPushButton("上一页")
-        self.prev_page_btn.clicked.connect(self.prev_page)
-        self.page_info = QLabel("第 0/0 页")
-        self.page_info.setAlignment(Qt.AlignCenter)
-        self.next_page_btn = QPushButton("下一页")
-        self.next_page_btn.clicked.connect(self.next_page)
+        # 结果数量和加载状态，向下滚动时自动加载更多
+        result_layout = QHBoxLayout()
+        self.result_info = QLabel("")
+        self.result_info.setAlignment(Qt.AlignCenter)
         
-        page_layout.addStretch()
-        page_layout.addWidget(self.prev_page_btn)
-        page_layout.addWidget(self.page_info)
-        page_layout.addWidget(self.next_page_btn)
-        page_layout.addStretch()
+        result_layout.addStretch()
+        result_layout.addWidget(self.result_info)
+        result_layout.addStretch()
         
-        song_list_layout.addLayout(page_layout)
+        # 批量下载
+        self.download_selected_btn = QPushButton("下载选中")
+        self.download_selected_btn.clicked.connect(self.download_selected)
+        self.download_all_btn = QPushButton("下载全部")
+        self.download_all_btn.clicked.connect(self.download_all)
+        result_layout.addWidget(self.download_selected_btn)
+        result_layout.addWidget(self.download_all_btn)
+        
+        song_list_layout.addLayout(result_layout)
         
         # 播放列表标签页
         playlist_tab = QWidget()
         playlist_layout = QVBoxLayout(playlist_tab)
-        playlist_layout.addWidget(QLabel("您的播放列表将在这里显示"))
-        # 这里可以添加播放列表功能的实现
+        self.playlist_list = QListWidget()
+        self.playlist_list.setAlternatingRowColors(True)
+        self.playlist_list.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.playlist_list.setUniformItemSizes(True)
+        self.playlist_list.itemDoubleClicked.connect(
+            lambda item: self.play_node(self.play_queue.nodes[item.data(Qt.UserRole)]))
+        playlist_layout.addWidget(self.playlist_list)
+        
+        playlist_control_layout = QHBoxLayout()
+        self.gap_label = QLabel("在搜索结果中右键添加歌曲")
+        crossfade_label = QLabel("淡入淡出:")
+        self.crossfade_spin = QSpinBox()
+        self.crossfade_spin.setRange(0, CROSSFADE_MAX)
+        self.crossfade_spin.setValue(CROSSFADE_SECONDS)
+        self.crossfade_spin.setSuffix(" 秒")
+        self.crossfade_spin.setSpecialValueText("无缝")
+        self.crossfade_spin.valueChanged.connect(self.set_crossfade)
+        move_up_btn = QPushButton("上移")
+        move_up_btn.clicked.connect(lambda: self.move_queue_selected(-1))
+        move_down_btn = QPushButton("下移")
+        move_down_btn.clicked.connect(lambda: self.move_queue_selected(1))
+        remove_btn = QPushButton("移除选中")
+        remove_btn.clicked.connect(self.remove_queue_selected)
+        clear_queue_btn = QPushButton("清空列表")
+        clear_queue_btn.clicked.connect(self.clear_queue)
+        playlist_control_layout.addWidget(self.gap_label, 1)
+        playlist_control_layout.addWidget(crossfade_label)
+        playlist_control_layout.addWidget(self.crossfade_spin)
+        playlist_control_layout.addWidget(move_up_btn)
+        playlist_control_layout.addWidget(move_down_btn)
+        playlist_control_layout.addWidget(remove_btn)
+        playlist_control_layout.addWidget(clear_queue_btn)
+        playlist_layout.addLayout(playlist_control_layout)
         
         # 收藏标签页
         favorites_tab = QWidget()
@@ -591,39 +1020,51 @@ class MusicPlayer(QMainWindow):
         favorites_layout.addWidget(QLabel("您收藏的歌曲将在这里显示"))
         # 这里可以添加收藏功能的实现
         
+        # 下载队列标签页
+        downloads_tab = QWidget()
+        downloads_layout = QVBoxLayout(downloads_tab)
+        self.download_list = QListWidget()
+        downloads_layout.addWidget(self.download_list)
+        
+        download_control_layout = QHBoxLayout()
+        self.download_summary = QLabel("下载队列为空")
+        retry_btn = QPushButton("重试失败")
+        retry_btn.clicked.connect(lambda: self.download_manager.retry_failed())
+        clear_btn = QPushButton("清除已完成")
+        clear_btn.clicked.connect(lambda: self.download_manager.clear_finished())
+        download_control_layout.addWidget(self.download_summary, 1)
+        download_control_layout.addWidget(retry_btn)
+        download_control_layout.addWidget(clear_btn)
+        downloads_layout.addLayout(download_control_layout)
+        
         # 添加标签页
         content_tabs.addTab(song_list_tab, "搜索结果")
         content_tabs.addTab(playlist_tab, "播放列表")
         content_tabs.addTab(favorites_tab, "我的收藏")
+        content_tabs.addTab(downloads_tab, "下载队列")
         
         main_layout.addWidget(content_tabs, 3)  # 占用较大空间
         
         # 播放器控制区域
         player_frame = QFrame()
-        player_frame.setStyleSheet("background-color: rgba(26, 26, 46, 0.8); border-radius: 8px;")
-        player_layout = QVBoxLayout(player_frame)
-        
-        # 在播放控制区域上方添加可视化组件
-        self.visualizer = VisualizerWidget()
-        self.visualizer.setMinimumHeight(100)
-        self.visualizer.setStyleSheet("background-color: transparent;")
-        player_layout.addWidget(self.visualizer)
-        
-        # 在可视化组件和播放控制之间添加歌词显示
-        self.lyrics_widget = LyricsWidget()
+        player_frame.setObjectName("playerFrame")
+        self.player_layout = QVBoxLayout(player_frame)
+        player_layout = self.player_layout
+        
+        # 在播放控制区域上方添加可视化组件，窗口显示之后由build_panels替换占位部件
+        self.visualizer = None
+        self.visualizer_placeholder = QWidget()
+        self.visualizer_placeholder.setMinimumHeight(100)
+        self.visualizer_placeholder.setObjectName("visualizer")
+        player_layout.addWidget(self.visualizer_placeholder)
+        
+        # 在可视化组件和播放控制之间添加歌词显示，歌词部件同样稍后创建
+        self.lyrics_widget = None
         self.lyrics_frame = QFrame()
         self.lyrics_frame.setFrameShape(QFrame.StyledPanel)
         self.lyrics_frame.setFixedHeight(180)
-        self.lyrics_frame.setStyleSheet("""
-            QFrame {
-                background-color: rgba(26, 26, 46, 0.5);
-                border-radius: 8px;
-                border: 1px solid #3d5a80;
-            }
-        """)
-        
-        lyrics_layout = QVBoxLayout(self.lyrics_frame)
-        lyrics_layout.addWidget(self.lyrics_widget)
+        self.lyrics_frame.setObjectName("lyricsFrame")
+        QVBoxLayout(self.lyrics_frame)
         
         player_layout.addWidget(self.lyrics_frame)
         
@@ -631,24 +1072,24 @@ class MusicPlayer(QMainWindow):
         self.now_playing = QLabel("当前未播放任何歌曲")
         self.now_playing.setAlignment(Qt.AlignCenter)
         self.now_playing.setFont(QFont("Microsoft YaHei", 14, QFont.Bold))
-        self.now_playing.setStyleSheet("color: #a8dadc; margin: 5px 0;")
+        self.now_playing.setObjectName("nowPlaying")
         player_layout.addWidget(self.now_playing)
         
         # 进度条
         progress_frame = QFrame()
-        progress_frame.setStyleSheet("background-color: transparent; border: none;")
+        progress_frame.setObjectName("progressFrame")
         progress_layout = QHBoxLayout(progress_frame)
         progress_layout.setContentsMargins(10, 5, 10, 5)
         
         self.time_label = QLabel("00:00")
-        self.time_label.setStyleSheet("color: #a8dadc; font-size: 12px;")
+        self.time_label.setObjectName("timeLabel")
         self.progress_bar = QSlider(Qt.Horizontal)
         self.progress_bar.setEnabled(False)
         self.progress_bar.sliderMoved.connect(self.set_position)
         self.progress_bar.sliderPressed.connect(self.slider_pressed)
         self.progress_bar.sliderReleased.connect(self.slider_released)
         self.duration_label = QLabel("00:00")
-        self.duration_label.setStyleSheet("color: #a8dadc; font-size: 12px;")
+        self.duration_label.setObjectName("timeLabel")
         
         progress_layout.addWidget(self.time_label)
         progress_layout.addWidget(self.progress_bar, 8)
@@ -657,31 +1098,19 @@ class MusicPlayer(QMainWindow):
         
         # 播放控制按钮
         control_frame = QFrame()
-        control_frame.setStyleSheet("background-color: transparent; border: none;")
+        control_frame.setObjectName("controlFrame")
         control_layout = QHBoxLayout(control_frame)
         
         # 音量控制
         volume_layout = QHBoxLayout()
         volume_icon = QLabel("🔊")
-        volume_icon.setStyleSheet("color: #a8dadc; font-size: 16px;")
+        volume_icon.setObjectName("volumeIcon")
         self.volume_slider = QSlider(Qt.Horizontal)
         self.volume_slider.setRange(0, 100)
-        self.volume_slider.setValue(70)  # 默认音量70%
+        self.volume_slider.setValue(DEFAULT_VOLUME)
         self.volume_slider.valueChanged.connect(self.set_volume)
         self.volume_slider.setFixedWidth(100)
-        self.volume_slider.setStyleSheet("""
-            QSlider::groove:horizontal {
-                height: 4px;
-                background: #3d5a80;
-                border-radius: 2px;
-            }
-            QSlider::handle:horizontal {
-                background: #e0fbfc;
-                width: 10px;
-                margin: -3px 0;
-                border-radius: 5px;
-            }
-        """)
+        self.volume_slider.setObjectName("volumeSlider")
         
         volume_layout.addWidget(volume_icon)
         volume_layout.addWidget(self.volume_slider)
@@ -699,31 +1128,13 @@ class MusicPlayer(QMainWindow):
         self.stop_btn.clicked.connect(self.stop_music)
         self.download_btn.clicked.connect(self.download_current_song)
         self.download_btn.setEnabled(False)
+        self.download_status = QLabel("")
+        self.download_status.setObjectName("downloadStatus")
         
         # 设置按钮样式
         for btn in [self.prev_btn, self.play_btn, self.next_btn, self.stop_btn, self.download_btn]:
             btn.setFixedSize(40, 40)
-            btn.setStyleSheet("""
-                QPushButton {
-                    background-color: #3d5a80;
-                    border-radius: 20px;
-                    color: white;
-                    font-size: 16px;
-                    font-weight: bold;
-                    border: none;
-                    padding: 0;
-                }
-                QPushButton:hover {
-                    background-color: #4a6fa5;
-                }
-                QPushButton:pressed {
-                    background-color: #293241;
-                }
-                QPushButton:disabled {
-                    background-color: #293241;
-                    color: #7d8597;
-                }
-            """)
+            btn.setObjectName("controlButton")
         
         control_layout.addLayout(volume_layout)
         control_layout.addStretch()
@@ -732,16 +1143,24 @@ class MusicPlayer(QMainWindow):
         control_layout.addWidget(self.stop_btn)
         control_layout.addWidget(self.next_btn)
         control_layout.addStretch()
+        control_layout.addWidget(self.download_status)
         control_layout.addWidget(self.download_btn)
         
         player_layout.addWidget(control_frame)
         
         main_layout.addWidget(player_frame, 2)  # 占用较小空间
     
-    def change_api(self, index):
-        self.use_backup_api = (index == 1)
-        source_name = "备用音源" if self.use_backup_api else "默认音源"
-        QMessageBox.information(self, "音源切换", f"已切换到{source_name}，请重新搜索")
+    def change_sources(self, checked):
+        enabled = [name for name, action in self.source_actions.items() if action.isChecked()]
+        if not enabled:
+            # 至少保留一个音源
+            self.sender().setChecked(True)
+            return
+        self.enabled_sources = enabled
+        self.source_btn.setText("音源" if len(enabled) == len(PROVIDERS) else
+                                "、".join(PROVIDERS[name].title for name in enabled))
+        if self.engine.search_term:
+            self.run_search()
     
     def search_music(self):
         search_term = self.search_input.text().strip()
@@ -749,251 +1168,541 @@ class MusicPlayer(QMainWindow):
             QMessageBox.warning(self, "提示", "请输入搜索内容")
             return
             
-        self.current_page = 0
-        self.load_page()
+        self.search_timer.stop()
+        self.run_search()
+    
+    def schedule_incremental_search(self, text):
+        # 每次输入都重新计时，停止输入后才真正搜索
+        if self.instant_search_check.isChecked():
+            self.search_timer.start(SEARCH_DEBOUNCE)
     
-    def load_page(self):
+    def incremental_search(self):
         search_term = self.search_input.text().strip()
+        if len(normalize_term(search_term)) < SEARCH_MIN_CHARS:
+            return
+        sources = self.engine.route_sources(self.enabled_sources)
+        if (tuple(sources), normalize_term(search_term)) == self.last_sent_term:
+            return
+        self.run_search(incremental=True)
+    
+    def run_search(self, incremental=False):
+        search_term = self.search_input.text().strip()
+        if not search_term:
+            return
         
-        try:
-            if self.use_backup_api:
-                self.load_from_backup_api(search_term)
+        wait = self.engine.start_search(search_term, self.enabled_sources, incremental)
+        if wait:
+            # 超出请求频率时稍后再试，期间继续输入会重新计时
+            self.search_timer.start(int(wait * 1000) + 1)
+            return
+        self.last_sent_term = (tuple(self.engine.search_sources), normalize_term(search_term))
+    
+    def refresh_source_health(self):
+        report = self.engine.health_report()
+        parts = []
+        tips = []
+        for source, health in report["sources"].items():
+            title = PROVIDERS[source].title
+            if health["state"] == SourceHealth.OPEN:
+                color, text = "#ee6c4d", "暂停"
+            elif health["state"] == SourceHealth.HALF_OPEN:
+                color, text = "#f4d35e", "探测中"
+            elif health["p50_ms"] is not None:
+                color, text = "#98c1d9", f'{health["p50_ms"]}ms'
             else:
-                self.load_from_main_api(search_term)
-        except Exception as e:
-            QMessageBox.critical(self, "搜索失败", f"错误: {str(e)}\n请尝试切换API或稍后重试")
+                color, text = "#98c1d9", "正常"
+            parts.append(f'<span style="color:{color}">●</span> {title[:2]} {text}')
+            self.source_actions[source].setText(f"{title}（{text}）")
+            
+            rate = f'{health["success_rate"]:.0%}' if health["success_rate"] is not None else "-"
+            p50 = f'{health["p50_ms"]}ms' if health["p50_ms"] is not None else "-"
+            p95 = f'{health["p95_ms"]}ms' if health["p95_ms"] is not None else "-"
+            tips.append(f'{title}: 成功率 {rate}，延迟 p50 {p50} / p95 {p95}，'
+                        f'请求 {health["requests"]} 次，熔断 {health["trips"]} 次')
+        for source, race in report["races"].items():
+            if race["wins"]:
+                tips.append(f'{PROVIDERS[source].title}竞速: 胜出 {race["wins"]} 次（{race["win_rate"]:.0%}），'
+                            f'节省 {race["saved_ms"]}ms，救回 {race["rescued"]} 首')
+        self.health_label.setText("  ".join(parts))
+        self.health_label.setToolTip("\n".join(tips))
     
-    def load_from_main_api(self, search_term):
-        url = self.build_url(search_term, self.current_page)
-        
+    def export_source_health(self):
         try:
-            # 添加请求头
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-                "Referer": "http://www.kuwo.cn/"
-            }
-            
-            print(f"搜索请求: {url}")
-            response = requests.get(url, headers=headers, timeout=API_TIMEOUT).json()
-            
-            if "abslist" not in response or "TOTAL" not in response:
-                raise Exception("API返回数据格式不正确")
-                
-            self.total_pages = (int(response["TOTAL"]) + 19) // 20
-            self.search_results = response["abslist"]
-            
-            print(f"搜索结果: 找到 {response['TOTAL']} 首歌曲")
-            
-            # 更新页码信息
-            self.page_info.setText(f"第 {self.current_page + 1}/{self.total_pages} 页")
-            
-            # 启用/禁用分页按钮
-            self.prev_page_btn.setEnabled(self.current_page > 0)
-            self.next_page_btn.setEnabled(self.current_page < self.total_pages - 1)
-            
-            # 更新歌曲列表
-            self.update_song_list()
-        except requests.exceptions.Timeout:
-            print("API请求超时")
-            QMessageBox.critical(self, "搜索失败", f"主API请求超时，请检查网络连接或尝试切换到备用API")
-        except Exception as e:
-            print(f"API请求错误: {str(e)}")
-            traceback.print_exc()
-            QMessageBox.critical(self, "搜索失败", f"主API搜索失败: {str(e)}\n请尝试切换到备用API")
+            path = self.engine.export_health()
+        except OSError as e:
+            QMessageBox.warning(self, "导出失败", f"无法保存音源状态: {str(e)}")
+            return
+        QMessageBox.information(self, "导出完成", f"音源状态已保存到 {os.path.abspath(path)}")
+    
+    def set_searching(self, searching):
+        # 搜索期间界面保持可用，只显示进行中的状态
+        if searching:
+            self.search_btn.setText("搜索中…")
+            self.result_info.setText("正在搜索…")
+        else:
+            self.search_btn.setText("搜索")
     
-    def load_from_backup_api(self, search_term):
-        params = {
-            "keywords": search_term,
-            "limit": 20,
-            "offset": self.current_page * 20
-        }
+    @pyqtSlot(object)
+    def on_search_updated(self, state):
+        results = state["results"]
+        
+        # 更新结果数量
+        self.set_searching(state["loading"])
+        if not state["loading"] and state["failed"] and not results:
+            self.result_info.setText("搜索失败")
+        elif not state["loading"]:
+            text = f"共 {len(results)} 首"
+            if state["more"]:
+                text += "，向下滚动加载更多"
+            if state["failed"]:
+                text += "，" + "、".join(PROVIDERS[source].title for source in state["failed"]) + "加载失败"
+            self.result_info.setText(text)
+        stats = self.engine.search_cache.stats()
+        self.result_info.setToolTip(f"搜索缓存命中 {stats['hits']} 次，未命中 {stats['misses']} 次")
+        
+        # 更新歌曲列表
+        self.song_model.set_results(results, len(state["sources"]) > 1)
+        self.refresh_source_health()
+    
+    @pyqtSlot(object)
+    def on_search_failed(self, failure):
+        # 输入过程中的自动搜索失败时只在结果数量处提示，按回车搜索时再弹出对话框
+        if failure["incremental"]:
+            self.result_info.setText("搜索失败")
+            self.last_sent_term = None
+            return
         
-        try:
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-                "Accept": "application/json"
-            }
-            
-            print(f"备用API搜索请求: {BACKUP_SEARCH_URL}，参数: {params}")
-            response = requests.get(BACKUP_SEARCH_URL, params=params, headers=headers, timeout=API_TIMEOUT).json()
-            
-            if response["code"] != 200:
-                raise Exception(f"备用API返回错误: {response.get('msg', '未知错误')}")
-            
-            # 处理搜索结果
-            self.search_results = []
-            for item in response["result"]["songs"]:
-                # 转换为与主API相同的格式
-                self.search_results.append({
-                    "NAME": item["name"],
-                    "ARTIST": item["artists"][0]["name"],
-                    "ALBUM": item["album"]["name"],
-                    "DC_TARGETID": str(item["id"]),  # 使用歌曲ID
-                    "API_TYPE": "backup"  # 标记为备用API
-                })
-            
-            # 计算总页数
-            total_count = response["result"]["songCount"]
-            self.total_pages = (total_count + 19) // 20
-            
-            print(f"备用API搜索结果: 找到 {total_count} 首歌曲")
-            
-            # 更新页码信息
-            self.page_info.setText(f"第 {self.current_page + 1}/{self.total_pages} 页")
-            
-            # 启用/禁用分页按钮
-            self.prev_page_btn.setEnabled(self.current_page > 0)
-            self.next_page_btn.setEnabled(self.current_page < self.total_pages - 1)
-            
-            # 更新歌曲列表
-            self.update_song_list()
-        except requests.exceptions.Timeout:
-            print("备用API请求超时")
-            QMessageBox.critical(self, "搜索失败", f"备用API请求超时，请检查网络连接或尝试使用主API")
-        except Exception as e:
-            print(f"备用API请求错误: {str(e)}")
-            traceback.print_exc()
-            QMessageBox.critical(self, "搜索失败", f"备用API搜索失败: {str(e)}")
+        lines = []
+        for source, error in failure["failures"].items():
+            if isinstance(error, requests.exceptions.Timeout):
+                lines.append(f"{PROVIDERS[source].title}: 请求超时，请检查网络连接")
+            else:
+                lines.append(f"{PROVIDERS[source].title}: {str(error)}")
+        QMessageBox.critical(self, "搜索失败", "搜索失败:\n" + "\n".join(lines))
     
-    def update_song_list(self):
-        self.song_list.clear()
-        for item in self.search_results:
-            # 添加更多信息，帮助用户选择歌曲
-            artist = item.get("ARTIST", "未知歌手")
-            album = item.get("ALBUM", "")
-            album_text = f" - {album}" if album else ""
-            
-            list_item = QListWidgetItem(f'{item["NAME"]} - {artist}{album_text}')
-            list_item.setData(Qt.UserRole, item["DC_TARGETID"])
-            self.song_list.addItem(list_item)
-    
-    def prev_page(self):
-        if self.current_page > 0:
-            self.current_page -= 1
-            self.load_page()
-    
-    def next_page(self):
-        if self.current_page < self.total_pages - 1:
-            self.current_page += 1
-            self.load_page()
-    
-    def play_selected_song(self, item):
-        song_id = item.data(Qt.UserRole)
-        song_name = item.text()
-        
-        # 检查选中的歌曲是否来自备用API
-        selected_item = None
-        for result in self.search_results:
-            if result["DC_TARGETID"] == song_id:
-                selected_item = result
-                break
-        
-        if selected_item and selected_item.get("API_TYPE") == "backup":
-            self.stream_from_backup_api(song_id, song_name)
+    def play_selected_song(self, index):
+        # 双击的歌曲插入到当前歌曲之后并立即播放，之后继续播放列表中的歌曲
+        self.play_node(self.enqueue_songs([self.song_entry(index)], after_current=True)[0])
+    
+    def song_entry(self, index):
+        return (index.data(SOURCE_ROLE), index.data(Qt.UserRole), index.data())
+    
+    def selected_songs(self):
+        # 按列表中的顺序返回选中的歌曲
+        indexes = sorted(self.song_list.selectionModel().selectedRows(), key=lambda index: index.row())
+        return [self.song_entry(index) for index in indexes]
+    
+    def show_song_menu(self, pos):
+        entries = self.selected_songs()
+        if not entries:
+            return
+        menu = QMenu(self)
+        menu.addAction("立即播放", lambda: self.play_node(self.enqueue_songs(entries, after_current=True)[0]))
+        menu.addAction("下一首播放", lambda: self.enqueue_songs(entries, after_current=True))
+        menu.addAction("添加到播放列表", lambda: self.enqueue_songs(entries))
+        menu.addSeparator()
+        menu.addAction("下载", self.download_selected)
+        menu.exec_(self.song_list.viewport().mapToGlobal(pos))
+    
+    def enqueue_songs(self, entries, after_current=False):
+        """把歌曲加入播放列表，已在列表中的歌曲移到新位置，返回对应的节点"""
+        # 加载完成前只能加到末尾，避免插到还没读取的条目中间
+        after = None
+        if after_current and self.play_queue.loaded:
+            after = self.play_queue.current or self.play_queue.head
+        nodes = self.play_queue.insert(entries, after)
+        for node in nodes:
+            self.place_queue_item(node)
+        self.check_preload()
+        return nodes
+    
+    def place_queue_item(self, node):
+        # 只移动或插入这一行，不重建整个列表
+        item = self.queue_items.get(node.id)
+        if item is not None:
+            self.playlist_list.takeItem(self.playlist_list.row(item))
+        else:
+            item = QListWidgetItem()
+            item.setData(Qt.UserRole, node.id)
+            self.queue_items[node.id] = item
+        
+        if node.prev is self.play_queue.head:
+            row = 0
         else:
-            self.stream_from_main_api(song_id, song_name)
+            row = self.playlist_list.row(self.queue_items[node.prev.id]) + 1
+        self.playlist_list.insertItem(row, item)
+        self.mark_queue_item(node)
+    
+    def mark_queue_item(self, node):
+        item = self.queue_items.get(node.id) if node else None
+        if item is not None:
+            item.setText(("▶ " if node is self.play_queue.current else "") + node.entry[2])
+    
+    @pyqtSlot(object)
+    def on_queue_chunk(self, nodes):
+        # 后台读取的条目插在启动后新加入的条目之前
+        for node in nodes:
+            item = QListWidgetItem(node.entry[2])
+            item.setData(Qt.UserRole, node.id)
+            self.queue_items[node.id] = item
+            self.playlist_list.insertItem(self.queue_loaded_rows, item)
+            self.queue_loaded_rows += 1
     
-    def stream_from_main_api(self, song_id, song_name):
+    @pyqtSlot(object)
+    def on_queue_loaded(self, count):
+        self.mark_queue_item(self.play_queue.current)
+        self.playlist_list.setEnabled(True)
+        self.gap_label.setText(f"播放列表共 {len(self.play_queue)} 首")
+        print(f"已加载播放列表: {count} 首")
+    
+    @pyqtSlot(object)
+    def on_queue_load_failed(self, error):
+        print(f"加载播放列表失败: {str(error)}")
+        self.playlist_list.setEnabled(True)
+        self.gap_label.setText("加载播放列表失败")
+    
+    def selected_queue_nodes(self):
+        items = self.playlist_list.selectedItems()
+        return [self.play_queue.nodes[item.data(Qt.UserRole)] for item in items]
+    
+    def remove_queue_selected(self):
+        for node in self.selected_queue_nodes():
+            self.play_queue.remove(node)
+            self.playlist_list.takeItem(self.playlist_list.row(self.queue_items.pop(node.id)))
+        self.check_preload()
+    
+    def move_queue_selected(self, step):
+        nodes = self.selected_queue_nodes()
+        if len(nodes) != 1:
+            return
+        node = nodes[0]
+        if step < 0 and node.prev is not self.play_queue.head:
+            self.play_queue.move(node, node.prev.prev)
+        elif step > 0 and node.next is not self.play_queue.tail:
+            self.play_queue.move(node, node.next)
+        else:
+            return
+        self.place_queue_item(node)
+        self.queue_items[node.id].setSelected(True)
+        self.check_preload()
+    
+    def clear_queue(self):
+        if not self.play_queue.loaded:
+            return
+        self.play_queue.clear()
+        self.queue_items.clear()
+        self.queue_loaded_rows = 0
+        self.playlist_list.clear()
+        self.check_preload()
+    
+    def check_preload(self):
+        # 预加载的歌曲已经不是下一首时作废
+        if self.preload and self.preload["node"] is not self.next_node():
+            self.cancel_preload()
+    
+    def next_node(self):
+        if self.play_queue.history_cursor:
+            # 在播放历史中后退时，下一首是历史中的后一首
+            return None
+        return self.play_queue.next_of(self.play_queue.current)
+    
+    def set_current_node(self, node, record=True):
+        previous = self.play_queue.current
+        self.play_queue.set_current(node)
+        if record:
+            self.play_queue.record_history(node.entry)
+        self.mark_queue_item(previous)
+        self.mark_queue_item(node)
+    
+    def play_node(self, node):
+        self.set_current_node(node)
+        self.play_song(*node.entry)
+    
+    def play_history_entry(self, entry):
+        # 历史中的歌曲仍在播放列表中时，从它所在的位置继续
+        node = self.play_queue.find(entry)
+        if node is not None:
+            self.set_current_node(node, record=False)
+        self.play_song(*entry)
+    
+    def play_song(self, source, song_id, song_name):
+        # 窗口显示之前就开始播放时（例如从脚本调用）面板还没有创建
+        self.build_panels()
+        
+        # 新的播放请求会使之前还没返回的地址和歌词结果作废
+        self.play_generation += 1
+        self.current_source = source
         self.current_song_id = song_id
         self.current_song_name = song_name
+        self.current_url = None
+        self.now_playing.setText(f"正在加载: {song_name}")
+        self.stop_fade()
+        self.cancel_preload()
+        self.engine.cancel_stream()
+        self.handoff = None
+        self.engine.record_play(source, song_id, song_name)
+        
+        # 已缓存的音频和地址会立即送回，否则与歌词获取同时在后台解析
+        self.engine.start_stream(("play", self.play_generation), source, song_id, song_name,
+                                 race=self.race_action.isChecked(), sources=self.enabled_sources)
+        self.load_lyrics(source, song_id)
+    
+    def load_lyrics(self, source, song_id):
+        # 缓存中有歌词（包括确认没有歌词）时不需要任何网络请求
+        if not self.engine.start_lyrics(("play", self.play_generation), source, song_id):
+            self.lyrics_widget.show_no_lyrics("歌词加载中…")
+    
+    @pyqtSlot(object, object)
+    def on_stream_ready(self, token, stream):
+        kind, generation = token
+        if kind == "preload":
+            self.on_preload_ready(generation, stream)
+            return
+        if generation != self.play_generation:
+            return
         
-        try:
-            # 获取真实的MP3 URL
-            mp3_url = MP3_BASE_URL + song_id
-            
-            # 添加浏览器请求头
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-                "Referer": "http://www.kuwo.cn/",
-                "Accept": "*/*",
-                "Accept-Encoding": "gzip, deflate, br",
-                "Connection": "keep-alive"
-            }
-            
-            print(f"请求资源信息: {mp3_url}")
-            response = requests.get(mp3_url, headers=headers, timeout=API_TIMEOUT)
-            
-            if response.status_code != 200:
-                raise Exception(f"服务器返回错误代码: {response.status_code}")
-            
-            # 从响应中提取真正的MP3 URL
-            real_mp3_url = response.text.strip()
-            print(f"获取到真正的音乐链接: {real_mp3_url}")
-            
-            # 启用下载按钮
-            self.download_btn.setEnabled(True)
-            
-            # 使用QMediaPlayer直接播放URL
-            self.media_player.setMedia(QMediaContent(QUrl(real_mp3_url)))
-            self.media_player.play()
-            
-            # 更新播放状态
-            self.now_playing.setText(f"正在播放: {song_name}")
-            self.play_btn.setText("⏸")
-            self.is_playing = True
-            
-            # 开始更新可视化
-            self.visualizer_timer.start()
-            
-            # 尝试获取歌词
-            self.fetch_lyrics(song_id)
-                
-        except Exception as e:
-            print(f"播放失败: {str(e)}")
-            traceback.print_exc()
-            QMessageBox.critical(self, "播放失败", f"无法播放此音乐: {str(e)}\n请尝试其他歌曲")
+        # 竞速时可能改用了其他音源中的同一首歌
+        self.current_source, self.current_song_id = stream["source"], stream["song_id"]
+        self.current_url = stream["url"]
+        self.current_url_cached = stream["cached"]
+        if stream["path"]:
+            self.start_playback(QUrl.fromLocalFile(stream["path"]))
+        else:
+            self.start_playback(QUrl(stream["media"]))
     
-    def stream_from_backup_api(self, song_id, song_name):
-        self.current_song_id = song_id
-        self.current_song_name = song_name
+    def start_playback(self, url):
+        # 启用下载按钮
+        self.download_btn.setEnabled(True)
         
-        try:
-            # 获取歌曲URL
-            params = {"id": song_id}
-            print(f"请求备用API获取歌曲URL: {BACKUP_SONG_URL}?id={song_id}")
-            
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-                "Accept": "application/json"
-            }
-            
-            response = requests.get(BACKUP_SONG_URL, params=params, headers=headers, timeout=API_TIMEOUT).json()
-            
-            if response["code"] != 200:
-                raise Exception(f"获取歌曲URL失败: {response.get('msg', '未知错误')}")
-            
-            # 获取音乐URL
-            if not response["data"] or len(response["data"]) == 0:
-                raise Exception("未找到音乐资源")
-                
-            music_url = response["data"][0]["url"]
-            if not music_url:
-                raise Exception("此歌曲无法播放，可能需要VIP或版权受限")
-            
-            print(f"获取到音乐URL: {music_url}")
-            
-            # 启用下载按钮
-            self.download_btn.setEnabled(True)
-            
-            # 使用QMediaPlayer直接播放URL
-            self.media_player.setMedia(QMediaContent(QUrl(music_url)))
+        self.media_player.setMedia(QMediaContent(url))
+        self.media_player.play()
+        
+        # 更新播放状态
+        self.now_playing.setText(f"正在播放: {self.current_song_name}")
+        self.play_btn.setText("⏸")
+        self.is_playing = True
+        
+        # 开始更新可视化
+        self.update_frame_clock()
+    
+    @pyqtSlot(object, object)
+    def on_stream_failed(self, token, error):
+        kind, generation = token
+        if kind == "preload":
+            self.on_preload_failed(generation, error)
+            return
+        if generation != self.play_generation:
+            return
+        
+        self.now_playing.setText(f"播放失败: {self.current_song_name}")
+        self.refresh_source_health()
+        if not self.engine.source_available(self.current_source):
+            title = PROVIDERS[self.current_source].title
+            print(f"{title}播放失败: {str(error)}")
+            QMessageBox.critical(self, "播放失败", f"{title}暂时不可用: {str(error)}\n"
+                                 "恢复后会自动重新启用，请先播放其他音源的歌曲")
+        elif self.current_source == "backup":
+            print(f"备用API播放失败: {str(error)}")
+            QMessageBox.critical(self, "播放失败", f"备用API播放失败: {str(error)}\n请尝试其他歌曲")
+        else:
+            print(f"播放失败: {str(error)}")
+            QMessageBox.critical(self, "播放失败", f"无法播放此音乐: {str(error)}\n请尝试其他歌曲")
+    
+    @pyqtSlot(object, object)
+    def on_lyrics_loaded(self, token, timeline):
+        if token == ("play", self.play_generation):
+            self.lyrics_widget.set_lyrics(timeline)
+    
+    @pyqtSlot(object, object)
+    def on_lyrics_failed(self, token, error):
+        if token == ("play", self.play_generation):
+            print(f"获取歌词出错: {error}")
+            self.lyrics_widget.show_no_lyrics()
+    
+    def create_player(self):
+        player = QMediaPlayer(self)
+        player.setVolume(self.volume)
+        player.setNotifyInterval(POSITION_INTERVAL)
+        return player
+    
+    def bind_players(self, connect):
+        # 只有正在播放的播放器驱动界面，另一个只报告预加载状态
+        connections = [
+            (self.media_player.positionChanged, self.position_changed),
+            (self.media_player.durationChanged, self.duration_changed),
+            (self.media_player.stateChanged, self.media_state_changed),
+            (self.media_player.mediaStatusChanged, self.media_status_changed),
+            (self.media_player.error, self.media_error),
+            (self.next_player.mediaStatusChanged, self.preload_status_changed),
+            (self.next_player.error, self.preload_error),
+        ]
+        for signal, slot in connections:
+            if connect:
+                signal.connect(slot)
+            else:
+                signal.disconnect(slot)
+    
+    def swap_players(self):
+        self.bind_players(False)
+        self.media_player, self.next_player = self.next_player, self.media_player
+        self.bind_players(True)
+        # 频谱截取跟随正在播放的播放器
+        self.audio_probe.setSource(self.media_player)
+    
+    def start_preload(self):
+        node = self.next_node()
+        if node is None or self.preload is not None or self.fading_out is not None:
+            return
+        source, song_id, song_name = node.entry
+        self.preload_generation += 1
+        self.preload = {"node": node, "entry": node.entry, "url": None, "ready": False}
+        print(f"预加载下一首: {song_name}")
+        
+        self.engine.start_stream(("preload", self.preload_generation), source, song_id, song_name)
+        # 歌词也提前放进缓存，切换时直接显示
+        self.engine.prefetch_lyrics(source, song_id)
+    
+    def on_preload_ready(self, generation, stream):
+        if generation != self.preload_generation or self.preload is None:
+            return
+        self.preload["url"] = stream["url"]
+        self.load_preload(QUrl.fromLocalFile(stream["path"]) if stream["path"] else QUrl(stream["media"]))
+    
+    def on_preload_failed(self, generation, error):
+        if generation == self.preload_generation:
+            print(f"预加载失败: {str(error)}")
+            self.preload = None
+    
+    def load_preload(self, url):
+        # 暂停状态下设置媒体会开始缓冲，但不会发声
+        self.next_player.setMedia(QMediaContent(url))
+        self.next_player.setVolume(0 if self.crossfade_seconds else self.volume)
+        self.next_player.pause()
+    
+    def preload_status_changed(self, status):
+        if self.preload is None or self.fading_out is not None:
+            return
+        if status in (QMediaPlayer.LoadedMedia, QMediaPlayer.BufferedMedia) and not self.preload["ready"]:
+            self.preload["ready"] = True
+            print(f"下一首已缓冲: {self.preload['entry'][2]}")
+        elif status == QMediaPlayer.InvalidMedia:
+            self.preload_error(QMediaPlayer.FormatError)
+    
+    def preload_error(self, error):
+        # 预加载失败时到切换歌曲时再正常加载
+        if self.preload is None or self.fading_out is not None:
+            return
+        print(f"预加载出错: {self.next_player.errorString()}")
+        source, song_id, song_name = self.preload["entry"]
+        if self.preload["url"]:
+            self.engine.invalidate_stream(source, song_id, self.preload["url"])
+        self.cancel_preload()
+    
+    def cancel_preload(self):
+        self.preload_generation += 1
+        self.preload = None
+        if self.fading_out is None:
+            self.next_player.stop()
+            self.next_player.setMedia(QMediaContent())
+    
+    def check_handoff(self, position):
+        # 播放接近结尾时预加载下一首，开启淡入淡出时提前开始切换
+        if self.song_duration <= 0 or not self.is_playing:
+            return
+        remaining = self.song_duration - position
+        if self.preload is None and remaining <= max(PRELOAD_AHEAD, self.crossfade_seconds + 5) * 1000:
+            self.start_preload()
+        if (self.crossfade_seconds and self.preload and self.preload["ready"]
+                and remaining <= self.crossfade_seconds * 1000):
+            self.hand_off()
+    
+    def hand_off(self):
+        """切换到已经缓冲好的下一首，无缝衔接或淡入淡出"""
+        preload = self.preload
+        self.preload = None
+        old_player = self.media_player
+        self.swap_players()
+        
+        self.set_current_node(preload["node"])
+        self.play_generation += 1
+        self.current_source, self.current_song_id, self.current_song_name = preload["entry"]
+        self.current_url = preload["url"]
+        self.current_url_cached = False
+        self.engine.record_play(self.current_source, self.current_song_id, self.current_song_name)
+        self.handoff = {"end": self.handoff["end"] if self.handoff else None, "start": None}
+        
+        if self.crossfade_seconds:
+            self.fading_out = old_player
+            self.fade_started = time.monotonic()
+            self.media_player.setVolume(0)
             self.media_player.play()
-            
-            # 更新播放状态
-            self.now_playing.setText(f"正在播放: {song_name}")
-            self.play_btn.setText("⏸")
-            self.is_playing = True
-            
-            # 开始更新可视化
-            self.visualizer_timer.start()
-            
-            # 尝试获取歌词
-            self.fetch_lyrics_from_backup(song_id)
-                
-        except Exception as e:
-            print(f"备用API播放失败: {str(e)}")
-            traceback.print_exc()
-            QMessageBox.critical(self, "播放失败", f"备用API播放失败: {str(e)}\n请尝试其他歌曲")
+            self.fade_timer.start()
+        else:
+            old_player.stop()
+            self.media_player.setVolume(self.volume)
+            self.media_player.play()
+        
+        self.download_btn.setEnabled(True)
+        self.now_playing.setText(f"正在播放: {self.current_song_name}")
+        self.duration_changed(self.media_player.duration())
+        self.load_lyrics(self.current_source, self.current_song_id)
+    
+    def fade_step(self):
+        progress = (time.monotonic() - self.fade_started) / self.crossfade_seconds if self.crossfade_seconds else 1
+        if progress >= 1 or self.fading_out is None:
+            self.stop_fade()
+            if self.handoff is not None:
+                self.handoff["end"] = time.monotonic()
+                self.report_gap()
+            return
+        self.media_player.setVolume(int(self.volume * progress))
+        self.fading_out.setVolume(int(self.volume * (1 - progress)))
+    
+    def stop_fade(self):
+        self.fade_timer.stop()
+        if self.fading_out is not None:
+            self.fading_out.stop()
+            self.fading_out.setVolume(self.volume)
+            self.fading_out = None
+            self.media_player.setVolume(self.volume)
+    
+    def report_gap(self):
+        # 新歌曲开始发声减去旧歌曲结束的时间，负数表示两首重叠播放
+        if self.handoff is None or self.handoff["end"] is None or self.handoff["start"] is None:
+            return
+        gap = (self.handoff["start"] - self.handoff["end"]) * 1000
+        self.handoff = None
+        self.gap_samples.append(gap)
+        average = sum(self.gap_samples) / len(self.gap_samples)
+        print(f"曲间间隔: {gap:.0f} ms")
+        self.gap_label.setText(f"曲间间隔: {gap:.0f} ms（最近{len(self.gap_samples)}次平均 {average:.0f} ms）")
+    
+    def set_crossfade(self, seconds):
+        self.crossfade_seconds = seconds
+        if self.preload and not self.fading_out:
+            self.next_player.setVolume(0 if seconds else self.volume)
+    
+    def prefetch_selected_url(self, index, previous=None):
+        if not index.isValid():
+            return
+        source, song_id, song_name = self.song_entry(index)
+        self.engine.prefetch_url(source, song_id)
+    
+    def media_error(self, error):
+        if error not in (QMediaPlayer.ResourceError, QMediaPlayer.NetworkError, QMediaPlayer.AccessDeniedError):
+            return
+        print(f"播放出错: {self.media_player.errorString()}")
+        if self.current_url is None:
+            if self.media_player.media().canonicalUrl().isLocalFile():
+                # 缓存文件损坏，删除后重新在线播放
+                self.engine.invalidate_stream(self.current_source, self.current_song_id)
+                self.play_song(self.current_source, self.current_song_id, self.current_song_name)
+            return
+        # 地址返回403/404时播放器报告资源错误，删除缓存的地址
+        self.engine.invalidate_stream(self.current_source, self.current_song_id, self.current_url)
+        if self.current_url_cached:
+            # 用的是缓存地址时重新解析一次再播放
+            self.play_song(self.current_source, self.current_song_id, self.current_song_name)
     
     def toggle_play(self):
         if self.current_song_id is None:
@@ -1004,12 +1713,11 @@ class MusicPlayer(QMainWindow):
                 self.media_player.pause()
                 self.play_btn.setText("▶")
                 self.is_playing = False
-                self.visualizer_timer.stop()
             else:
                 self.media_player.play()
                 self.play_btn.setText("⏸")
                 self.is_playing = True
-                self.visualizer_timer.start()
+            self.update_frame_clock()
         except Exception as e:
             print(f"切换播放状态出错: {str(e)}")
             traceback.print_exc()
@@ -1018,10 +1726,13 @@ class MusicPlayer(QMainWindow):
     def stop_music(self):
         if self.current_song_id is not None:
             try:
+                self.stop_fade()
+                self.cancel_preload()
                 self.media_player.stop()
                 self.is_playing = False
                 self.play_btn.setText("▶")
-                self.visualizer_timer.stop()
+                self.update_frame_clock()
+                self.visualizer.reset()
                 self.progress_bar.setValue(0)
                 self.time_label.setText("00:00")
                 self.lyrics_widget.show_no_lyrics()
@@ -1035,8 +1746,15 @@ class MusicPlayer(QMainWindow):
         self.progress_bar.setValue(position)
         self.time_label.setText(self.format_time(position // 1000))
         
-        # 更新歌词显示
-        self.lyrics_widget.update_display(position)
+        # 动画时钟暂停时（例如暂停后拖动进度条）由这里更新歌词
+        if not self.frame_clock.is_running():
+            self.lyrics_widget.update_display(position)
+        
+        if self.handoff is not None and self.handoff["start"] is None and position > 0:
+            # 进度按固定间隔报告，减去已播放的时长得到开始发声的时间
+            self.handoff["start"] = time.monotonic() - position / 1000
+            self.report_gap()
+        self.check_handoff(position)
     
     def duration_changed(self, duration):
         # 当歌曲总时长改变时
@@ -1052,16 +1770,21 @@ class MusicPlayer(QMainWindow):
         else:
             self.play_btn.setText("▶")
             self.is_playing = False
-            
-            # 如果媒体停止，停止可视化更新
-            if state == QMediaPlayer.StoppedState:
-                self.visualizer_timer.stop()
+        
+        # 暂停或停止时动画时钟也随之暂停
+        self.update_frame_clock()
     
     def media_status_changed(self, status):
         # 当媒体状态改变时
         if status == QMediaPlayer.EndOfMedia:
-            # 播放结束，自动播放下一首
-            self.play_next()
+            # 播放结束，下一首已缓冲好时直接切换，否则正常加载
+            self.handoff = {"end": time.monotonic(), "start": None}
+            if self.preload and self.preload["ready"]:
+                self.hand_off()
+            elif self.advance():
+                self.handoff = {"end": time.monotonic(), "start": None}
+            else:
+                self.handoff = None
     
     def slider_pressed(self):
         # 用户按下进度条时暂停更新
@@ -1078,249 +1801,174 @@ class MusicPlayer(QMainWindow):
         self.media_player.setPosition(position)
     
     def set_volume(self, volume):
-        # 设置音量
-        self.media_player.setVolume(volume)
+        # 设置音量，淡入淡出过程中由fade_step按比例调整
+        self.volume = volume
+        if self.fading_out is None:
+            self.media_player.setVolume(volume)
+            if self.preload and not self.crossfade_seconds:
+                self.next_player.setVolume(volume)
         
     def play_previous(self):
-        # 播放上一首歌曲
-        # 这里可以实现播放历史功能
-        QMessageBox.information(self, "提示", "播放上一首功能即将开发")
+        # 在播放历史中后退一首
+        entry = self.play_queue.step_back()
+        if entry is None:
+            QMessageBox.information(self, "提示", "没有更早的播放记录")
+            return
+        self.play_history_entry(entry)
         
     def play_next(self):
-        # 播放下一首歌曲
-        # 这里可以实现自动播放下一首功能
-        QMessageBox.information(self, "提示", "播放下一首功能即将开发")
+        # 播放列表中的下一首歌曲，已经缓冲好时直接切换
+        if self.preload and self.preload["ready"] and self.fading_out is None:
+            self.hand_off()
+        elif not self.advance():
+            QMessageBox.information(self, "提示", "已经是播放列表中的最后一首")
+    
+    def advance(self):
+        # 后退过的先沿播放历史前进，否则播放列表中的下一首
+        entry = self.play_queue.step_forward()
+        if entry is not None:
+            self.play_history_entry(entry)
+            return True
+        node = self.next_node()
+        if node is None:
+            return False
+        self.play_node(node)
+        return True
     
     def format_time(self, seconds):
         minutes = seconds // 60
         seconds = seconds % 60
         return f"{minutes:02d}:{seconds:02d}"
     
-    def build_url(self, search, pn):
-        search_encoded = urllib.parse.quote(search)
-        return f"{BASE_URL}?vipver={VIP_VER}&client={CLIENT}&ft={FT}&cluster={CLUSTER}&strategy={STRATEGY}&encoding={ENCODING}&rformat={RFORMAT}&mobi={MOBI}&issubtitle={ISSUBTITLE}&show_copyright_off={SHOW_COPYRIGHT_OFF}&pn={pn}&rn={RN}&all={search_encoded}"
+    def on_audio_buffer(self, buffer):
+        # 缓冲区只在本次回调中有效，复制数据后交给分析线程
+        audio_format = buffer.format()
+        raw = buffer.constData().asstring(buffer.byteCount())
+        self.pcm_ready.emit(raw, (audio_format.sampleRate(), audio_format.channelCount(),
+                                  audio_format.sampleSize(), audio_format.sampleType(),
+                                  audio_format.byteOrder() == QAudioFormat.LittleEndian))
+        self.last_pcm_time = time.monotonic()
     
-    def update_visualizer(self):
-        if self.is_playing:
-            try:
+    @pyqtSlot(object)
+    def on_spectrum(self, values):
+        # 只保存最新的频谱，由下一帧统一绘制
+        self.latest_spectrum = values
+    
+    def update_frame_clock(self):
+        # 窗口可见且正在播放时才需要动画
+        if self.is_playing and self.isVisible() and not self.isMinimized():
+            self.frame_clock.start()
+        else:
+            self.frame_clock.stop()
+    
+    def on_frame(self, dt):
+        try:
+            # 收不到真实的PCM数据时才使用模拟效果
+            if time.monotonic() - self.last_pcm_time > PCM_TIMEOUT:
                 self.visualizer.update_values()
-            except Exception as e:
-                print(f"更新可视化效果出错: {str(e)}")
-                traceback.print_exc()
+            elif self.latest_spectrum is not None:
+                self.visualizer.update_values(self.latest_spectrum)
+            self.visualizer.advance(dt)
+            self.lyrics_widget.update_display(self.media_player.position())
+        except Exception as e:
+            print(f"更新可视化效果出错: {str(e)}")
+            traceback.print_exc()
+    
+    def changeEvent(self, event):
+        if event.type() == QEvent.WindowStateChange:
+            self.update_frame_clock()
+        super().changeEvent(event)
+    
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.update_frame_clock()
+    
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if self.visualizer is None:
+            # 第一次绘制完成后再创建其余面板，showEvent时安排的话会抢在绘制之前执行
+            QTimer.singleShot(0, self.build_panels)
+    
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self.update_frame_clock()
     
     def download_current_song(self):
         if self.current_song_id is None:
             return
-            
-        # 检查当前歌曲是哪个API的
-        for result in self.search_results:
-            if result["DC_TARGETID"] == self.current_song_id:
-                if result.get("API_TYPE") == "backup":
-                    self.download_from_backup_api()
-                    return
-                break
-        
-        try:
-            # 创建downloads文件夹（如果不存在）
-            if not os.path.exists("downloads"):
-                os.makedirs("downloads")
-            
-            # 使用与原始music.py相同的方式获取音乐
-            mp3_url = MP3_BASE_URL + self.current_song_id
-            
-            # 添加浏览器请求头
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-                "Referer": "http://www.kuwo.cn/",
-                "Accept": "*/*",
-                "Accept-Encoding": "gzip, deflate, br",
-                "Connection": "keep-alive"
-            }
-            
-            print(f"开始请求资源信息: {mp3_url}")
-            # 获取MP3信息
-            response = requests.get(mp3_url, headers=headers, timeout=API_TIMEOUT)
-            
-            if response.status_code != 200:
-                raise Exception(f"服务器返回错误代码: {response.status_code}")
-            
-            # 从响应中提取真正的MP3 URL
-            real_mp3_url = response.text.strip()
-            print(f"获取到真正的下载链接: {real_mp3_url}")
-            
-            # 获取真正的MP3文件
-            mp3_response = requests.get(real_mp3_url, headers=headers, timeout=API_TIMEOUT)
-            if mp3_response.status_code != 200:
-                raise Exception(f"下载MP3文件失败，状态码: {mp3_response.status_code}")
-                
-            print(f"下载完成，内容长度: {len(mp3_response.content)} 字节")
-            
-            # 从歌曲名和歌手名提取信息
-            parts = self.current_song_name.split(' - ', 1)
-            song_title = parts[0]
-            artist = parts[1].split(' - ')[0] if ' - ' in parts[1] else parts[1]
-            
-            # 保存文件，使用更易辨别的命名方式
-            safe_song_name = f"{artist} - {song_title}.mp3"
-            safe_song_name = "".join(c for c in safe_song_name if c.isalnum() or c in (" ", ".", "_", "-")).rstrip()
-            target_path = os.path.join("downloads", safe_song_name)
-            
-            # 直接保存文件
-            with open(target_path, "wb") as file:
-                file.write(mp3_response.content)
-            
-            QMessageBox.information(self, "下载成功", f"歌曲已保存到 {target_path}")
-                
-        except requests.exceptions.Timeout:
-            print("下载超时")
-            QMessageBox.critical(self, "下载失败", f"下载歌曲超时，请检查网络连接后重试")
-        except Exception as e:
-            print(f"下载失败: {str(e)}")
-            traceback.print_exc()
-            QMessageBox.critical(self, "下载失败", f"错误: {str(e)}\n请尝试其他歌曲")
+        self.download_manager.enqueue([(self.current_source, self.current_song_id, self.current_song_name)])
     
-    def download_from_backup_api(self):
-        try:
-            # 创建downloads文件夹
-            if not os.path.exists("downloads"):
-                os.makedirs("downloads")
-            
-            # 获取歌曲URL
-            params = {"id": self.current_song_id}
-            print(f"请求备用API获取歌曲URL: {BACKUP_SONG_URL}?id={self.current_song_id}")
-            
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-                "Accept": "application/json"
-            }
-            
-            response = requests.get(BACKUP_SONG_URL, params=params, headers=headers, timeout=API_TIMEOUT).json()
-            
-            if response["code"] != 200:
-                raise Exception(f"获取歌曲URL失败: {response.get('msg', '未知错误')}")
-            
-            # 获取音乐URL
-            if not response["data"] or len(response["data"]) == 0:
-                raise Exception("未找到音乐资源")
-                
-            music_url = response["data"][0]["url"]
-            if not music_url:
-                raise Exception("此歌曲无法下载，可能需要VIP或版权受限")
-            
-            print(f"获取到音乐URL: {music_url}")
-            
-            # 下载歌曲，添加请求头
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-                "Accept": "*/*",
-                "Accept-Encoding": "gzip, deflate, br",
-                "Connection": "keep-alive",
-                "Referer": "https://music.163.com/"
-            }
-            
-            print("开始下载音乐文件...")
-            music_response = requests.get(music_url, headers=headers, timeout=API_TIMEOUT)
-            
-            if music_response.status_code != 200:
-                raise Exception(f"下载失败，状态码: {music_response.status_code}")
-                
-            print(f"下载完成，内容长度: {len(music_response.content)} 字节")
-            
-            # 从歌曲名提取信息
-            parts = self.current_song_name.split(' - ', 1)
-            song_title = parts[0]
-            artist = parts[1].split(' - ')[0] if ' - ' in parts[1] else parts[1]
-            
-            # 保存文件，使用更易辨别的命名方式
-            safe_song_name = f"{artist} - {song_title}.mp3"
-            safe_song_name = "".join(c for c in safe_song_name if c.isalnum() or c in (" ", ".", "_", "-")).rstrip()
-            target_path = os.path.join("downloads", safe_song_name)
-            
-            # 保存文件
-            with open(target_path, "wb") as file:
-                file.write(music_response.content)
-                
-            print(f"文件已保存: {target_path}")
-            
-            QMessageBox.information(self, "下载成功", f"歌曲已保存到 {target_path}")
-                
-        except requests.exceptions.Timeout:
-            print("备用API下载超时")
-            QMessageBox.critical(self, "下载失败", f"下载歌曲超时，请检查网络连接后重试")      
-        except Exception as e:
-            print(f"备用API下载失败: {str(e)}")
-            traceback.print_exc()
-            QMessageBox.critical(self, "下载失败", f"错误: {str(e)}\n请尝试其他歌曲")
+    def download_selected(self):
+        entries = self.selected_songs()
+        if not entries:
+            QMessageBox.information(self, "提示", "请先在列表中选择要下载的歌曲")
+            return
+        self.download_manager.enqueue(entries)
     
-    def fetch_lyrics(self, song_id):
-        try:
-            # 构造歌词API URL
-            lyrics_url = f"http://m.kuwo.cn/newh5/singles/songinfoandlrc?musicId={song_id}"
-            
-            # 发送请求
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
-            }
-            response = requests.get(lyrics_url, headers=headers)
-            
-            if response.status_code == 200:
-                data = response.json()
-                if "data" in data and "lrclist" in data["data"]:
-                    # 构建LRC格式歌词
-                    lrc_text = ""
-                    for item in data["data"]["lrclist"]:
-                        minute = int(float(item["time"]) // 60)
-                        second = float(item["time"]) % 60
-                        lrc_text += f"[{minute:02d}:{second:06.3f}]{item['lineLyric']}\n"
-                    
-                    # 设置歌词
-                    self.lyrics_widget.set_lyrics(lrc_text)
-                    return
-            
-            # 如果没有找到歌词或者请求失败
-            self.lyrics_widget.show_no_lyrics()
-        except Exception as e:
-            print(f"获取歌词出错: {e}")
-            self.lyrics_widget.show_no_lyrics()
+    def download_all(self):
+        # 已经加载的全部结果，滚动加载后可能有上千首，数量较多时先确认
+        count = self.song_model.rowCount()
+        if count > BULK_DOWNLOAD_CONFIRM and QMessageBox.question(
+                self, "下载全部", f"确定要下载列表中的 {count} 首歌曲吗？") != QMessageBox.Yes:
+            return
+        self.download_manager.enqueue([self.song_entry(self.song_model.index(row)) for row in range(count)])
     
-    def fetch_lyrics_from_backup(self, song_id):
-        try:
-            # 获取歌词
-            lyrics_url = f"https://api.music.imsyy.top/lyric?id={song_id}"
-            response = requests.get(lyrics_url).json()
-            
-            if response["code"] != 200:
-                self.lyrics_widget.show_no_lyrics()
-                return
-            
-            if "lrc" in response and "lyric" in response["lrc"]:
-                # 设置歌词
-                self.lyrics_widget.set_lyrics(response["lrc"]["lyric"])
-            else:
-                self.lyrics_widget.show_no_lyrics()
-                
-        except Exception as e:
-            print(f"获取歌词出错: {e}")
-            self.lyrics_widget.show_no_lyrics()
+    def on_download_changed(self, item):
+        if item is None:
+            # 整个队列重新显示
+            self.download_list.clear()
+            self.download_items = {}
+            for queued in self.download_manager.items.values():
+                self.show_download_item(queued)
+        else:
+            self.show_download_item(item)
+        
+        stats = self.download_manager.stats()
+        counts = stats["counts"]
+        total = sum(counts.values())
+        if not total:
+            summary = "下载队列为空"
+        else:
+            summary = f"已完成 {counts['done']}/{total}"
+            if counts["failed"]:
+                summary += f"，失败 {counts['failed']}"
+            if counts["active"]:
+                summary += f"，{format_size(stats['speed'])}/s"
+                if stats["eta"] is not None:
+                    summary += f"，剩余 {self.format_time(int(stats['eta']))}"
+        self.download_summary.setText(summary)
+        self.download_status.setText(summary if total and counts["done"] < total else "")
+    
+    def show_download_item(self, item):
+        text = f"[{DOWNLOAD_STATE_NAMES[item['state']]}] {item['song_name']}"
+        if item["state"] == "active" and item["total"]:
+            text += f"  {item['done'] * 100 // item['total']}%"
+        elif item["state"] in ("pending", "failed") and item["error"]:
+            text += f"  ({item['error']})"
+        
+        list_item = self.download_items.get(item["id"])
+        if list_item is None:
+            list_item = QListWidgetItem(text)
+            self.download_list.addItem(list_item)
+            self.download_items[item["id"]] = list_item
+        else:
+            list_item.setText(text)
     
     # 重写closeEvent以确保程序退出前清理资源
     def closeEvent(self, event):
         try:
-            if pygame.mixer.get_init():
-                pygame.mixer.quit()
-            
             # 停止所有计时器
-            self.visualizer_timer.stop()
-            
-            # 删除临时音乐文件
-            for filename in os.listdir('.'):
-                if filename.endswith('.mp3') and os.path.isfile(filename):
-                    try:
-                        os.remove(filename)
-                        print(f"已删除临时文件: {filename}")
-                    except:
-                        pass
-                        
+            self.frame_clock.stop()
+            self.fade_timer.stop()
+            self.search_timer.stop()
+            if self.analyzer_thread is not None:
+                self.analyzer_thread.quit()
+                self.analyzer_thread.wait(1000)
+            
+            # 播放器停止后引擎才能关闭本地转发服务
+            self.media_player.stop()
+            self.next_player.stop()
+            self.engine.shutdown()
         except Exception as e:
             print(f"程序关闭时出错: {str(e)}")
             traceback.print_exc()